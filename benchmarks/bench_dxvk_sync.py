@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Compare the legacy dircmp/copy2 DXVK sync against the manifest-indexed one.
+
+Builds a synthetic DXVK tree (x64 + x32) in a temporary directory and times
+a cold sync, a warm sync with nothing changed and a sync after one DLL was
+updated, for both implementations.
+
+    python benchmarks/bench_dxvk_sync.py --files 9 --size 4 --repeat 20
+"""
+from __future__ import annotations
+
+import argparse
+import filecmp
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "configgen"))
+
+from dcg import dirSync  # noqa: E402
+
+
+def legacy_sync(source_dir, dest_dir, manifest=None):
+    dcmp = filecmp.dircmp(source_dir, dest_dir)
+    for file in dcmp.diff_files + dcmp.left_only:
+        shutil.copy2(os.path.join(source_dir, file), os.path.join(dest_dir, file))
+
+
+def new_sync(source_dir, dest_dir, manifest):
+    dirSync.sync_directories(source_dir, dest_dir, manifest)
+
+
+def make_tree(root: Path, files: int, size_mb: int) -> None:
+    for arch in ("x64", "x32"):
+        arch_dir = root / "dxvk" / arch
+        arch_dir.mkdir(parents=True)
+        for i in range(files):
+            (arch_dir / f"d3d{i}.dll").write_bytes(os.urandom(size_mb * 1024 * 1024))
+
+
+def run_sync(impl, root: Path) -> float:
+    start = time.perf_counter()
+    for arch, target in (("x64", "system32"), ("x32", "syswow64")):
+        dest = root / "prefix" / "drive_c" / "windows" / target
+        dest.mkdir(parents=True, exist_ok=True)
+        impl(root / "dxvk" / arch, dest, root / "prefix" / f"dxvk-{arch}.manifest")
+    return time.perf_counter() - start
+
+
+def touch_one(root: Path) -> None:
+    dll = root / "dxvk" / "x64" / "d3d0.dll"
+    dll.write_bytes(os.urandom(dll.stat().st_size))
+
+
+def bench(name: str, impl, args) -> None:
+    cold, warm, changed = [], [], []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmp:
+            root = Path(tmp)
+            make_tree(root, args.files, args.size)
+            cold.append(run_sync(impl, root))
+            warm.append(run_sync(impl, root))
+            touch_one(root)
+            changed.append(run_sync(impl, root))
+
+    def fmt(samples):
+        return f"{statistics.median(samples) * 1000:9.2f} ms"
+
+    print(f"{name:<10} cold {fmt(cold)}   warm {fmt(warm)}   one-changed {fmt(changed)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=9, help="DLLs per architecture")
+    parser.add_argument("--size", type=int, default=4, help="size of each DLL in MiB")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--tmpdir", default=None, help="run on this filesystem (e.g. the SD card)")
+    args = parser.parse_args()
+
+    bench("legacy", legacy_sync, args)
+    bench("manifest", new_sync, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
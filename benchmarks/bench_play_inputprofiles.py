@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Per-launch cost of producing Play!'s inputprofiles/default.xml.
+
+"legacy" rebuilds the profile the way PlayGenerator used to (substring scan
+of GAME_MAPPING_RULES against the ROM path, then hundreds of SubElement
+calls). "cold" loads the compiled library from disk as a fresh launch does,
+"warm" is a lookup in an already loaded library. The outputs are checked to
+be byte-identical.
+
+    python benchmarks/bench_play_inputprofiles.py --repeat 200
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "configgen"))
+
+from generators.namco2x6 import playInputProfiles as profiles  # noqa: E402
+
+ROMS = [
+    "/userdata/roms/namco2x6/tekken4.zip",
+    "/userdata/roms/namco2x6/wanganmr.zip",
+    "/userdata/roms/namco2x6/prdgp03.zip",
+    "/userdata/roms/namco2x6/sbxc.zip",
+]
+
+
+def legacy_profile(rom: str, nplayers: int) -> bytes:
+    rule = None
+    for needle, _, _ in profiles.GAME_MAPPING_RULES:
+        if needle in rom:
+            rule = needle
+            break
+    return profiles.render_profile(rule, nplayers)
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        profiles.PROFILES_CACHE = Path(tmp)
+
+        start = time.perf_counter()
+        profiles.compile_library()
+        print(f"compile library      {(time.perf_counter() - start) * 1000:9.2f} ms (once per mapping change)")
+
+        for rom in ROMS:
+            assert profiles.profile_bytes(rom, 2) == legacy_profile(rom, 2), rom
+
+        def cold():
+            profiles._library = None
+            for rom in ROMS:
+                profiles.profile_bytes(rom, 2)
+
+        def warm():
+            for rom in ROMS:
+                profiles.profile_bytes(rom, 2)
+
+        def legacy():
+            for rom in ROMS:
+                legacy_profile(rom, 2)
+
+        n = len(ROMS)
+        print(f"legacy per launch    {timed(legacy, args.repeat) / n:9.1f} us")
+        print(f"library cold         {timed(cold, args.repeat) / n:9.1f} us")
+        print(f"library warm         {timed(warm, args.repeat) / n:9.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
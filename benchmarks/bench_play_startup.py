@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare Play! startup from the AppImage against its extracted runtime cache.
+
+Starts each candidate offscreen and times how long it takes until a process
+of its tree has mapped the library marking the end of startup (Qt widgets by
+default), then kills the tree. The AppImage is extracted first if needed.
+With --cold the page cache is dropped before every start, which needs root.
+
+    python benchmarks/bench_play_startup.py --repeat 5 --cold
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "configgen"))
+
+from dcg import appImageCache  # noqa: E402
+
+DEFAULT_APPIMAGE = "/userdata/system/dcg/emulators/play/play.AppImage"
+
+
+def tree(pid: int) -> list[int]:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children") as fp:
+                    pending.extend(int(child) for child in fp.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def mapped(pids: list[int], marker: str) -> bool:
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/maps") as fp:
+                if marker in fp.read():
+                    return True
+        except OSError:
+            continue
+    return False
+
+
+def drop_caches() -> None:
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as fp:
+        fp.write("3")
+
+
+def start(executable: Path, args: argparse.Namespace) -> float:
+    if args.cold:
+        drop_caches()
+    env = {**os.environ, "QT_QPA_PLATFORM": "offscreen"}
+    begin = time.perf_counter()
+    proc = subprocess.Popen([executable, *args.args], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    try:
+        while time.perf_counter() - begin < args.timeout:
+            if mapped(tree(proc.pid), args.ready):
+                return time.perf_counter() - begin
+            if proc.poll() is not None:
+                raise RuntimeError(f"{executable} exited with {proc.returncode} before mapping {args.ready}")
+            time.sleep(0.002)
+        raise RuntimeError(f"{executable} did not map {args.ready} within {args.timeout}s")
+    finally:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--appimage", type=Path, default=Path(DEFAULT_APPIMAGE))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="drop the page cache before each start (root)")
+    parser.add_argument("--ready", default="libQt5Widgets", help="library whose mapping ends startup")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("args", nargs="*", help="Play! arguments")
+    args = parser.parse_args()
+
+    extracted = appImageCache.extract(args.appimage)
+    for name, executable in (("appimage", args.appimage), ("extracted", extracted)):
+        samples = [start(executable, args) for _ in range(args.repeat)]
+        print(f"{name:<10} median {statistics.median(samples) * 1000:9.1f} ms   "
+              f"min {min(samples) * 1000:9.1f} ms   max {max(samples) * 1000:9.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare the Demul and Play setup steps run one after the other against the task graph.
+
+Runs generate() on the throwaway tree of harness.py, cold (freshly installed)
+and warm (configs already written), with the steps serialized as
+DCG_SERIAL_SETUP=1 does and then on the thread pool. For each it prints the
+median wall time of the setup, the sum of its steps and its critical path,
+the longest chain of steps waiting on each other, which is as fast as the
+graph can get. --delay adds that many ms to every file open, as a slow SD
+card or a cold page cache does.
+
+    python benchmarks/bench_setup_graph.py --repeat 20 --delay 2
+"""
+from __future__ import annotations
+
+import argparse
+import builtins
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+import harness  # must be imported before dcg and generators
+
+from dcg import taskGraph
+from generators.demul import demulGenerator
+from generators.namco2x6.playGenerator import PlayGenerator
+
+RESOLUTION = {"width": 1280, "height": 720}
+CONTROLLERS = [object(), object()]
+
+CASES = [
+    ("demul-naomi", "demul", demulGenerator.DemulGenerator, "naomi", "roms/naomi/mvsc2.zip"),
+    ("demul-hikaru", "demul", demulGenerator.DemulGenerator, "hikaru", "roms/hikaru/braveff.zip"),
+    ("play-arcade", "play", PlayGenerator, "namco2x6", "roms/namco2x6/tekken4.zip"),
+    ("play-disc", "play", PlayGenerator, "namco2x6", "roms/namco2x6/timecrs3.iso"),
+]
+
+
+def slow_open(delay_ms: float):
+    real_open = builtins.open
+
+    def open_(*args, **kwargs):
+        time.sleep(delay_ms / 1000)
+        return real_open(*args, **kwargs)
+
+    return open_
+
+
+def launch(generator, system_name: str, rom: str, graph: str, serial: bool) -> dict:
+    if serial:
+        os.environ[taskGraph.SERIAL_ENV] = "1"
+    else:
+        os.environ.pop(taskGraph.SERIAL_ENV, None)
+    # Play prints its command line
+    with contextlib.redirect_stderr(io.StringIO()):
+        generator().generate(harness.System(system_name), harness.USERDATA / rom, CONTROLLERS, {}, [], [], RESOLUTION)
+    return taskGraph.last_runs[graph]
+
+
+def bench(case: str, graph: str, generator, system_name: str, rom: str, args) -> None:
+    for phase in ("cold", "warm"):
+        for serial in (True, False):
+            runs = []
+            for _ in range(args.repeat):
+                os.chdir(harness.ROOT)
+                if phase == "cold":
+                    harness.build_tree()
+                harness.reset_process_state()
+                if phase == "warm":
+                    launch(generator, system_name, rom, graph, serial)
+                runs.append(launch(generator, system_name, rom, graph, serial))
+
+            def fmt(key):
+                return f"{statistics.median(run[key] for run in runs):8.2f} ms"
+
+            mode = "serial" if serial else "graph"
+            print(f"{case:<13} {phase:<5} {mode:<7} wall {fmt('wall_ms')}   steps {fmt('total_ms')}   critical path {fmt('critical_ms')}")
+            if args.steps:
+                for step in runs[0]["steps"]:
+                    print(f"{'':<28} {step:<14} {statistics.median(run['steps'][step] for run in runs):8.2f} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.0, help="ms added to every file open")
+    parser.add_argument("--steps", action="store_true", help="also print the median time of each step")
+    args = parser.parse_args()
+
+    demulGenerator.DXVK_DIR = harness.USR / "wine" / "dxvk"
+    if args.delay:
+        builtins.open = slow_open(args.delay)
+    for case in CASES:
+        bench(*case, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
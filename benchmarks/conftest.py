@@ -0,0 +1,105 @@
+"""pytest plumbing for the offline generator benchmarks, see harness.py.
+
+Every benchmark is compared against baselines.json and fails when it got
+slower than the wall-time tolerance or does noticeably more I/O. Refresh the
+baselines after an intended change with:
+
+    python -m pytest benchmarks -q --update-baselines
+"""
+from __future__ import annotations
+
+import dataclasses
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Final
+
+import pytest
+
+import harness  # must be imported before dcg and generators
+
+BASELINES: Final = Path(__file__).with_name("baselines.json")
+
+# wall time is noisy across machines, the I/O counters are not
+WALL_SLACK_MS: Final = 2.0
+COUNT_TOLERANCE: Final = 1.25
+COUNT_SLACK: Final = 4
+
+_results: dict[str, harness.Sample] = {}
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("dcg benchmarks")
+    group.addoption("--update-baselines", action="store_true", help="record the measured values in baselines.json")
+    group.addoption("--bench-repeat", type=int, default=20, help="launches measured per warm benchmark")
+    group.addoption("--bench-wall-tolerance", type=float, default=3.0, help="allowed wall time, as a multiple of the baseline")
+
+
+class Bench:
+    def __init__(self, config: pytest.Config) -> None:
+        self.repeat: int = config.getoption("--bench-repeat")
+        self.wall_tolerance: float = config.getoption("--bench-wall-tolerance")
+        self.update: bool = config.getoption("--update-baselines")
+        try:
+            self.baselines: dict[str, dict[str, Any]] = json.loads(BASELINES.read_text())
+        except (OSError, ValueError):
+            self.baselines = {}
+
+    def __call__(self, name: str, fn: Callable[[], Any], repeat: int | None = None) -> Any:
+        """Measure fn as repeat separate launches and check the median against the baseline."""
+        samples = []
+        for _ in range(repeat or self.repeat):
+            harness.reset_process_state()
+            result, sample = harness.measure(fn)
+            samples.append(sample)
+
+        summary = harness.Sample.median(samples)
+        _results[name] = summary
+        if not self.update:
+            self.check(name, summary)
+        return result
+
+    def check(self, name: str, sample: harness.Sample) -> None:
+        baseline = self.baselines.get(name)
+        if baseline is None:
+            return
+
+        regressions = []
+        if sample.wall_ms > baseline["wall_ms"] * self.wall_tolerance + WALL_SLACK_MS:
+            regressions.append(f"wall {sample.wall_ms:.2f} ms > baseline {baseline['wall_ms']:.2f} ms")
+        for counter in ("io_syscalls", "fs_ops", "bytes_written"):
+            if getattr(sample, counter) > baseline[counter] * COUNT_TOLERANCE + COUNT_SLACK:
+                regressions.append(f"{counter} {getattr(sample, counter)} > baseline {baseline[counter]}")
+        if regressions:
+            pytest.fail(f"{name} regressed: " + ", ".join(regressions))
+
+
+@pytest.fixture
+def bench(request: pytest.FixtureRequest) -> Bench:
+    return Bench(request.config)
+
+
+def pytest_terminal_summary(terminalreporter: Any, exitstatus: int, config: pytest.Config) -> None:
+    if not _results:
+        return
+    terminalreporter.section("dcg generate() per launch")
+    terminalreporter.write_line(f"{'benchmark':<24}{'wall ms':>10}{'io calls':>10}{'fs ops':>8}{'bytes':>10}")
+    for name, sample in sorted(_results.items()):
+        terminalreporter.write_line(
+            f"{name:<24}{sample.wall_ms:>10.2f}{sample.io_syscalls:>10}{sample.fs_ops:>8}{sample.bytes_written:>10}"
+        )
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus: int) -> None:
+    if session.config.getoption("--update-baselines") and _results:
+        try:
+            baselines = json.loads(BASELINES.read_text())
+        except (OSError, ValueError):
+            baselines = {}
+        for name, sample in _results.items():
+            baselines[name] = {key: round(value, 3) for key, value in dataclasses.asdict(sample).items()}
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    shutil.rmtree(harness.ROOT, ignore_errors=True)
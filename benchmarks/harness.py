@@ -0,0 +1,264 @@
+"""Throwaway /userdata and configgen stand-ins for the offline generator benchmarks.
+
+Importing this module points dcg.paths at a temporary tree through
+DCG_USERDATA and registers minimal replacements for the batocera configgen
+modules the generators import (Command, batoceraPaths, controller, Generator,
+exceptions, utils.configparser) and the Emulator dcg.prepare builds. Settings are served from a generated
+batocera.conf, the file batocera-settings-get reads. It has to be imported
+before any dcg or generators module, which conftest.py takes care of.
+"""
+from __future__ import annotations
+
+import configparser
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Final
+
+REPO: Final = Path(__file__).resolve().parent.parent
+ROOT: Final = Path(tempfile.mkdtemp(prefix="dcg-bench-"))
+USERDATA: Final = ROOT / "userdata"
+USR: Final = ROOT / "usr"
+
+os.environ["DCG_USERDATA"] = str(USERDATA)
+os.environ.pop("DCG_TRACE", None)
+os.environ.pop("DCG_TRACE_FILE", None)
+sys.path.insert(0, str(REPO / "configgen"))
+
+
+# ------------------------------------------------------------
+# configgen stand-ins
+# ------------------------------------------------------------
+
+@dataclass
+class Command:
+    array: list[Any]
+    env: dict[str, Any] = field(default_factory=dict)
+
+
+class Generator:
+    pass
+
+
+class BatoceraException(Exception):
+    pass
+
+
+class CaseSensitiveConfigParser(configparser.ConfigParser):
+    def optionxform(self, optionstr: str) -> str:
+        return optionstr
+
+
+def mkdir_if_not_exists(path: Path) -> None:
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+
+def configure_emulator(rom: Path) -> bool:
+    return False
+
+
+def generate_sdl_game_controller_config(controllers: Any) -> str:
+    return ""
+
+
+def _module(name: str, **attrs: Any) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def _install_configgen() -> None:
+    system = USERDATA / "system"
+    _module("configgen", __path__=[])
+    _module("configgen.Command", Command=Command)
+    _module(
+        "configgen.batoceraPaths",
+        CACHE=system / "cache",
+        CONFIGS=system / "configs",
+        SAVES=USERDATA / "saves",
+        DEFAULTS_DIR=REPO / "configs",
+        configure_emulator=configure_emulator,
+        mkdir_if_not_exists=mkdir_if_not_exists,
+    )
+    _module("configgen.controller", generate_sdl_game_controller_config=generate_sdl_game_controller_config)
+    _module("configgen.Emulator", Emulator=Emulator)
+    _module("configgen.exceptions", BatoceraException=BatoceraException)
+    _module("configgen.generators", __path__=[])
+    _module("configgen.generators.Generator", Generator=Generator)
+    _module("configgen.utils", __path__=[])
+    _module("configgen.utils.configparser", CaseSensitiveConfigParser=CaseSensitiveConfigParser)
+
+
+class SystemConfig(dict):
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self.get(key)
+        if value is None:
+            return default
+        return str(value).lower() in ("1", "true", "on", "yes")
+
+
+@dataclass
+class System:
+    name: str
+    config: SystemConfig = field(default_factory=SystemConfig)
+
+    def isOptSet(self, key: str) -> bool:
+        return key in self.config
+
+
+class Emulator(System):
+    def __init__(self, args: Any, rom: Path) -> None:
+        super().__init__(args.system, SystemConfig(emulator=args.emulator, core=args.core))
+
+
+_install_configgen()
+
+
+# ------------------------------------------------------------
+# /userdata tree
+# ------------------------------------------------------------
+
+BATOCERA_CONF: Final = """\
+system.language=en_US
+windows.wine-runner=wine-tkg
+global.esync=1
+dcg.prefetch.size=0
+"""
+
+DXVK_DLLS: Final = ("d3d9", "d3d10core", "d3d11", "dxgi")
+DXVK_DLL_SIZE: Final = 256 * 1024
+
+
+def build_tree() -> None:
+    """Recreate a freshly installed /userdata (and /usr/wine/dxvk) under ROOT."""
+    for path in (USERDATA, USR):
+        shutil.rmtree(path, ignore_errors=True)
+
+    system = USERDATA / "system"
+    system.mkdir(parents=True)
+    (system / "batocera.conf").write_text(BATOCERA_CONF)
+
+    # Demul as install.sh lays it out, configuration files only
+    demul = system / "dcg" / "emulators" / "demul"
+    demul.mkdir(parents=True)
+    for ini in (REPO / "emulators" / "demul").glob("*.ini*"):
+        shutil.copy2(ini, demul / ini.name)
+    shutil.copy2(REPO / "emulators" / "demul" / "arcade_compat.txt", demul / "arcade_compat.txt")
+
+    # an already provisioned Demul prefix, there is no wine to create one
+    prefix = system / "wine-bottles" / "demul"
+    for target in ("system32", "syswow64"):
+        (prefix / "drive_c" / "windows" / target).mkdir(parents=True)
+    (prefix / "init.done").write_text("init")
+    (system / "wine" / "custom" / "ge-custom" / "lib" / "wine").mkdir(parents=True)
+
+    # a complete Play! arcade set: dongle in the zip, CHD in the folder named after the game
+    namco2x6 = USERDATA / "roms" / "namco2x6"
+    (namco2x6 / "tekken4").mkdir(parents=True)
+    with zipfile.ZipFile(namco2x6 / "tekken4.zip", "w") as archive:
+        archive.writestr("tef3verc.ic002", bytes(128))
+    (namco2x6 / "tekken4" / "tef1dvd0.chd").write_bytes(bytes(4096))
+
+    for arch in ("x64", "x32"):
+        dxvk = USR / "wine" / "dxvk" / arch
+        dxvk.mkdir(parents=True)
+        for dll in DXVK_DLLS:
+            (dxvk / f"{dll}.dll").write_bytes((f"{arch}:{dll}".encode() * DXVK_DLL_SIZE)[:DXVK_DLL_SIZE])
+
+
+def reset_process_state() -> None:
+    """Forget what the dcg modules cached in memory, as a new launcher process would."""
+    from dcg import batoceraSettings, materialize
+    from generators.demul import arcadeCompat
+    from generators.namco2x6 import arcadeDefs, playInputProfiles
+
+    batoceraSettings._settings = None
+    materialize._fingerprints = None
+    arcadeCompat._compat = None
+    arcadeDefs._index = None
+    playInputProfiles._library = None
+
+
+# ------------------------------------------------------------
+# Measurement
+# ------------------------------------------------------------
+
+# filesystem and process operations raising an audit event, stat() does not
+AUDITED: Final = frozenset({
+    "open", "os.listdir", "os.scandir", "os.mkdir", "os.rename", "os.remove", "os.rmdir",
+    "os.link", "os.symlink", "os.truncate", "os.utime", "os.chmod", "os.chdir",
+    "shutil.copyfile", "shutil.copymode", "shutil.copystat", "fcntl.ioctl", "subprocess.Popen",
+})
+
+
+class _Audit:
+    active = False
+    count = 0
+
+    @classmethod
+    def hook(cls, event: str, args: tuple[Any, ...]) -> None:
+        if cls.active and event in AUDITED:
+            cls.count += 1
+
+
+sys.addaudithook(_Audit.hook)
+
+
+def _proc_io() -> dict[str, int]:
+    try:
+        with open("/proc/self/io") as fp:
+            return {key: int(value) for key, value in (line.split(":") for line in fp)}
+    except OSError:
+        return {}
+
+
+@dataclass
+class Sample:
+    wall_ms: float
+    io_syscalls: int
+    fs_ops: int
+    bytes_written: int
+
+    @classmethod
+    def median(cls, samples: list[Sample]) -> Sample:
+        return cls(
+            wall_ms=statistics.median(s.wall_ms for s in samples),
+            io_syscalls=int(statistics.median(s.io_syscalls for s in samples)),
+            fs_ops=int(statistics.median(s.fs_ops for s in samples)),
+            bytes_written=int(statistics.median(s.bytes_written for s in samples)),
+        )
+
+
+def measure(fn: Callable[[], Any]) -> tuple[Any, Sample]:
+    """Run fn once: wall time, read/write syscalls, audited fs operations and bytes written."""
+    before = _proc_io()
+    _Audit.count = 0
+    _Audit.active = True
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        wall = time.perf_counter() - start
+        _Audit.active = False
+    after = _proc_io()
+
+    def delta(key: str) -> int:
+        return after.get(key, 0) - before.get(key, 0)
+
+    return result, Sample(
+        wall_ms=wall * 1000,
+        io_syscalls=delta("syscr") + delta("syscw"),
+        fs_ops=_Audit.count,
+        bytes_written=delta("wchar"),
+    )
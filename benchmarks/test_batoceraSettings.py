@@ -0,0 +1,87 @@
+"""dcg.batoceraSettings: the precedence of batocera-settings-get, resolved in one pass."""
+from __future__ import annotations
+
+import os
+import pickle
+import subprocess
+
+import harness
+from dcg import batoceraSettings
+
+ADVANCED = (harness.REPO / "configs" / "advanced-arcade.conf").read_text()
+
+CONF = f"""\
+global.smooth=0
+namco2x6.smooth=1
+namco2x6["tekken4.zip"].smooth=2
+namco2x6.play_vsync=false
+windows.wine-runner=wine-tkg
+windows.wine-runner=ge-custom
+  # indented comment=ignored
+windows["My Game (v1.2).wine"].title=It's "$HOME" & more
+
+# --- ARCADE ADVANCED CONFIG START ---
+{ADVANCED}
+# --- ARCADE ADVANCED CONFIG END ---
+"""
+
+
+def _write(text: str) -> None:
+    harness.build_tree()
+    batoceraSettings.BATOCERA_CONF.write_text(text)
+    batoceraSettings._settings = None
+
+
+def test_precedence_matches_batocera_settings_get(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    _write(CONF)
+    get = batoceraSettings.get_setting
+
+    # system["game"].key, then system.key, then global.key
+    assert get("smooth", "namco2x6", "tekken4.zip") == "2"
+    assert get("smooth", "namco2x6", "sc2.zip") == "1"
+    assert get("smooth", "naomi", "mvsc2.zip") == "0"
+    assert get("missing", "naomi", "mvsc2.zip", default="x") == "x"
+    resolved = batoceraSettings.resolve("namco2x6", "tekken4.zip")
+    assert resolved["smooth"] == "2" and resolved["play_api"] == "1"
+
+    # a key repeated further down wins, as batocera-settings-get reads it
+    assert batoceraSettings.get("windows.wine-runner") == "ge-custom"
+    assert batoceraSettings.get("# indented comment") is None
+
+    # the section install.sh injects overrides what came before it
+    assert batoceraSettings.get("namco2x6.play_vsync") == "true"
+    assert batoceraSettings.get("namco2x6.bezel") == "none"
+
+
+def test_snapshot_follows_the_file(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    _write("global.a=1\n")
+    assert batoceraSettings.get("global.a") == "1"
+    st = batoceraSettings.BATOCERA_CONF.stat()
+
+    # same size and mtime: served from the snapshot without parsing
+    with batoceraSettings.SNAPSHOT_CACHE.open("wb") as fp:
+        pickle.dump(((st.st_size, st.st_mtime_ns), {"global.a": "cached"}), fp)
+    batoceraSettings._settings = None
+    assert batoceraSettings.get("global.a") == "cached"
+
+    # rewritten: the mtime moved, the file is parsed again
+    batoceraSettings.BATOCERA_CONF.write_text("global.a=2\n")
+    os.utime(batoceraSettings.BATOCERA_CONF, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    batoceraSettings._settings = None
+    assert batoceraSettings.get("global.a") == "2"
+
+
+def test_export_round_trips_through_bash(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    _write(CONF)
+    game = "My Game (v1.2).wine"
+    script = """
+    eval "$(python -m dcg.batoceraSettings export --system windows --game "$1" --raw windows.wine-runner --raw global.nothing)"
+    printf '%s\\n' "${DCG_SETTINGS[title]}" "${DCG_SETTINGS[wine-runner]}" "${DCG_SETTINGS_RAW[windows.wine-runner]}" \
+        "${DCG_SETTINGS_RAW[global.nothing]+set}" "$DCG_SETTINGS_LOADED"
+    """
+    env = {**os.environ, "PYTHONPATH": str(harness.REPO / "configgen")}
+    out = subprocess.run(["bash", "-c", script, "bash", game], env=env, capture_output=True, text=True, check=True).stdout
+    assert out.splitlines() == ["It's \"$HOME\" & more", "ge-custom", "ge-custom", "", "1"]
@@ -0,0 +1,58 @@
+"""dcg.biosStore: BIOS files stored once by hash, linked into /userdata/bios and checked."""
+from __future__ import annotations
+
+import shutil
+import zipfile
+
+import harness
+from dcg import biosStore
+
+
+def _status(result: dict) -> dict[str, str]:
+    return {file["file"]: file["status"] for file in result["files"]}
+
+
+def test_bios_are_deployed_once_then_left_alone(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    shutil.rmtree(harness.USERDATA / "bios", ignore_errors=True)
+    biosStore.STATE.unlink(missing_ok=True)
+    shutil.copytree(harness.REPO / "bios", biosStore.MANIFEST.parent)
+
+    result = biosStore.sync()
+    status = _status(result)
+    assert result["imported"] == 18 and result["mode"] == "hardlink"
+    assert [file for file, state in status.items() if state != "deployed"] == ["naomi.zip", "naomi2.zip", "awbios.zip"]
+    deployed = biosStore.BIOS / "hikaru" / "epr-21904.ic94"
+    assert deployed.stat().st_ino == biosStore.blob("d10d837bc7d68eb7125c34beffe21a91305627b0").stat().st_ino
+    assert not (biosStore.BIOS / "bios.zip").exists()
+
+    # nothing changed: nothing hashed, stored or written
+    stamp = biosStore.STATE.stat().st_mtime_ns
+    monkeypatch.setattr(biosStore.hashlib, "sha1", None)
+    result = biosStore.sync()
+    assert result["imported"] == 0 and set(_status(result).values()) == {"ok", "missing"}
+    assert biosStore.STATE.stat().st_mtime_ns == stamp
+    monkeypatch.undo()
+    monkeypatch.chdir(harness.ROOT)
+
+    # a corrupt dump is reported, then replaced; a repacked zip with the same members passes
+    deployed.unlink()
+    deployed.write_bytes(bytes(16))
+    mie = biosStore.BIOS / "mie.zip"
+    with zipfile.ZipFile(mie) as archive:
+        members = {name: archive.read(name) for name in archive.namelist()}
+    mie.unlink()
+    with zipfile.ZipFile(mie, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    assert _status(biosStore.sync(deploy=False))["hikaru/epr-21904.ic94"] == "mismatch"
+    status = _status(biosStore.sync())
+    assert (status["hikaru/epr-21904.ic94"], status["mie.zip"]) == ("replaced", "ok")
+    assert deployed.with_name("epr-21904.ic94.bad").read_bytes() == bytes(16)
+
+    # an empty store is filled again from the shipped packs when the loose files are gone
+    shutil.rmtree(biosStore.STORE)
+    shutil.rmtree(biosStore.SHIPPED / "Oric")
+    shutil.rmtree(biosStore.BIOS / "Oric")
+    assert _status(biosStore.sync(["oric"])) == {"Oric/basic11.rom": "deployed", "Oric/colour.rom": "deployed"}
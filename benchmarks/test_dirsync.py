@@ -0,0 +1,42 @@
+"""dcg.dirSync: files rewritten in place are synced again, their directory's mtime does not move."""
+from __future__ import annotations
+
+import os
+
+import harness
+from dcg import dirSync
+
+
+def _rewrite(path, data: bytes, mtime_ns: int) -> None:
+    with open(path, "r+b") as fp:
+        fp.write(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_in_place_rewrites_are_synced(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    source = harness.USR / "wine" / "dxvk" / "x64"
+    dest = harness.ROOT / "system32"
+    manifest = harness.ROOT / "dxvk-x64.manifest"
+    for path in (dest, manifest):
+        if path.is_dir():
+            for file in path.iterdir():
+                file.unlink()
+        else:
+            path.unlink(missing_ok=True)
+
+    assert dirSync.sync_directories(source, dest, manifest) == len(harness.DXVK_DLLS)
+    assert dirSync.sync_directories(source, dest, manifest) == 0
+
+    # wineboot recreating a DLL of the prefix, then a DLL of the runner replaced with cp
+    dll = f"{harness.DXVK_DLLS[0]}.dll"
+    source_mtime = os.stat(source).st_mtime_ns
+    _rewrite(dest / dll, b"wine builtin", 1_000_000_000)
+    assert dirSync.sync_directories(source, dest, manifest) == 1
+    assert (dest / dll).read_bytes() == (source / dll).read_bytes()
+
+    _rewrite(source / dll, b"new dxvk", 2_000_000_000)
+    assert os.stat(source).st_mtime_ns == source_mtime
+    assert dirSync.sync_directories(source, dest, manifest) == 1
+    assert (dest / dll).read_bytes()[:8] == b"new dxvk"
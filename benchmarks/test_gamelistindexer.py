@@ -0,0 +1,58 @@
+"""dcg.gamelistIndexer: gamelists from the shipped metadata, only what changed listed again."""
+from __future__ import annotations
+
+import shutil
+import xml.etree.ElementTree as ET
+
+import harness
+from dcg import gamelistIndexer
+
+
+def _games(system: str) -> dict[str, ET.Element]:
+    root = ET.parse(harness.USERDATA / "roms" / system / gamelistIndexer.GAMELIST).getroot()
+    return {game.findtext("path"): game for game in root.iter("game")}
+
+
+def test_gamelists_are_built_then_updated_incrementally(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    es_systems = harness.ROOT / "es_systems"
+    shutil.rmtree(es_systems, ignore_errors=True)
+    es_systems.mkdir()
+    for name in ("hikaru", "namco2x6"):
+        shutil.copy2(harness.REPO / "configs" / "emulationstations" / f"es_systems_{name}.cfg", es_systems)
+    hikaru = harness.USERDATA / "roms" / "hikaru"
+    (hikaru / "images").mkdir(parents=True)
+    (hikaru / "images" / "braveff-image.png").write_bytes(b"")
+    for rom in ("braveff.zip", "derbyo2k.zip", "more/sgnascar.zip"):
+        (hikaru / rom).parent.mkdir(parents=True, exist_ok=True)
+        (hikaru / rom).write_bytes(b"")
+
+    results = {r["system"]: r for r in gamelistIndexer.index(directory=es_systems)}
+    assert results["hikaru"]["games"] == 3 and results["hikaru"]["written"]
+    games = _games("hikaru")
+    assert games["./braveff.zip"].findtext("players") == "2"
+    assert games["./braveff.zip"].findtext("image") == "./images/braveff-image.png"
+    assert "Link unemulated" in games["./derbyo2k.zip"].findtext("desc")
+    assert "./more/sgnascar.zip" in games
+    assert _games("namco2x6")["./tekken4.zip"].findtext("name") == "Tekken 4"
+
+    # nothing changed: no directory listed, no gamelist read
+    results = {r["system"]: r for r in gamelistIndexer.index(directory=es_systems)}
+    assert results["hikaru"]["listed"] == 0 and not results["hikaru"]["written"]
+
+    # a scraper renamed a game and EmulationStation counted a play, then a ROM was added to a subfolder
+    gamelist = harness.USERDATA / "roms" / "hikaru" / gamelistIndexer.GAMELIST
+    tree = ET.parse(gamelist)
+    game = next(g for g in tree.getroot() if g.findtext("path") == "./braveff.zip")
+    game.find("name").text = "Brave Fire Fighters"
+    ET.SubElement(game, "playcount").text = "4"
+    tree.write(gamelist)
+    (hikaru / "more" / "airtrix.zip").write_bytes(b"")
+
+    result = gamelistIndexer.index(["hikaru"], directory=es_systems)[0]
+    assert (result["games"], result["listed"], result["changed"]) == (4, 1, 1)
+    games = _games("hikaru")
+    assert games["./braveff.zip"].findtext("name") == "Brave Fire Fighters"
+    assert games["./braveff.zip"].findtext("playcount") == "4"
+    assert "./more/airtrix.zip" in games
@@ -0,0 +1,99 @@
+"""Per-launch cost of each generate() path, checked against baselines.json.
+
+"cold" is the first launch on a freshly installed tree, "warm" a launch whose
+configuration files were already materialized by a previous one.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+import harness
+import pytest
+
+from configgen.exceptions import BatoceraException
+from generators.demul import demulGenerator
+from generators.namco2x6.playGenerator import PlayGenerator
+from generators.wine.wineGenerator import WineGenerator
+
+RESOLUTION = {"width": 1280, "height": 720}
+CONTROLLERS = [object(), object()]
+
+CASES = [
+    pytest.param(demulGenerator.DemulGenerator, "naomi", "roms/naomi/mvsc2.zip", id="demul-naomi"),
+    pytest.param(demulGenerator.DemulGenerator, "hikaru", "roms/hikaru/braveff.zip", id="demul-hikaru"),
+    pytest.param(demulGenerator.DemulGenerator, "gaelco", "roms/gaelco/chase.zip", id="demul-gaelco"),
+    pytest.param(demulGenerator.DemulGenerator, "dreamcast", "roms/dreamcast/sonic.chd", id="demul-dc"),
+    pytest.param(PlayGenerator, "namco2x6", "roms/namco2x6/tekken4.zip", id="play-arcade"),
+    pytest.param(PlayGenerator, "namco2x6", "roms/namco2x6/timecrs3.iso", id="play-disc"),
+    pytest.param(WineGenerator, "windows_installers", "roms/windows_installers/setup.exe", id="wine-installer"),
+    pytest.param(WineGenerator, "windows", "roms/windows/Game.wine", id="wine-play"),
+]
+
+
+@pytest.mark.parametrize("phase", ["cold", "warm"])
+@pytest.mark.parametrize(("generator", "system_name", "rom"), CASES)
+def test_generate(request, bench, monkeypatch, generator, system_name, rom, phase):
+    harness.build_tree()
+    monkeypatch.chdir(harness.ROOT)
+    monkeypatch.setattr(demulGenerator, "DXVK_DIR", harness.USR / "wine" / "dxvk")
+
+    system = harness.System(system_name)
+    rom = harness.USERDATA / rom
+
+    def launch():
+        return generator().generate(system, rom, CONTROLLERS, {}, [], [], RESOLUTION)
+
+    case = request.node.callspec.id.rsplit("-", 1)[0]
+    if phase == "cold":
+        command = bench(f"{case}/cold", launch, repeat=1)
+    else:
+        harness.reset_process_state()
+        launch()
+        command = bench(f"{case}/warm", launch)
+
+    assert command.array
+
+
+def test_play_preflight_rejects_incomplete_set(bench):
+    harness.build_tree()
+    (harness.USERDATA / "roms" / "namco2x6" / "tekken4" / "tef1dvd0.chd").unlink()
+    system = harness.System("namco2x6")
+    rom = harness.USERDATA / "roms" / "namco2x6" / "tekken4.zip"
+
+    def launch():
+        with pytest.raises(BatoceraException, match="tef1dvd0.chd"):
+            PlayGenerator().generate(system, rom, CONTROLLERS, {}, [], [], RESOLUTION)
+
+    bench("play-missing-chd/fail", launch)
+    assert not (harness.USERDATA / "system" / "configs" / "play").exists()
+
+
+def test_demul_rejects_broken_set(bench):
+    harness.build_tree()
+    system = harness.System("naomi")
+    rom = harness.USERDATA / "roms" / "naomi" / "derbyo2k.zip"
+
+    def launch():
+        with pytest.raises(BatoceraException, match="link unemulated"):
+            demulGenerator.DemulGenerator().generate(system, rom, CONTROLLERS, {}, [], [], RESOLUTION)
+
+    bench("demul-broken/fail", launch)
+    assert not (harness.USERDATA / "system" / "wine-bottles" / "demul" / "dxvk-x64.manifest").exists()
+
+
+def test_demul_shader_cache_per_game(bench, monkeypatch):
+    harness.build_tree()
+    monkeypatch.setattr(demulGenerator, "DXVK_DIR", harness.USR / "wine" / "dxvk")
+    system = harness.System("naomi")
+
+    def launch(name):
+        rom = harness.USERDATA / "roms" / "naomi" / name
+        return demulGenerator.DemulGenerator().generate(system, rom, CONTROLLERS, {}, [], [], RESOLUTION).env
+
+    mvsc2 = launch("mvsc2.zip")["DXVK_STATE_CACHE_PATH"]
+    (Path(mvsc2) / "Demul.dxvk-cache").write_bytes(b"warm")
+
+    env = bench("demul-shader-cache/warm", lambda: launch("mvsc2.zip"))
+    assert env["DXVK_STATE_CACHE_PATH"] == mvsc2
+    assert "/demul/mvsc2/" in mvsc2
+    assert launch("braveff.zip")["DXVK_STATE_CACHE_PATH"] != mvsc2
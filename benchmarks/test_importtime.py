@@ -0,0 +1,69 @@
+"""Import cost of each dcg generator, paid by every launch before generate() runs.
+
+Each generator is imported in a fresh interpreter under -X importtime, after
+the harness and the stdlib modules emulatorlauncher has already loaded by
+then. Its cumulative import time is held to a budget and the modules only
+the command line helpers need must stay out of it.
+"""
+from __future__ import annotations
+
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Final
+
+import pytest
+
+from dcg import registry
+
+BENCHMARKS: Final = Path(__file__).resolve().parent
+
+# cumulative import time, ms
+IMPORT_BUDGET_MS: Final = {"demul": 40.0, "play": 50.0, "wine": 30.0}
+RUNS: Final = 5
+
+# loaded by configgen's emulatorlauncher before it asks for a generator
+LAUNCHER_PRELOADED: Final = ("json", "logging", "subprocess")
+
+# imported by the dcg command lines and the rare paths that use them, never by a launch
+DEFERRED: Final = frozenset({"argparse", "tarfile", "ctypes", "statistics", "yaml"})
+
+
+def _import(module: str) -> tuple[float, set[str]]:
+    """Cumulative import time of module in ms and the modules it pulled in."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import harness, {', '.join(LAUNCHER_PRELOADED)}\nimport {module}"],
+        cwd=BENCHMARKS, capture_output=True, text=True, check=True,
+    )
+    lines = [line.split("|") for line in proc.stderr.splitlines() if line.startswith("import time:")]
+    names = [name.strip() for _, _, name in lines[1:]]
+    after_preload = names[names.index(LAUNCHER_PRELOADED[-1]) + 1:]
+    cumulative = next(int(us) for _, us, name in lines[1:] if name.strip() == module)
+    return cumulative / 1000, set(after_preload)
+
+
+@pytest.mark.parametrize("emulator", sorted(registry.GENERATORS))
+def test_generator_import_budget(emulator):
+    module = registry.GENERATORS[emulator][0]
+    runs = [_import(module) for _ in range(RUNS)]
+    elapsed = statistics.median(ms for ms, _ in runs)
+    imported = runs[0][1]
+
+    assert not imported & DEFERRED, f"{module} imports {sorted(imported & DEFERRED)}"
+    others = {m for e, (m, _) in registry.GENERATORS.items() if e != emulator}
+    assert not imported & others, f"{module} imports other generators"
+    assert elapsed <= IMPORT_BUDGET_MS[emulator], f"{module} takes {elapsed:.1f} ms to import"
+
+
+def test_registry_imports_only_the_selected_generator():
+    code = (
+        "import sys, harness\n"
+        "from dcg import registry\n"
+        "registry.get_generator('play')\n"
+        "print(' '.join(sorted(m for m in sys.modules if m.startswith('generators.'))))\n"
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=BENCHMARKS, capture_output=True, text=True, check=True)
+    loaded = set(proc.stdout.split())
+    assert registry.GENERATORS["play"][0] in loaded
+    assert not loaded & {registry.GENERATORS[e][0] for e in ("demul", "wine")}
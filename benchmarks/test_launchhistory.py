@@ -0,0 +1,71 @@
+"""dcg.launchHistory: launch records spooled by the launcher, stored in batches and reported."""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+
+import harness
+from dcg import launchHistory, tracing
+
+
+class Generator:
+    def generate(self, system, rom, *args):
+        with tracing.span("fake.config"):
+            launchHistory.cache("shader", False)
+        return rom
+
+
+def _spool(records: list[dict]) -> None:
+    launchHistory.SPOOL.parent.mkdir(parents=True, exist_ok=True)
+    with launchHistory.SPOOL.open("a") as fp:
+        fp.writelines(json.dumps(record) + "\n" for record in records)
+
+
+def test_launch_record_is_spooled_then_stored(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    monkeypatch.setattr(launchHistory, "INGEST_EVERY", 1000)
+    monkeypatch.setattr(tracing, "_listeners", [])
+    monkeypatch.delenv(launchHistory.NOTES_ENV, raising=False)
+
+    launchHistory.begin("hikaru", "demul", "demul", "/userdata/roms/hikaru/braveff.zip")
+    generator = Generator()
+    launchHistory.watch(generator)
+    generator.generate(None, "braveff.zip")
+    # what batocera-wine and the dcg helpers it starts add
+    with open(os.environ[launchHistory.NOTES_ENV], "a") as fp:
+        fp.write('{"phase":"provision","ms":12}\n{"note":{"runner":"ge-custom"}}\n{"cache":"mount_stack","hit":true}\n')
+    launchHistory.finish(3)
+
+    assert not launchHistory.HISTORY_DB.exists()
+    assert launchHistory.ingest() == 1
+    assert launchHistory.ingest() == 0
+    conn = launchHistory.connect()
+    row = conn.execute("SELECT * FROM launches").fetchone()
+    conn.close()
+    assert (row["system"], row["game"], row["runner"], row["exit_code"]) == ("hikaru", "braveff", "ge-custom", 3)
+    assert json.loads(row["caches"]) == {"shader": False, "mount_stack": True}
+    assert {"fake.config", "provision"} <= set(json.loads(row["phases"]))
+    assert row["latency_ms"] is not None and row["session_s"] is not None
+
+
+def test_report_flags_regressions_and_failing_games(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    shutil.rmtree(launchHistory.HISTORY_DB.parent, ignore_errors=True)
+    base = {"system": "namco2x6", "emulator": "play", "exit_code": 0, "phases": {}, "caches": {}}
+    records = []
+    for i, (version, latency) in enumerate([("r1", 400), ("r1", 420), ("r2", 900), ("r2", 950), ("r2", 880)]):
+        records.append({**base, "rom": "/roms/tekken4.zip", "started": i, "version": version, "latency_ms": latency})
+    for i, code in enumerate([0, 1, 134, 0, 1]):
+        records.append({**base, "rom": "/roms/sc2.zip", "started": 10 + i, "version": "r2", "latency_ms": 300, "exit_code": code})
+    _spool(records)
+
+    report = launchHistory.report()
+    assert report["launches"] == 10
+    latency = {entry["game"]: entry for entry in report["latency"]}
+    assert (latency["tekken4"]["p50_ms"], latency["tekken4"]["p95_ms"]) == (880, 950)
+    assert latency[None]["launches"] == 10
+    assert [(r["game"], r["before_ms"], r["after_ms"]) for r in report["regressions"]] == [("tekken4", 410, 900)]
+    assert [(f["game"], f["failed"], f["last_exit"]) for f in report["failures"]] == [("sc2", 3, 1)]
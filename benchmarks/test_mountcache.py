@@ -0,0 +1,31 @@
+"""dcg.mountCache: stacks of dead launches become idle, the trim outlives the supervised game."""
+from __future__ import annotations
+
+import os
+import types
+
+import harness
+from dcg import mountCache, supervisor
+
+
+def test_reused_pid_does_not_hold_a_stack():
+    pid = os.getpid()
+    started = mountCache._start_time(pid)
+    assert started is not None
+    stacks = {
+        "/var/run/wine/a": {"overlay": "/var/run/wine/a", "pid": pid, "started": started, "last_used": 1},
+        # SIGKILLed before release, its pid now belongs to another process
+        "/var/run/wine/b": {"overlay": "/var/run/wine/b", "pid": pid, "started": started - 1, "last_used": 2},
+        # recorded before start times were
+        "/var/run/wine/c": {"overlay": "/var/run/wine/c", "pid": pid, "last_used": 3},
+    }
+    assert [stack["overlay"] for stack in mountCache._idle(stacks)] == ["/var/run/wine/b"]
+
+
+def test_trim_in_background_is_handed_off(monkeypatch):
+    handoff = harness.ROOT / "mountcache.handoff"
+    handoff.unlink(missing_ok=True)
+    monkeypatch.setenv(supervisor.HANDOFF_ENV, str(handoff))
+    monkeypatch.setattr(mountCache.subprocess, "Popen", lambda *args, **kwargs: types.SimpleNamespace(pid=4242))
+    mountCache.trim_in_background()
+    assert handoff.read_text() == "4242\n"
@@ -0,0 +1,54 @@
+"""dcg.prefixTemplates: prefixes created as overlays of their template."""
+from __future__ import annotations
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import harness
+from dcg import prefixTemplates
+
+
+def test_overlay_prefix_leaves_the_template_alone(monkeypatch):
+    runner = harness.ROOT / "runners" / "wine-tkg"
+    shutil.rmtree(harness.ROOT / "runners", ignore_errors=True)
+    (runner / "bin").mkdir(parents=True)
+    (runner / "bin" / "wineserver").write_bytes(b"wineserver")
+    template = prefixTemplates.template_path(runner)
+    shutil.rmtree(prefixTemplates.PREFIX_TEMPLATES, ignore_errors=True)
+    (template / "drive_c" / "windows" / "system32").mkdir(parents=True)
+    (template / "drive_c" / "windows" / "system32" / "msvcp140.dll").write_bytes(b"template")
+    (template / prefixTemplates.TEMPLATE_INFO).write_text(json.dumps({"runner": str(runner), "fingerprint": "old"}))
+
+    bottles = prefixTemplates.WINE_BOTTLES / "windows"
+    shutil.rmtree(bottles, ignore_errors=True)
+    bottles.mkdir(parents=True)
+    dest = bottles / "game.wine"
+    monkeypatch.setattr(prefixTemplates.batoceraSettings, "get", lambda key, default=None: "overlay")
+    try:
+        prefixTemplates.overlay_prefix(template, harness.ROOT / "probe")
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("overlayfs cannot be mounted here")
+    subprocess.run(["umount", str(harness.ROOT / "probe")], check=True)
+    shutil.rmtree(prefixTemplates.overlay_dir(harness.ROOT / "probe"))
+
+    try:
+        assert prefixTemplates.create_prefix(dest, runner, runner / "bin" / "wine")
+        # an installer rewriting a DLL in place
+        with (dest / "drive_c" / "windows" / "system32" / "msvcp140.dll").open("r+b") as fp:
+            fp.write(b"game's")
+        assert (template / "drive_c" / "windows" / "system32" / "msvcp140.dll").read_bytes() == b"template"
+        upper = prefixTemplates.overlay_dir(dest) / "upper"
+        assert [path.name for path in upper.rglob("*") if path.is_file()] == ["msvcp140.dll"]
+
+        # stale, but the prefix sits on it
+        assert prefixTemplates.gc_templates() == []
+
+        # after a reboot
+        subprocess.run(["umount", str(dest)], check=True)
+        assert prefixTemplates.create_prefix(dest, runner, runner / "bin" / "wine")
+        assert (dest / "drive_c" / "windows" / "system32" / "msvcp140.dll").read_bytes() == b"game'ste"
+    finally:
+        subprocess.run(["umount", str(dest)], stderr=subprocess.DEVNULL)
@@ -0,0 +1,42 @@
+"""dcglauncher --prepare over a small library, each game dry run in a forked worker."""
+from __future__ import annotations
+
+import shutil
+
+import harness
+from dcg import prepare, shaderCache
+from generators.demul import demulGenerator
+
+ES_CONFIGS = ("hikaru", "namco2x6", "arcadepc", "cps1")
+
+
+def test_prepare_reports_every_dcg_game(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    monkeypatch.setattr(demulGenerator, "DXVK_DIR", harness.USR / "wine" / "dxvk")
+
+    es_systems = harness.ROOT / "es_systems"
+    es_systems.mkdir(exist_ok=True)
+    for name in ES_CONFIGS:
+        shutil.copy2(harness.REPO / "configs" / "emulationstations" / f"es_systems_{name}.cfg", es_systems)
+    roms = harness.USERDATA / "roms"
+    for rom in ("hikaru/braveff.zip", "hikaru/derbyo2k.zip", "cps1/sf2.zip", "hikaru/images/braveff.zip"):
+        (roms / rom).parent.mkdir(parents=True, exist_ok=True)
+        (roms / rom).write_bytes(b"")
+    (roms / "arcadepc" / "Game.wine").mkdir(parents=True)
+
+    report = prepare.run(jobs=2, scan=False, directory=es_systems)
+    status = {(game["system"], game["rom"].rsplit("/", 1)[1]): game for game in report["games"]}
+
+    assert sorted(status) == [
+        ("arcadepc", "Game.wine"), ("hikaru", "braveff.zip"), ("hikaru", "derbyo2k.zip"), ("namco2x6", "tekken4.zip"),
+    ]
+    assert status["hikaru", "derbyo2k.zip"]["status"] == "fail"
+    assert "BatoceraException" in status["hikaru", "derbyo2k.zip"]["error"]
+    assert all(game["status"] == "pass" for key, game in status.items() if key[1] != "derbyo2k.zip")
+    assert report["summary"] == {"games": 4, "passed": 3, "failed": 1}
+
+    # the dry runs left the files a launch reads, without counting as launches
+    assert (harness.USERDATA / "system" / "configs" / "play" / "Play Data Files" / "config.xml").exists()
+    assert shaderCache.stats()["partitions"]
+    assert all(p["launches"] == 0 for p in shaderCache.stats()["partitions"])
@@ -0,0 +1,55 @@
+"""dcg.romScanner: damaged ROMs are reported as corrupt, they never abort the scan."""
+from __future__ import annotations
+
+import struct
+import zipfile
+
+import harness
+from dcg import romScanner
+
+
+def _corrupt_zip(path):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mpr-23000.ic1", bytes(range(256)) * 64)
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo("mpr-23000.ic1")
+    with open(path, "r+b") as fp:
+        fp.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", fp.read(4))
+        # deflate block type 3 does not exist, zlib.error rather than a CRC mismatch
+        fp.seek(info.header_offset + 30 + name_length + extra_length)
+        fp.write(b"\xff" * 8)
+
+
+def _truncated_chd(path):
+    header = bytearray(124)
+    header[:16] = romScanner.CHD_MAGIC + struct.pack(">II", 124, 5)
+    # uncompressed, 64 hunks of 4 KiB mapped at the end of the header
+    header[32:56] = struct.pack(">3Q", 64 * 4096, 124, 0)
+    header[56:60] = struct.pack(">I", 4096)
+    path.write_bytes(bytes(header) + b"\0" * 100)
+
+
+def test_corrupt_zip_and_truncated_chd(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    romScanner.SCAN_CACHE.unlink(missing_ok=True)
+    naomi = romScanner.ROMS / "naomi"
+    naomi.mkdir(parents=True, exist_ok=True)
+    for rom in naomi.iterdir():
+        if rom.is_file():
+            rom.unlink()
+
+    _corrupt_zip(naomi / "broken.zip")
+    _truncated_chd(naomi / "broken.chd")
+    with zipfile.ZipFile(naomi / "good.zip", "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("epr-21576.ic27", b"\x55" * 4096)
+
+    assert romScanner.check_file(str(naomi / "broken.zip"))["status"] == "corrupt"
+    chd = romScanner.check_file(str(naomi / "broken.chd"))
+    assert chd["status"] == "corrupt" and "truncated" in chd["error"]
+
+    report = romScanner.scan(("naomi",), jobs=1)
+    status = {file["path"].rsplit("/", 1)[1]: file["status"] for file in report["files"]}
+    assert status == {"broken.chd": "corrupt", "broken.zip": "corrupt", "good.zip": "ok"}
+    assert report["summary"]["corrupt"] == 2
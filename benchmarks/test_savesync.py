@@ -0,0 +1,88 @@
+"""dcg.saveSync: block level sync and deduplicated save snapshots."""
+from __future__ import annotations
+
+import os
+import shutil
+
+import harness
+from dcg import saveSync
+
+
+def _tree(name: str):
+    path = harness.ROOT / name
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    return path
+
+
+def _touch(path, data: bytes, mtime: int) -> None:
+    path.write_bytes(data)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_sync_writes_only_what_changed():
+    source, dest = _tree("saves-src"), _tree("saves-dest")
+    (source / "slot").mkdir()
+    state = os.urandom(6 * saveSync.BLOCK)
+    _touch(source / "game.sts", state, 1_000_000_000)
+    _touch(source / "slot" / "card.mcd", b"card", 1_000_000_000)
+
+    assert saveSync.sync(source, dest)["copied"] == 2
+    assert saveSync.sync(source, dest)["copied"] == 0
+
+    # one block of the save state changed, a file went away
+    changed = state[:2 * saveSync.BLOCK] + bytes(saveSync.BLOCK) + state[3 * saveSync.BLOCK:]
+    _touch(source / "game.sts", changed, 2_000_000_000)
+    (source / "slot" / "card.mcd").unlink()
+    stats = saveSync.sync(source, dest)
+    assert (stats["copied"], stats["blocks"], stats["removed"]) == (1, 1, 1)
+    assert (dest / "game.sts").read_bytes() == changed
+    assert (dest / "game.sts").stat().st_mtime_ns == 2_000_000_000
+    assert not (dest / "slot" / "card.mcd").exists()
+
+
+def test_sync_rewrites_a_copy_changed_since():
+    source, dest = _tree("saves-src"), _tree("saves-dest")
+    state = os.urandom(6 * saveSync.BLOCK)
+    _touch(source / "game.sts", state, 1_000_000_000)
+    saveSync.sync(source, dest)
+
+    # the game saved through its symlink into dest, same size, then the source changed one block
+    _touch(dest / "game.sts", os.urandom(6 * saveSync.BLOCK), 1_500_000_000)
+    changed = state[:saveSync.BLOCK] + bytes(saveSync.BLOCK) + state[2 * saveSync.BLOCK:]
+    _touch(source / "game.sts", changed, 2_000_000_000)
+    stats = saveSync.sync(source, dest)
+    assert (stats["copied"], stats["blocks"]) == (1, 0)
+    assert (dest / "game.sts").read_bytes() == changed
+
+    # untouched since, block copies again
+    _touch(source / "game.sts", state, 3_000_000_000)
+    assert saveSync.sync(source, dest)["blocks"] == 1
+    assert (dest / "game.sts").read_bytes() == state
+
+
+def test_snapshots_share_blocks_and_stay_bounded(monkeypatch):
+    monkeypatch.setattr(saveSync, "_history", lambda: 2)
+    saves = _tree("saves-game")
+    shutil.rmtree(saveSync.SNAPSHOTS, ignore_errors=True)
+    state = os.urandom(3 * saveSync.BLOCK)
+    _touch(saves / "mvsc2.sts", state, 1_000_000_000)
+    _touch(saves / "other.sts", b"not this game", 1_000_000_000)
+    objects = saveSync._game_root("demul", "mvsc2") / "objects"
+
+    first = saveSync.snapshot("demul", "mvsc2", {"sstates": saves}, match="mvsc2")
+    assert first and len(list(objects.glob("*/*"))) == 3
+    assert saveSync.snapshot("demul", "mvsc2", {"sstates": saves}, match="mvsc2") is None
+
+    for n, mtime in enumerate((2_000_000_000, 3_000_000_000), 1):
+        _touch(saves / "mvsc2.sts", state[:saveSync.BLOCK] + bytes([n]) * saveSync.BLOCK + state[2 * saveSync.BLOCK:], mtime)
+        assert saveSync.snapshot("demul", "mvsc2", {"sstates": saves}, match="mvsc2")
+
+    # the first snapshot was pruned with the block only it used
+    history = saveSync.snapshots("demul", "mvsc2")
+    assert len(history) == 2 and first not in {entry["id"] for entry in history}
+    assert len(list(objects.glob("*/*"))) == 4
+
+    restored = _tree("saves-restored")
+    assert saveSync.restore("demul", "mvsc2", history[0]["id"], {"sstates": restored}) == 1
+    assert (restored / "mvsc2.sts").read_bytes()[saveSync.BLOCK:2 * saveSync.BLOCK] == bytes([1]) * saveSync.BLOCK
@@ -0,0 +1,46 @@
+"""dcg.supervisor: an emulator still starts when its cgroup cannot take it."""
+from __future__ import annotations
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+
+import harness
+from dcg import supervisor
+
+
+def test_spawn_falls_back_to_the_subreaper():
+    # no cgroup.procs there, the preexec fails in the child
+    tracker = supervisor._Cgroup(harness.ROOT / "no-such-cgroup")
+    child, tracker = supervisor._spawn(tracker, "demul", [sys.executable, "-c", "raise SystemExit(3)"])
+    assert tracker.kind == "subreaper"
+    assert child.wait() == 3
+
+
+def test_handed_off_helper_survives_the_teardown():
+    root = harness.ROOT / "supervisor"
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    # a game script leaving two helpers behind, the first one handed off as mountCache does
+    game = (
+        f"sleep 30 & echo $! > {root}/kept; echo $! >> \"${supervisor.HANDOFF_ENV}\";"
+        f"sleep 30 & echo $! > {root}/other"
+    )
+    script = (
+        "import sys; from pathlib import Path; from dcg import supervisor;"
+        f"supervisor.SUPERVISOR_STATE = Path({str(root / 'state.json')!r});"
+        "sys.exit(supervisor.main(sys.argv[1:]))"
+    )
+    env = {**os.environ, **supervisor.SUPERVISOR_ENV}
+    subprocess.run([sys.executable, "-c", script, "run", "--name", "test", "--deadline", "1", "--", "sh", "-c", game],
+                   env=env, check=True, timeout=20)
+
+    kept, other = (int((root / name).read_text()) for name in ("kept", "other"))
+    try:
+        assert not os.path.exists(f"/proc/{other}")
+        assert os.path.exists(f"/proc/{kept}")
+        assert not list(root.glob("*.handoff"))
+    finally:
+        os.kill(kept, signal.SIGKILL)
@@ -0,0 +1,96 @@
+"""dcg.taskGraph: setup steps overlapping, failures and timeouts surfacing, the serial fallback."""
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import harness
+from dcg import taskGraph
+
+
+def test_independent_steps_overlap_and_dependents_wait():
+    graph = taskGraph.TaskGraph("test")
+    both = threading.Barrier(2, timeout=5)
+
+    def meet(name):
+        both.wait()
+        return name
+
+    graph.add("a", lambda: meet("a"))
+    graph.add("b", lambda: meet("b"))
+    graph.add("c", lambda: graph.results["a"] + graph.results["b"], after=["a", "b"])
+    # a and b only get past the barrier together
+    assert graph.run(serial=False) == {"a": "a", "b": "b", "c": "ab"}
+    run = taskGraph.last_runs["test"]
+    assert run["critical_ms"] <= run["total_ms"] and set(run["steps"]) == {"a", "b", "c"}
+
+    with pytest.raises(ValueError, match="undeclared"):
+        graph.add("d", lambda: None, after=["e"])
+
+
+def test_failure_skips_dependents_and_keeps_its_exception():
+    ran = []
+    graph = taskGraph.TaskGraph("test")
+    graph.add("config", lambda: 1 / 0)
+    graph.add("other", lambda: ran.append("other"))
+    graph.add("uses_config", lambda: ran.append("uses_config"), after=["config"])
+    with pytest.raises(ZeroDivisionError):
+        graph.run(serial=False)
+    assert "uses_config" not in ran
+
+
+def test_timeout_and_serial_fallback(monkeypatch):
+    graph = taskGraph.TaskGraph("test")
+    release = threading.Event()
+    graph.add("stuck", lambda: release.wait(5), timeout=0.05)
+    start = time.monotonic()
+    with pytest.raises(taskGraph.StepTimeout, match="stuck"):
+        graph.run(serial=False)
+    assert time.monotonic() - start < 2
+    release.set()
+
+    order = []
+    graph = taskGraph.TaskGraph("test")
+    for name in ("a", "b", "c"):
+        graph.add(name, lambda name=name: order.append((name, threading.current_thread() is threading.main_thread())))
+    monkeypatch.setenv(taskGraph.SERIAL_ENV, "1")
+    graph.run()
+    assert order == [("a", True), ("b", True), ("c", True)]
+
+
+def test_timed_out_step_is_cancelled_and_never_joined():
+    graph = taskGraph.TaskGraph("test")
+    children = []
+
+    def hang():
+        # as prefix_init runs wine: bounded by what is left of the step's timeout
+        assert 0 < taskGraph.remaining() <= 0.2
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+        children.append(child)
+        try:
+            child.wait(timeout=taskGraph.remaining())
+        except subprocess.TimeoutExpired:
+            child.kill()
+            raise
+
+    graph.add("hang", hang, timeout=0.2)
+    graph.add("after", lambda: None, after=["hang"])
+    assert taskGraph.remaining() is None
+    with pytest.raises((taskGraph.StepTimeout, subprocess.TimeoutExpired)):
+        graph.run(serial=False)
+    assert "after" not in graph.results
+    assert children[0].wait(timeout=5) != 0
+
+    # a step stuck for good does not keep the launcher from exiting
+    script = (
+        "import threading; from dcg import taskGraph; graph = taskGraph.TaskGraph('stuck');"
+        "graph.add('stuck', threading.Event().wait, timeout=0.1)\n"
+        "try: graph.run(serial=False)\nexcept taskGraph.StepTimeout: pass"
+    )
+    env = {**os.environ, "PYTHONPATH": str(harness.REPO / "configgen")}
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, timeout=10)
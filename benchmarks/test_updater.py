@@ -0,0 +1,158 @@
+"""dcg.updater against a local HTTP stand-in for the release host."""
+from __future__ import annotations
+
+import io
+import json
+import shutil
+import tarfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import harness
+import pytest
+from dcg import updater
+
+
+class Release(BaseHTTPRequestHandler):
+    """Serves a release folder with Range support, cutting the responses listed in cut short once."""
+
+    folder = harness.ROOT / "release"
+    requests: list[tuple[str, str | None]] = []
+    cut: dict[str, int] = {}
+
+    def do_GET(self) -> None:
+        rel = urllib.parse.unquote(self.path.lstrip("/"))
+        self.requests.append((rel, self.headers.get("Range")))
+        path = self.folder / rel
+        if not path.is_file():
+            self.send_error(404)
+            return
+        data = path.read_bytes()
+        start = int(self.headers["Range"][len("bytes="):-1]) if self.headers.get("Range") else 0
+        if start >= len(data) > 0:
+            self.send_error(416)
+            return
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        if (length := self.cut.pop(rel, None)) is not None:
+            self.wfile.write(data[start:start + length])
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:])
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def release(monkeypatch):
+    monkeypatch.setattr(updater, "RETRY_DELAY", 0.0)
+    shutil.rmtree(Release.folder, ignore_errors=True)
+    Release.folder.mkdir(parents=True)
+    Release.requests.clear()
+    Release.cut.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Release)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def publish(files: dict[str, bytes]) -> None:
+    for rel, data in files.items():
+        path = Release.folder / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    (Release.folder / "bin" / "tool").chmod(0o755)
+    (Release.folder / "emulators").mkdir(exist_ok=True)
+    with tarfile.open(Release.folder / "emulators" / "demul.tar.gz", "w:gz") as tar:
+        info = tarfile.TarInfo("demul.exe")
+        info.size, info.mode = 4096, 0o755
+        tar.addfile(info, io.BytesIO(bytes(4096)))
+    manifest = updater.build_manifest(Release.folder)
+    (Release.folder / updater.MANIFEST).write_text(json.dumps(manifest))
+
+
+def fetched() -> list[str]:
+    return sorted(rel for rel, _ in Release.requests if rel != updater.MANIFEST)
+
+
+def test_update_fetches_only_changes_and_keeps_user_configs(release):
+    root = harness.ROOT / "installed"
+    shutil.rmtree(root, ignore_errors=True)
+    big = bytes(range(256)) * 4096
+    publish({"bin/tool": b"#!/bin/sh\n", "configs/a.ini": b"[a]\nx=1\n", "data/big.bin": big, "old/gone.txt": b"gone"})
+
+    report = updater.update(release, root)
+    assert report["fetch"] == ["bin/tool", "configs/a.ini", "data/big.bin", "emulators/demul/demul.exe", "old/gone.txt"]
+    assert fetched() == ["bin/tool", "configs/a.ini", "data/big.bin", "emulators/demul.tar.gz", "old/gone.txt"]
+    assert (root / "bin" / "tool").stat().st_mode & 0o777 == 0o755
+    assert (root / "emulators" / "demul" / "demul.exe").read_bytes() == bytes(4096)
+    assert not (root / updater.STAGING).exists()
+
+    # nothing changed upstream: only the manifest is fetched, no file is hashed again
+    Release.requests.clear()
+    report = updater.update(release, root)
+    assert report["fetch"] == [] and report["unchanged"] == 5
+    assert fetched() == []
+
+    # a new release while the user edited a.ini, big.bin's download is cut short once
+    (root / "configs" / "a.ini").write_bytes(b"[a]\nx=mine\n")
+    shutil.rmtree(Release.folder / "old")
+    publish({"configs/a.ini": b"[a]\nx=2\n", "data/big.bin": big[::-1]})
+    Release.cut["data/big.bin"] = 100_000
+    Release.requests.clear()
+
+    report = updater.update(release, root)
+    assert report["fetch"] == ["data/big.bin"]
+    assert report["preserve"] == ["configs/a.ini"]
+    assert report["remove"] == ["old/gone.txt"]
+    assert ("data/big.bin", "bytes=100000-") in Release.requests
+    assert (root / "data" / "big.bin").read_bytes() == big[::-1]
+    assert (root / "configs" / "a.ini").read_bytes() == b"[a]\nx=mine\n"
+    assert (root / "configs" / f"a.ini{updater.NEW_SUFFIX}").read_bytes() == b"[a]\nx=2\n"
+    assert not (root / "old").exists()
+
+
+def test_interrupted_commit_is_finished_by_the_next_run(release):
+    root = harness.ROOT / "installed"
+    shutil.rmtree(root, ignore_errors=True)
+    publish({"bin/tool": b"#!/bin/sh\n"})
+    manifest = updater.fetch_manifest(release)
+    todo = updater.plan(manifest, root)
+    staged = updater.stage(release, manifest, todo["fetch"], root / updater.STAGING)
+    journal = {
+        "generated": manifest["generated"],
+        "moves": [{"staged": staged[manifest["files"][rel]["sha256"]].name, "target": rel,
+                   "mode": manifest["files"][rel]["mode"]} for rel in todo["fetch"]],
+        "remove": [], "files": {rel: e["sha256"] for rel, e in manifest["files"].items()},
+        "preserve": [], "changed": todo["fetch"],
+    }
+    (root / updater.STAGING / updater.JOURNAL).write_text(json.dumps(journal))
+
+    assert updater.recover(root)
+    assert (root / "bin" / "tool").read_bytes() == b"#!/bin/sh\n"
+    assert not updater.recover(root)
+    assert updater.update(release, root, check_only=True)["fetch"] == []
+
+
+def test_generator_owned_inis_are_replaced(release):
+    root = harness.ROOT / "installed"
+    shutil.rmtree(root, ignore_errors=True)
+    publish({"bin/tool": b"#!/bin/sh\n", "emulators/demul/Demul.ini": b"[files]\n", "emulators/demul/padDemul.ini": b"[pad]\n"})
+    updater.update(release, root)
+
+    # as every launch does to Demul.ini, as a user might to padDemul.ini
+    (root / "emulators" / "demul" / "Demul.ini").write_bytes(b"[files]\nroms0=Z:\\userdata\\roms\\naomi2\n")
+    (root / "emulators" / "demul" / "padDemul.ini").write_bytes(b"[pad]\nmine=1\n")
+    publish({"emulators/demul/Demul.ini": b"[files]\nromsPathsCount=8\n", "emulators/demul/padDemul.ini": b"[pad]\nnew=1\n"})
+
+    report = updater.update(release, root)
+    assert report["fetch"] == ["emulators/demul/Demul.ini"]
+    assert report["preserve"] == ["emulators/demul/padDemul.ini"]
+    assert (root / "emulators" / "demul" / "Demul.ini").read_bytes() == b"[files]\nromsPathsCount=8\n"
+    assert not (root / "emulators" / "demul" / f"Demul.ini{updater.NEW_SUFFIX}").exists()
@@ -0,0 +1,56 @@
+"""dcg.winetgzCache: trimming a prefix keeps everything the game wrote."""
+from __future__ import annotations
+
+import io
+import shutil
+import tarfile
+
+import harness
+from dcg import winetgzCache
+
+
+def _archive(path, files: dict[str, bytes]) -> None:
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1_000_000_000
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_trim_keeps_what_the_game_wrote(monkeypatch):
+    monkeypatch.chdir(harness.ROOT)
+    harness.build_tree()
+    bottles = winetgzCache.WINE_BOTTLES / "windows"
+    shutil.rmtree(bottles, ignore_errors=True)
+    bottles.mkdir(parents=True)
+    archive = harness.ROOT / "game.wtgz"
+    _archive(archive, {
+        "drive_c/game/game.exe": b"exe" * 1000,
+        "drive_c/game/data.pak": b"pak" * 1000,
+        "drive_c/game/save/slot1.sav": b"empty",
+        "system.reg": b"WINE REGISTRY",
+    })
+    prefix = bottles / "game.wine"
+    assert winetgzCache.extract(archive, prefix)["written"] == 4
+
+    # the game saves, wine rewrites its registry, the player adds a config
+    (prefix / "drive_c/game/save/slot1.sav").write_bytes(b"level 9")
+    (prefix / "system.reg").write_bytes(b"WINE REGISTRY\n[Software]")
+    (prefix / "drive_c/game/config.ini").write_bytes(b"[video]")
+
+    # opt-in: nothing is ever trimmed without a budget
+    assert winetgzCache._budget() == 0 and winetgzCache.trim() == []
+
+    assert winetgzCache.trim_prefix(prefix) == 6000
+    assert not (prefix / "drive_c/game/game.exe").exists() and not (prefix / "drive_c/game/data.pak").exists()
+    assert (prefix / "drive_c/game/save/slot1.sav").read_bytes() == b"level 9"
+    assert (prefix / "system.reg").read_bytes() == b"WINE REGISTRY\n[Software]"
+    assert (prefix / "drive_c/game/config.ini").read_bytes() == b"[video]"
+    assert winetgzCache.list_prefixes() == []
+
+    # the next launch brings back the game and nothing else
+    result = winetgzCache.extract(archive, prefix)
+    assert result["action"] == "adopted" and result["written"] == 2
+    assert (prefix / "drive_c/game/game.exe").read_bytes() == b"exe" * 1000
+    assert (prefix / "drive_c/game/save/slot1.sav").read_bytes() == b"level 9"
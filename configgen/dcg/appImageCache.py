@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Final
+
+from dcg import launchHistory, prepare, tracing
+from dcg.materialize import atomic_write
+from dcg.paths import CONFIGGEN
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# AppImage runtime cache
+#
+# An AppImage is extracted once next to itself, into a directory named
+# after its hash, and launches exec the extracted AppRun instead of
+# mounting the squashfs through FUSE and decompressing it again. A state
+# file next to the AppImage ties its size and mtime to that hash, so a
+# launch only stats the AppImage and reads the state. While the cache is
+# missing or stale the AppImage itself runs and the extraction happens in
+# the background.
+# ------------------------------------------------------------
+
+CACHE_STATE: Final = ".dcg-appimage.json"
+CACHE_LOCK: Final = ".dcg-appimage.lock"
+APPRUN: Final = "AppRun"
+
+_HASH_DIR: Final = re.compile(r"[0-9a-f]{16}")
+
+
+def _stamp(appimage: Path) -> list[int]:
+    st = appimage.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _load_state(appimage: Path) -> dict[str, Any] | None:
+    try:
+        with (appimage.parent / CACHE_STATE).open() as fp:
+            states = json.load(fp)
+        return states.get(appimage.name)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _current(appimage: Path, stamp: list[int]) -> Path | None:
+    state = _load_state(appimage)
+    if state is None or state["stamp"] != stamp:
+        return None
+    apprun = appimage.parent / state["hash"] / APPRUN
+    return apprun if os.access(apprun, os.X_OK) else None
+
+
+def runtime(appimage: str | Path, timeout: float | None = None) -> Path:
+    """What to exec for appimage: its extracted AppRun when cached, else the AppImage.
+
+    A dry run extracts it first, giving up past timeout seconds.
+    """
+    appimage = Path(appimage)
+    try:
+        stamp = _stamp(appimage)
+    except OSError:
+        return appimage
+    apprun = _current(appimage, stamp)
+    launchHistory.cache("appimage", apprun is not None)
+    if apprun is not None:
+        return apprun
+    if prepare.dry_run():
+        # nothing is about to start, extract now so the first launch runs extracted
+        try:
+            return extract(appimage, timeout)
+        except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            eslog.warning(f"unable to extract {appimage}: {e}")
+            return appimage
+    eslog.info(f"{appimage.name} is not extracted yet, running the AppImage")
+    extract_in_background(appimage)
+    return appimage
+
+
+def _hash(appimage: Path) -> str:
+    digest = hashlib.sha256()
+    with appimage.open("rb") as fp:
+        while data := fp.read(1024 * 1024):
+            digest.update(data)
+    return digest.hexdigest()[:16]
+
+
+def extract(appimage: str | Path, timeout: float | None = None) -> Path:
+    """Extract appimage into <hash>/ next to it unless already there, drop older extractions.
+
+    The extraction is killed past timeout seconds and subprocess.TimeoutExpired raised.
+    """
+    appimage = Path(appimage).resolve()
+    root = appimage.parent
+    with (root / CACHE_LOCK).open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stamp = _stamp(appimage)
+        if (apprun := _current(appimage, stamp)) is not None:
+            return apprun
+
+        with tracing.span("appimage.extract", appimage=appimage.name):
+            key = _hash(appimage)
+            target = root / key
+            if not os.access(target / APPRUN, os.X_OK):
+                staging = root / f".extract-{key}"
+                shutil.rmtree(staging, ignore_errors=True)
+                shutil.rmtree(target, ignore_errors=True)
+                staging.mkdir()
+                try:
+                    # --appimage-extract needs no FUSE, it writes squashfs-root in the working directory
+                    subprocess.run([appimage, "--appimage-extract"], cwd=staging, check=True,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, timeout=timeout)
+                    os.rename(staging / "squashfs-root", target)
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+
+        try:
+            with (root / CACHE_STATE).open() as fp:
+                states = json.load(fp)
+        except (OSError, ValueError):
+            states = {}
+        states[appimage.name] = {"stamp": stamp, "hash": key, "extracted": time.time()}
+        atomic_write(root / CACHE_STATE, json.dumps(states, indent=1).encode(), sync=False)
+
+        in_use = {state["hash"] for state in states.values()}
+        for path in root.iterdir():
+            if path.is_dir() and _HASH_DIR.fullmatch(path.name) and path.name not in in_use:
+                eslog.info(f"removing the stale extraction {path}")
+                shutil.rmtree(path, ignore_errors=True)
+    return target / APPRUN
+
+
+def extract_in_background(appimage: str | Path) -> None:
+    subprocess.Popen(
+        [sys.executable, "-m", "dcg.appImageCache", "extract", str(appimage)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**os.environ, "PYTHONPATH": str(CONFIGGEN)}, start_new_session=True,
+    )
+
+
+def clear(appimage: str | Path) -> bool:
+    """Remove the extraction of appimage, it runs from the AppImage until extracted again."""
+    appimage = Path(appimage).resolve()
+    root = appimage.parent
+    with (root / CACHE_LOCK).open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = _load_state(appimage)
+        if state is None:
+            return False
+        shutil.rmtree(root / state["hash"], ignore_errors=True)
+        with (root / CACHE_STATE).open() as fp:
+            states = json.load(fp)
+        del states[appimage.name]
+        atomic_write(root / CACHE_STATE, json.dumps(states, indent=1).encode(), sync=False)
+    return True
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.appImageCache", description="Run AppImages from a one-time extraction.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    for name, help_text in (
+        ("extract", "extract an AppImage unless its extraction is current"),
+        ("status", "show what a launch would run"),
+        ("clear", "remove the extraction of an AppImage"),
+    ):
+        sub.add_parser(name, help=help_text).add_argument("appimage")
+    args = parser.parse_args(argv)
+    appimage = Path(args.appimage)
+
+    if args.action == "extract":
+        start = time.monotonic()
+        try:
+            apprun = extract(appimage)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"unable to extract {appimage}: {e}", file=sys.stderr)
+            return 1
+        print(f"{appimage.name}: {apprun} ({time.monotonic() - start:.1f}s)")
+        return 0
+
+    if args.action == "clear":
+        return 0 if clear(appimage) else 1
+
+    try:
+        apprun = _current(appimage, _stamp(appimage))
+    except OSError as e:
+        print(f"{appimage}: {e}", file=sys.stderr)
+        return 1
+    print(f"{appimage.name}: " + (f"extracted, runs {apprun}" if apprun else "not extracted, runs the AppImage"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
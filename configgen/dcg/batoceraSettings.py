@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import logging
+import pickle
+import shlex
+import sys
+from typing import Final
+
+from dcg.materialize import atomic_write
+from dcg.paths import BATOCERA_CONF, DCG_CACHE
+
+eslog = logging.getLogger(__name__)
+
+SNAPSHOT_CACHE: Final = DCG_CACHE / "batocera-conf.pickle"
+
+_settings: dict[str, str] | None = None
+
+
+# ------------------------------------------------------------
+# batocera.conf
+# ------------------------------------------------------------
+
+def parse(text: str) -> dict[str, str]:
+    """Parse batocera.conf, ARCADE ADVANCED CONFIG section included.
+
+    Comment and blank lines are ignored and, like configgen's own reader,
+    a key repeated further down the file overrides the earlier value.
+    """
+    settings: dict[str, str] = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        settings[key.strip()] = value.strip()
+    return settings
+
+
+def load() -> dict[str, str]:
+    """All batocera.conf settings, parsed at most once per file change."""
+    global _settings
+    if _settings is not None:
+        return _settings
+
+    try:
+        st = BATOCERA_CONF.stat()
+    except FileNotFoundError:
+        _settings = {}
+        return _settings
+    stamp = (st.st_size, st.st_mtime_ns)
+
+    try:
+        with SNAPSHOT_CACHE.open("rb") as fp:
+            cached_stamp, settings = pickle.load(fp)
+        if cached_stamp == stamp:
+            _settings = settings
+            return _settings
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+
+    with BATOCERA_CONF.open(encoding="utf-8", errors="replace") as fp:
+        _settings = parse(fp.read())
+    try:
+        atomic_write(SNAPSHOT_CACHE, pickle.dumps((stamp, _settings), protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    except OSError as e:
+        eslog.warning(f"unable to cache batocera.conf: {e}")
+    return _settings
+
+
+def get(*keys: str, default: str | None = None) -> str | None:
+    """Value of the first of keys that is set, as batocera-settings-get does."""
+    settings = load()
+    for key in keys:
+        if key in settings:
+            return settings[key]
+    return default
+
+
+def get_setting(key: str, system: str, game: str, default: str | None = None) -> str | None:
+    """Resolve key through system["game"].key, system.key and global.key."""
+    return get(f'{system}["{game}"].{key}', f"{system}.{key}", f"global.{key}", default=default)
+
+
+def resolve(system: str, game: str) -> dict[str, str]:
+    """Every setting visible to a game, the most specific definition winning."""
+    scopes = ("global.", f"{system}.", f'{system}["{game}"].')
+    resolved: dict[str, str] = {}
+    for prefix in scopes:
+        for key, value in load().items():
+            if key.startswith(prefix):
+                resolved[key[len(prefix):]] = value
+    return resolved
+
+
+# ------------------------------------------------------------
+# Shell export
+# ------------------------------------------------------------
+
+def export_shell(system: str, game: str, raw_keys: list[str]) -> str:
+    """Bash declarations of the resolved snapshot, for batocera-wine to eval."""
+    def assoc(name: str, values: dict[str, str]) -> str:
+        items = " ".join(f"[{shlex.quote(k)}]={shlex.quote(v)}" for k, v in values.items())
+        return f"declare -gA {name}=({items})"
+
+    raw = {key: value for key in raw_keys if (value := get(key)) is not None}
+    return "\n".join([
+        assoc("DCG_SETTINGS", resolve(system, game)),
+        assoc("DCG_SETTINGS_RAW", raw),
+        "DCG_SETTINGS_LOADED=1",
+    ]) + "\n"
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.batoceraSettings", description="Resolve batocera.conf in one pass.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    export = sub.add_parser("export", help="print the resolved settings of a game as bash declarations")
+    export.add_argument("--system", required=True)
+    export.add_argument("--game", required=True)
+    export.add_argument("--raw", action="append", default=[], help="also export this plain key")
+    getter = sub.add_parser("get", help="print the first key that is set")
+    getter.add_argument("keys", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.action == "export":
+        sys.stdout.write(export_shell(args.system, args.game, args.raw))
+        return 0
+
+    value = get(*args.keys)
+    if value is None:
+        return 1
+    print(value)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final, NamedTuple
+
+from dcg.materialize import atomic_write
+from dcg.paths import DCG_CACHE, DCG_HOME, USERDATA
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# BIOS store
+#
+# bios/manifest.txt lists the BIOS files of each system with their SHA-1.
+# Each of them is stored once under STORE, named by its hash whichever
+# shipped file or pack it came from, and /userdata/bios gets a hardlink
+# to it (a symlink, or a copy, where the filesystem has no hardlinks).
+# A pass stats every listed file and only hashes those whose size, mtime
+# or inode moved since the last one: on an unchanged tree it costs a few
+# dozen stat() calls and writes nothing, so it can run on every boot. A
+# file that does not match is moved aside as .bad and replaced when the
+# store holds the right one; a zip holding the same members repacked
+# passes.
+# ------------------------------------------------------------
+
+BIOS: Final = USERDATA / "bios"
+# on the filesystem of /userdata/bios, which the hardlinks need
+STORE: Final = BIOS / ".dcg-store"
+STATE: Final = DCG_CACHE / "bios.json"
+STATE_VERSION: Final = 1
+
+MANIFEST: Final = DCG_HOME / "bios" / "manifest.txt"
+# the shipped tree, laid out like /userdata/bios
+SHIPPED: Final = DCG_HOME / "bios" / "hikaru" / "bios"
+# archives of the shipped tree, only opened for a file the tree lacks
+PACKS: Final = (DCG_HOME / "bios" / "hikaru" / "bios.zip", SHIPPED / "bios.zip")
+PACK_PREFIX: Final = "bios/"
+
+PROBLEMS: Final = ("missing", "mismatch")
+
+
+class Entry(NamedTuple):
+    system: str
+    path: str
+    sha1: str | None
+
+
+def load_manifest(path: Path = MANIFEST) -> list[Entry]:
+    entries = []
+    with path.open(encoding="utf-8") as fp:
+        for line in fp:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            system, file, sha1 = line.split()
+            entries.append(Entry(system, file, None if sha1 == "-" else sha1.lower()))
+    return entries
+
+
+# ------------------------------------------------------------
+# Hashes
+# ------------------------------------------------------------
+
+def _load_state() -> dict[str, Any]:
+    try:
+        with STATE.open() as fp:
+            state = json.load(fp)
+        if state.get("version") == STATE_VERSION:
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"version": STATE_VERSION, "hashes": {}, "repacked": {}, "mode": None}
+
+
+def _stamp(st: os.stat_result) -> list[int]:
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def file_sha1(path: Path, st: os.stat_result, hashes: dict[str, list[Any]]) -> str:
+    """SHA-1 of path, read only when its stamp moved since it was last hashed."""
+    key = str(path)
+    cached = hashes.get(key)
+    if cached is not None and cached[:3] == _stamp(st):
+        return cached[3]
+    digest = hashlib.sha1()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
+    hashes[key] = [*_stamp(st), digest.hexdigest()]
+    return hashes[key][3]
+
+
+def _members(path: Path) -> dict[str, int]:
+    """CRC of each file of a zip, from its central directory alone."""
+    import zipfile
+
+    with zipfile.ZipFile(path) as archive:
+        return {info.filename: info.CRC for info in archive.infolist() if not info.is_dir()}
+
+
+def _repacked(target: Path, st: os.stat_result, stored: Path, sha1: str, state: dict[str, Any]) -> bool:
+    """Whether the zip target holds every member of the stored one, unchanged."""
+    import zipfile
+
+    key = str(target)
+    stamp = [*_stamp(st), sha1]
+    if state["repacked"].get(key) == stamp:
+        return True
+    try:
+        members = _members(target)
+        same = _members(stored).items() <= members.items()
+    except (OSError, zipfile.BadZipFile):
+        same = False
+    if same:
+        state["repacked"][key] = stamp
+    return same
+
+
+# ------------------------------------------------------------
+# Store
+# ------------------------------------------------------------
+
+def blob(sha1: str) -> Path:
+    return STORE / sha1[:2] / sha1
+
+
+def _add_blob(sha1: str, src: Path | None = None, data: bytes | None = None) -> None:
+    target = blob(sha1)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{sha1}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        if src is not None:
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+        else:
+            tmp.write_bytes(data)
+        # every deployed hardlink shares this inode, nothing may write through one
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    eslog.debug(f"stored {sha1}")
+
+
+def _import(entries: Iterable[Entry], hashes: dict[str, list[Any]]) -> int:
+    """Store the listed files the store lacks, from the shipped tree or else its packs; how many were."""
+    wanted = {entry.path: entry.sha1 for entry in entries if entry.sha1 and not blob(entry.sha1).exists()}
+    imported = 0
+    for path, sha1 in list(wanted.items()):
+        src = SHIPPED / path
+        try:
+            st = src.stat()
+        except OSError:
+            continue
+        if file_sha1(src, st, hashes) == sha1:
+            _add_blob(sha1, src=src)
+            del wanted[path]
+            imported += 1
+
+    for pack in PACKS:
+        if not wanted:
+            break
+        import zipfile
+
+        try:
+            archive = zipfile.ZipFile(pack)
+        except (OSError, zipfile.BadZipFile):
+            continue
+        with archive:
+            for info in archive.infolist():
+                path = info.filename.removeprefix(PACK_PREFIX)
+                if (sha1 := wanted.get(path)) is None:
+                    continue
+                data = archive.read(info)
+                if hashlib.sha1(data).hexdigest() == sha1:
+                    _add_blob(sha1, data=data)
+                    del wanted[path]
+                    imported += 1
+    return imported
+
+
+def _place(stored: Path, target: Path) -> str:
+    """Make target the stored blob: hardlinked, else symlinked, else copied; which it was."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    for mode, link in (("hardlink", os.link), ("symlink", os.symlink)):
+        try:
+            link(stored, tmp)
+            break
+        except OSError:
+            continue
+    else:
+        mode = "copy"
+        shutil.copyfile(stored, tmp)
+    os.replace(tmp, target)
+    return mode
+
+
+def prune(entries: Iterable[Entry]) -> int:
+    """Drop the blobs the manifest no longer lists and nothing links to."""
+    keep = {entry.sha1 for entry in entries if entry.sha1}
+    removed = 0
+    for stored in STORE.glob("??/*"):
+        if stored.name not in keep and stored.stat().st_nlink == 1:
+            stored.unlink()
+            removed += 1
+    return removed
+
+
+# ------------------------------------------------------------
+# Check and deploy
+# ------------------------------------------------------------
+
+def _check(entry: Entry, deploy: bool, state: dict[str, Any]) -> str:
+    target = BIOS / entry.path
+    try:
+        st = target.stat()
+    except FileNotFoundError:
+        st = None
+    if entry.sha1 is None:
+        return "missing" if st is None else "ok"
+
+    stored = blob(entry.sha1)
+    try:
+        stored_st = stored.stat()
+    except FileNotFoundError:
+        stored_st = None
+
+    if st is not None:
+        # deployed by us: the blob itself, through a hardlink or a symlink
+        if stored_st is not None and (st.st_dev, st.st_ino) == (stored_st.st_dev, stored_st.st_ino):
+            return "ok"
+        if file_sha1(target, st, state["hashes"]) == entry.sha1:
+            if stored_st is None:
+                _add_blob(entry.sha1, src=target)
+            elif deploy and state["mode"] != "copy":
+                # a copy of what is in the store, link it instead
+                state["mode"] = _place(stored, target)
+            return "ok"
+        if stored_st is not None and target.suffix == ".zip" and _repacked(target, st, stored, entry.sha1, state):
+            return "ok"
+
+    if not deploy or stored_st is None:
+        return "missing" if st is None else "mismatch"
+    if st is not None:
+        eslog.warning(f"{target} does not match the manifest, it is kept as {target.name}.bad")
+        os.replace(target, target.with_name(target.name + ".bad"))
+    state["mode"] = _place(stored, target)
+    return "deployed" if st is None else "replaced"
+
+
+def sync(systems: Iterable[str] = (), deploy: bool = True, manifest: Path = MANIFEST) -> dict[str, Any]:
+    """Check every listed BIOS file, deploying the missing and mismatched ones the store has unless deploy is False."""
+    systems = set(systems)
+    entries = load_manifest(manifest)
+    state = _load_state()
+    before = json.dumps(state, sort_keys=True)
+
+    imported = _import(entries, state["hashes"]) if deploy else 0
+    files = [
+        {"system": entry.system, "file": entry.path, "status": _check(entry, deploy, state)}
+        for entry in entries if not systems or entry.system in systems
+    ]
+    removed = prune(entries) if deploy and state["mode"] == "hardlink" and STORE.is_dir() else 0
+
+    # forget the hashes of files gone since
+    for key in [key for key in state["hashes"] if not os.path.exists(key)]:
+        del state["hashes"][key]
+    if json.dumps(state, sort_keys=True) != before:
+        atomic_write(STATE, json.dumps(state, separators=(",", ":")).encode(), sync=False)
+    return {"files": files, "imported": imported, "pruned": removed, "mode": state["mode"]}
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.biosStore", description="Check and deploy the BIOS files of the dcg systems.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    for action, description in (("sync", "store, deploy and check the BIOS files"), ("check", "only check the deployed BIOS files")):
+        action_parser = sub.add_parser(action, help=description)
+        action_parser.add_argument("--system", action="append", default=[], help="only this system (repeatable)")
+        action_parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    result = sync(args.system, deploy=args.action == "sync")
+    problems = [file for file in result["files"] if file["status"] in PROBLEMS]
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        for file in result["files"]:
+            if file["status"] != "ok":
+                print(f"{file['status'].upper():<9} {file['system']:<12} {BIOS / file['file']}")
+        counts = {status: sum(file["status"] == status for file in result["files"]) for status in ("ok", "deployed", "replaced", *PROBLEMS)}
+        print(", ".join(f"{count} {status}" for status, count in counts.items() if count)
+              + f" in {time.monotonic() - start:.2f}s", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
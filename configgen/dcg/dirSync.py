@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Final
+
+eslog = logging.getLogger(__name__)
+
+MANIFEST_VERSION: Final = 2
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE: Final = 0x40049409
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_manifest(manifest: Path) -> dict[str, Any]:
+    try:
+        with manifest.open("r") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data
+
+
+def _save_manifest(manifest: Path, data: dict[str, Any]) -> None:
+    tmp = manifest.with_name(manifest.name + ".tmp")
+    try:
+        with tmp.open("w") as fp:
+            json.dump(data, fp, separators=(",", ":"))
+        os.replace(tmp, manifest)
+    except OSError as e:
+        eslog.warning(f"unable to write sync manifest {manifest}: {e}")
+
+
+def place_file(src: str, dest: str) -> str:
+    """Put src at dest using the cheapest method the filesystem supports.
+
+    Tries a reflink first, then a hardlink, then falls back to a full copy.
+    Hardlinks are only used for read-only sources, otherwise an in-place
+    write to dest would end up in src. The file is staged next to dest and
+    renamed over it so a reader never sees a partial file. Returns the
+    method used.
+    """
+    tmp = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.dcgtmp")
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+
+    method = "reflink"
+    try:
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, tmp)
+    except OSError:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        method = "hardlink"
+        try:
+            if os.access(src, os.W_OK):
+                raise PermissionError(src)
+            os.link(src, tmp)
+        except OSError:
+            method = "copy"
+            shutil.copy2(src, tmp)
+
+    os.replace(tmp, dest)
+    return method
+
+
+def sync_directories(source_dir: str | Path, dest_dir: str | Path, manifest: str | Path) -> int:
+    """Make the top level files of dest_dir match source_dir.
+
+    The manifest remembers the size and mtime of every file on both sides
+    (plus its content hash once one was needed), so a launch where nothing
+    changed only stats the files, and files are only hashed when their stat
+    data moved. Each file is stamped rather than its directory: a file
+    rewritten in place (cp over a DLL, wineboot recreating system32) does
+    not move the directory's mtime. Returns the number of files written.
+    """
+    source_dir = os.fspath(source_dir)
+    dest_dir = os.fspath(dest_dir)
+    manifest = Path(manifest)
+
+    data = _load_manifest(manifest)
+    os.makedirs(dest_dir, exist_ok=True)
+
+    known: dict[str, dict[str, Any]] = data.get("files", {}) if data.get("source_dir") == source_dir else {}
+    files: dict[str, dict[str, Any]] = {}
+    placed = 0
+
+    with os.scandir(source_dir) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            src_stat = entry.stat()
+            dest_path = os.path.join(dest_dir, entry.name)
+            record = known.get(entry.name, {})
+
+            try:
+                dest_stat = os.stat(dest_path)
+            except FileNotFoundError:
+                dest_stat = None
+
+            src_same = record.get("size") == src_stat.st_size and record.get("mtime_ns") == src_stat.st_mtime_ns
+            dest_same = dest_stat is not None and record.get("dest") == [dest_stat.st_size, dest_stat.st_mtime_ns]
+            if src_same and dest_same:
+                files[entry.name] = record
+                continue
+
+            # hash only when a same-sized destination has to be compared
+            digest = record.get("sha256") if src_same else None
+            up_to_date = False
+            if dest_stat is not None and dest_stat.st_size == src_stat.st_size:
+                digest = digest or _file_hash(entry.path)
+                up_to_date = _file_hash(dest_path) == digest
+
+            if not up_to_date:
+                method = place_file(entry.path, dest_path)
+                eslog.debug(f"sync {entry.path} -> {dest_path} ({method})")
+                dest_stat = os.stat(dest_path)
+                placed += 1
+
+            files[entry.name] = {
+                "size": src_stat.st_size,
+                "mtime_ns": src_stat.st_mtime_ns,
+                "sha256": digest,
+                "dest": [dest_stat.st_size, dest_stat.st_mtime_ns],
+            }
+
+    if data.get("source_dir") != source_dir or files != known:
+        _save_manifest(manifest, {"version": MANIFEST_VERSION, "source_dir": source_dir, "files": files})
+    return placed
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg.materialize import atomic_write
+from dcg.paths import DCG_CACHE, DCG_HOME
+from dcg.prepare import ES_SYSTEMS, load_systems
+from dcg.romScanner import SKIP_DIRS
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from xml.etree.ElementTree import Element
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Gamelists
+#
+# Writes the gamelist.xml of each dcg system from what we already ship:
+# the names of the namco2x6 arcadedefs, the players, rotation and
+# controls of Demul's arcade_compat.txt and the system logos. The listing
+# of every ROM directory is kept with its mtime, so a run only lists the
+# directories where games were added, removed or renamed, and a run where
+# nothing changed reads no gamelist either. Only the fields the indexer
+# wrote itself are updated: what a scraper or EmulationStation set
+# (names, favorites, play counts) stays.
+# ------------------------------------------------------------
+
+INDEX_DIR: Final = DCG_CACHE / "gamelists"
+INDEX_VERSION: Final = 1
+
+GAMELIST: Final = "gamelist.xml"
+LOGOS: Final = DCG_HOME / "asset" / "logo"
+IMAGES: Final = "images"
+IMAGE_SUFFIXES: Final = ("-image.png", "-image.jpg", ".png", ".jpg")
+
+# gamelist fields the indexer owns
+FIELDS: Final = ("name", "desc", "players", "image", "marquee")
+
+
+# ------------------------------------------------------------
+# Directory scan
+# ------------------------------------------------------------
+
+def _list(path: Path, extensions: frozenset[str]) -> tuple[list[str], list[str]]:
+    """ROMs and subdirectories of path, .wine style directory games being ROMs."""
+    roms, subdirs = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            if os.path.splitext(entry.name)[1].lower() in extensions:
+                roms.append(entry.name)
+            elif entry.is_dir() and entry.name not in SKIP_DIRS:
+                subdirs.append(entry.name)
+    return sorted(roms), sorted(subdirs)
+
+
+def scan(root: Path, extensions: frozenset[str], cached: dict[str, tuple[Any, ...]]) -> tuple[dict[str, tuple[Any, ...]], int]:
+    """(mtime, roms, subdirs) of every directory below root by relative path, and how many had to be listed."""
+    dirs: dict[str, tuple[Any, ...]] = {}
+    listed = 0
+    pending = [""]
+    while pending:
+        rel = pending.pop()
+        try:
+            mtime = os.stat(root / rel).st_mtime_ns
+        except OSError:
+            continue
+        entry = cached.get(rel)
+        if entry is None or entry[0] != mtime:
+            try:
+                entry = (mtime, *_list(root / rel, extensions))
+            except OSError:
+                continue
+            listed += 1
+        dirs[rel] = entry
+        pending.extend(os.path.join(rel, name) for name in entry[2])
+    return dirs, listed
+
+
+def _roms(dirs: dict[str, tuple[Any, ...]]) -> list[str]:
+    return sorted(os.path.join(rel, name) for rel, entry in dirs.items() for name in entry[1])
+
+
+def _images(root: Path, cached: tuple[Any, ...] | None) -> tuple[Any, ...] | None:
+    """(mtime, {stem: file}) of the system's images folder."""
+    folder = root / IMAGES
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+    if cached is not None and cached[0] == mtime:
+        return cached
+    found: dict[str, str] = {}
+    with os.scandir(folder) as it:
+        names = sorted(entry.name for entry in it)
+    # the first suffix wins: -image.png before a bare .png
+    for suffix in reversed(IMAGE_SUFFIXES):
+        for name in names:
+            if name.endswith(suffix):
+                found[name[:-len(suffix)]] = name
+    return (mtime, found)
+
+
+# ------------------------------------------------------------
+# Metadata
+# ------------------------------------------------------------
+
+def _sources(system: dict[str, Any]) -> tuple[bool, bool]:
+    emulators = system["emulators"]
+    return "demul" in emulators, "play" in emulators
+
+
+def _stat(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def metadata_stamp(system: dict[str, Any]) -> tuple[Any, ...]:
+    """Changes whenever the metadata the gamelist of system is built from does."""
+    demul, play = _sources(system)
+    stamp: list[Any] = [INDEX_VERSION, _stat(LOGOS / f"{system['name']}.png")]
+    if demul:
+        from generators.demul import arcadeCompat
+
+        stamp.append(_stat(arcadeCompat.COMPAT_LIST))
+    if play:
+        from generators.namco2x6 import arcadeDefs
+
+        stamp.append(sorted(arcadeDefs._stamps().items()))
+    return tuple(stamp)
+
+
+def _describe(compat: dict[str, Any]) -> str:
+    parts = []
+    if compat.get("control"):
+        parts.append(f"Controls: {compat['control']}.")
+    if compat.get("rotation") == "V":
+        parts.append("Vertical screen.")
+    if compat.get("notes"):
+        parts.append(compat["notes"][:1].upper() + compat["notes"][1:] + ".")
+    return " ".join(parts)
+
+
+def entries(system: dict[str, Any], roms: Iterable[str], images: dict[str, str]) -> dict[str, dict[str, str]]:
+    """The fields the indexer sets for each ROM, by gamelist path."""
+    demul, play = _sources(system)
+    compat_list = defs = None
+    if demul:
+        from generators.demul import arcadeCompat
+
+        compat_list = arcadeCompat.load()
+    if play:
+        from generators.namco2x6 import arcadeDefs
+
+        defs = arcadeDefs.load_index()["games"]
+    logo = LOGOS / f"{system['name']}.png"
+    marquee = str(logo) if logo.exists() else None
+
+    result = {}
+    for rom in roms:
+        stem = os.path.splitext(os.path.basename(rom))[0]
+        fields = {"name": stem}
+        if defs is not None and (game := defs.get(stem)) is not None:
+            fields["name"] = game["name"]
+        if compat_list is not None and (compat := compat_list.get(stem)) is not None:
+            if compat.get("players", "").isdigit():
+                fields["players"] = compat["players"]
+            if desc := _describe(compat):
+                fields["desc"] = desc
+        if stem in images:
+            fields["image"] = f"./{IMAGES}/{images[stem]}"
+        if marquee:
+            fields["marquee"] = marquee
+        result[f"./{rom}"] = fields
+    return result
+
+
+# ------------------------------------------------------------
+# gamelist.xml
+# ------------------------------------------------------------
+
+def _load_gamelist(path: Path) -> Element:
+    import xml.etree.ElementTree as ET
+
+    try:
+        return ET.parse(path).getroot()
+    except FileNotFoundError:
+        return ET.Element("gameList")
+    except ET.ParseError as e:
+        # keep what EmulationStation wrote, a new list is started next to it
+        eslog.warning(f"{path} is not valid XML ({e}), it is kept as {path.name}.bad")
+        os.replace(path, path.with_name(path.name + ".bad"))
+        return ET.Element("gameList")
+
+
+def merge(gamelist: Element, wanted: dict[str, dict[str, str]], previous: dict[str, dict[str, str]]) -> int:
+    """Bring the indexer's fields of gamelist to wanted, leaving the others alone; games changed."""
+    import xml.etree.ElementTree as ET
+
+    games = {game.findtext("path"): game for game in gamelist.iter("game")}
+    changed = 0
+    for path, fields in wanted.items():
+        game = games.get(path)
+        if game is None:
+            game = ET.SubElement(gamelist, "game")
+            ET.SubElement(game, "path").text = path
+        ours = previous.get(path, {})
+        touched = False
+        for field in FIELDS:
+            node = game.find(field)
+            current = node.text if node is not None else None
+            value = fields.get(field)
+            # someone else set it: not ours to change
+            if current is not None and current != ours.get(field):
+                continue
+            if value == current:
+                continue
+            if value is None:
+                game.remove(node)
+            elif node is None:
+                ET.SubElement(game, field).text = value
+            else:
+                node.text = value
+            touched = True
+        changed += touched
+
+    for path in previous.keys() - wanted.keys():
+        game = games.get(path)
+        # the ROM is gone, drop the entry unless it holds more than what we wrote
+        if game is not None and all(node.tag == "path" or node.text == previous[path].get(node.tag) for node in game):
+            gamelist.remove(game)
+            changed += 1
+    return changed
+
+
+# ------------------------------------------------------------
+# Index
+# ------------------------------------------------------------
+
+def _state_path(system: str) -> Path:
+    return INDEX_DIR / f"{system}.pickle"
+
+
+def _load_state(system: str) -> dict[str, Any]:
+    try:
+        with _state_path(system).open("rb") as fp:
+            state = pickle.load(fp)
+        if state.get("version") == INDEX_VERSION:
+            return state
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    return {"version": INDEX_VERSION, "dirs": {}, "images": None, "metadata": None, "entries": {}, "gamelist": None}
+
+
+def index_system(system: dict[str, Any], full: bool = False) -> dict[str, Any]:
+    """Update the gamelist.xml of one system, doing nothing when neither its ROMs nor its metadata changed."""
+    root: Path = system["path"]
+    state = _load_state(system["name"])
+    if full:
+        state.update(dirs={}, images=None, metadata=None)
+    result = {"system": system["name"], "games": 0, "listed": 0, "changed": 0, "written": False}
+    if not root.is_dir():
+        return result
+
+    dirs, listed = scan(root, system["extensions"], state["dirs"])
+    images = _images(root, state["images"])
+    stamp = metadata_stamp(system)
+    gamelist_path = root / GAMELIST
+    roms = _roms(dirs)
+    result.update(games=len(roms), listed=listed)
+
+    unchanged = (dirs == state["dirs"] and images == state["images"] and stamp == state["metadata"]
+                 and _stat(gamelist_path) == state["gamelist"])
+    if unchanged:
+        return result
+
+    wanted = entries(system, roms, images[1] if images else {})
+    gamelist = _load_gamelist(gamelist_path)
+    changed = merge(gamelist, wanted, state["entries"])
+    if changed or not gamelist_path.exists():
+        import xml.etree.ElementTree as ET
+
+        ET.indent(gamelist)
+        atomic_write(gamelist_path, ET.tostring(gamelist, encoding="utf-8", xml_declaration=True) + b"\n", sync=False)
+        result["written"] = True
+        # the write moved the mtime of the ROM folder, take it again unless a ROM came meanwhile
+        top = dirs[""]
+        try:
+            if (now := (os.stat(root).st_mtime_ns, *_list(root, system["extensions"])))[1:] == top[1:]:
+                dirs[""] = now
+        except OSError:
+            pass
+    result["changed"] = changed
+
+    atomic_write(_state_path(system["name"]), pickle.dumps({
+        "version": INDEX_VERSION, "dirs": dirs, "images": images, "metadata": stamp,
+        "entries": wanted, "gamelist": _stat(gamelist_path),
+    }, protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    return result
+
+
+def index(only: Iterable[str] = (), full: bool = False, directory: Path = ES_SYSTEMS) -> list[dict[str, Any]]:
+    only = set(only)
+    return [index_system(system, full) for system in load_systems(directory) if not only or system["name"] in only]
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.gamelistIndexer", description="Write the gamelist.xml of the dcg systems.")
+    parser.add_argument("--system", action="append", default=[], help="only index this system (repeatable)")
+    parser.add_argument("--full", action="store_true", help="list every directory again")
+    parser.add_argument("--es-systems", type=Path, default=ES_SYSTEMS, help="folder of the es_systems_*.cfg files")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    results = index(args.system, args.full, args.es_systems)
+    for result in results:
+        if result["games"] or result["written"]:
+            print(f"{result['system']:<12} {result['games']:6} games, {result['listed']:4} directories listed, "
+                  f"{result['changed']:5} entries changed" + (", written" if result["written"] else ""))
+    print(f"{len(results)} systems in {time.monotonic() - start:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
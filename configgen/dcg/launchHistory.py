@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import atexit
+import fcntl
+import functools
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg import tracing
+from dcg.paths import CONFIGGEN, DCG_CACHE, DCG_HOME, SYSTEM
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Iterable
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Launch history
+#
+# dcglauncher opens a record as a game starts: the time generate() took is
+# its launch latency, the spans of the launch are summed per phase, the
+# generators and dcg helpers note the caches they found warm or cold, and
+# batocera-wine appends its phases and runner to the NOTES_ENV file. Once
+# the emulator exited the record is appended to a spool file. Every
+# INGEST_EVERY launches, a background process inserts what is spooled
+# into an SQLite database in one transaction: a launch writes nothing
+# before the game starts and never imports sqlite3.
+# ------------------------------------------------------------
+
+HISTORY_DB: Final = SYSTEM / "logs" / "dcg-launches.sqlite"
+SPOOL: Final = DCG_CACHE / "launches.spool"
+SPOOL_LOCK: Final = DCG_CACHE / "launches.lock"
+NOTES_ENV: Final = "DCG_LAUNCH_NOTES"
+
+INGEST_EVERY: Final = 5
+KEEP_LAUNCHES: Final = 5000
+
+# see dcg.updater, the release a launch ran is the generated stamp of its manifest
+INSTALL_STATE: Final = DCG_HOME / ".dcg-install.json"
+
+_record: dict[str, Any] | None = None
+_notes: list[dict[str, Any]] = []
+
+
+def begin(system: str | None, emulator: str | None, core: str | None, rom: str | None) -> None:
+    """Open the record of this launch, helpers started from now on add to it."""
+    global _record
+    _record = {
+        "started": time.time(), "start_ns": time.monotonic_ns(),
+        "system": system, "emulator": emulator, "core": core, "rom": rom, "runner": None,
+        "phases": {}, "caches": {},
+    }
+    DCG_CACHE.mkdir(parents=True, exist_ok=True)
+    os.environ[NOTES_ENV] = str(DCG_CACHE / f"launch-{os.getpid()}.notes")
+    tracing.add_listener(_on_span)
+
+
+def _on_span(name: str, ms: float) -> None:
+    if _record is not None:
+        phases = _record["phases"]
+        phases[name] = round(phases.get(name, 0.0) + ms, 2)
+
+
+def watch(generator: Any) -> None:
+    """Time generator.generate(), the launch latency, for the open record."""
+    generate = generator.generate
+
+    @functools.wraps(generate)
+    def timed(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return generate(*args, **kwargs)
+        finally:
+            if _record is not None:
+                _record["generated_ns"] = time.monotonic_ns()
+                _record["latency_ms"] = round((_record["generated_ns"] - _record["start_ns"]) / 1e6, 1)
+
+    generator.generate = timed
+
+
+def _add(entry: dict[str, Any]) -> None:
+    """A note of a helper process, handed to the launcher when it exits."""
+    if not os.environ.get(NOTES_ENV):
+        return
+    if not _notes:
+        atexit.register(_append_notes)
+    _notes.append(entry)
+
+
+def _append_notes() -> None:
+    try:
+        with open(os.environ[NOTES_ENV], "a") as fp:
+            fp.write("".join(json.dumps(entry) + "\n" for entry in _notes))
+    except OSError:
+        pass
+
+
+def note(**fields: Any) -> None:
+    """Set fields of the launch record (runner...)."""
+    if _record is not None:
+        _record.update(fields)
+    else:
+        _add({"note": fields})
+
+
+def cache(name: str, hit: bool) -> None:
+    """Whether the cache name was warm for this launch."""
+    if _record is not None:
+        _record["caches"][name] = hit
+    else:
+        _add({"cache": name, "hit": hit})
+
+
+def _merge_notes(record: dict[str, Any], path: str) -> None:
+    try:
+        with open(path) as fp:
+            lines = fp.readlines()
+        os.unlink(path)
+    except OSError:
+        return
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if "phase" in entry:
+            record["phases"][entry["phase"]] = round(record["phases"].get(entry["phase"], 0.0) + entry["ms"], 2)
+        elif "cache" in entry:
+            record["caches"][entry["cache"]] = bool(entry["hit"])
+        elif "note" in entry:
+            record.update(entry["note"])
+
+
+def _version() -> str | None:
+    try:
+        with INSTALL_STATE.open() as fp:
+            return json.load(fp).get("generated")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def finish(exit_code: int | None) -> None:
+    """Spool the record of this launch once its emulator exited, it is stored later."""
+    global _record
+    record, _record = _record, None
+    notes = os.environ.pop(NOTES_ENV, None)
+    if record is None or "generated_ns" not in record:
+        # not a dcg generator, or generate() never ran
+        if notes:
+            Path(notes).unlink(missing_ok=True)
+        return
+    if notes:
+        _merge_notes(record, notes)
+    record["session_s"] = round((time.monotonic_ns() - record.pop("generated_ns")) / 1e9, 1)
+    del record["start_ns"]
+    record["exit_code"] = exit_code
+    record["version"] = _version()
+
+    try:
+        with SPOOL.open("a+") as fp:
+            fp.write(json.dumps(record, separators=(",", ":")) + "\n")
+            fp.seek(0)
+            pending = sum(1 for _ in fp)
+    except OSError as e:
+        eslog.warning(f"unable to spool the launch record: {e}")
+        return
+    if pending >= INGEST_EVERY:
+        ingest_in_background()
+
+
+# ------------------------------------------------------------
+# Database
+# ------------------------------------------------------------
+
+SCHEMA: Final = """
+CREATE TABLE IF NOT EXISTS launches (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    system TEXT,
+    game TEXT,
+    rom TEXT,
+    emulator TEXT,
+    core TEXT,
+    runner TEXT,
+    version TEXT,
+    latency_ms REAL,
+    session_s REAL,
+    exit_code INTEGER,
+    phases TEXT NOT NULL DEFAULT '{}',
+    caches TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS launches_game ON launches (system, game, started);
+"""
+
+COLUMNS: Final = ("started", "system", "game", "rom", "emulator", "core", "runner", "version",
+                  "latency_ms", "session_s", "exit_code", "phases", "caches")
+
+
+def connect(path: str | Path = HISTORY_DB) -> sqlite3.Connection:
+    import sqlite3
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _row(record: dict[str, Any]) -> tuple[Any, ...]:
+    rom = record.get("rom")
+    values = {**record, "game": Path(rom).stem if rom else None,
+              "phases": json.dumps(record.get("phases", {})), "caches": json.dumps(record.get("caches", {}))}
+    return tuple(values.get(column) for column in COLUMNS)
+
+
+def ingest(path: str | Path = HISTORY_DB) -> int:
+    """Insert the spooled records in one transaction; records inserted."""
+    SPOOL_LOCK.parent.mkdir(parents=True, exist_ok=True)
+    with SPOOL_LOCK.open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # launches spool to a new file while this batch is stored
+        taken = SPOOL.with_suffix(".ingesting")
+        if not taken.exists():
+            try:
+                os.replace(SPOOL, taken)
+            except FileNotFoundError:
+                return 0
+        rows = []
+        with taken.open() as fp:
+            for line in fp:
+                try:
+                    rows.append(_row(json.loads(line)))
+                except (ValueError, TypeError, AttributeError):
+                    eslog.warning("skipping a damaged launch record")
+        with connect(path) as conn:
+            conn.executemany(f"INSERT INTO launches ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            conn.execute("DELETE FROM launches WHERE id <= (SELECT MAX(id) FROM launches) - ?", (KEEP_LAUNCHES,))
+        conn.close()
+        taken.unlink()
+    return len(rows)
+
+
+def ingest_in_background() -> None:
+    try:
+        subprocess.Popen(
+            [sys.executable, "-m", "dcg.launchHistory", "ingest"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True, env={**os.environ, "PYTHONPATH": str(CONFIGGEN)},
+        )
+    except OSError as e:
+        eslog.warning(f"unable to store the launch history: {e}")
+
+
+# ------------------------------------------------------------
+# Reports
+# ------------------------------------------------------------
+
+# a game regressed when its median latency since the last update grew this much
+REGRESSION_RATIO: Final = 1.25
+REGRESSION_MIN_MS: Final = 100.0
+REGRESSION_MIN_RUNS: Final = 2
+# a game fails often when this share of its recent launches exited non-zero
+FAILURE_WINDOW: Final = 10
+FAILURE_RATE: Final = 0.3
+FAILURE_MIN: Final = 2
+
+
+def _percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of values, q in [0, 1]."""
+    import math
+
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _launches(conn: sqlite3.Connection, systems: Iterable[str] = ()) -> list[sqlite3.Row]:
+    systems = list(systems)
+    where = f"WHERE system IN ({', '.join('?' * len(systems))})" if systems else ""
+    return conn.execute(f"SELECT * FROM launches {where} ORDER BY started", systems).fetchall()
+
+
+def latencies(rows: Iterable[sqlite3.Row]) -> list[dict[str, Any]]:
+    """p50 and p95 launch latency per system and per game."""
+    groups: dict[tuple[str, str | None], list[float]] = {}
+    for row in rows:
+        if row["latency_ms"] is None:
+            continue
+        groups.setdefault((row["system"], None), []).append(row["latency_ms"])
+        groups.setdefault((row["system"], row["game"]), []).append(row["latency_ms"])
+    return [
+        {"system": system, "game": game, "launches": len(values),
+         "p50_ms": _percentile(values, 0.5), "p95_ms": _percentile(values, 0.95)}
+        for (system, game), values in sorted(groups.items(), key=lambda item: (item[0][0] or "", item[0][1] or ""))
+    ]
+
+
+def regressions(rows: Iterable[sqlite3.Row]) -> list[dict[str, Any]]:
+    """Games launching slower with the current release than with the one before it."""
+    import statistics
+
+    games: dict[tuple[str, str], dict[str | None, list[float]]] = {}
+    for row in rows:
+        if row["latency_ms"] is not None:
+            games.setdefault((row["system"], row["game"]), {}).setdefault(row["version"], []).append(row["latency_ms"])
+    found = []
+    for (system, game), versions in sorted(games.items()):
+        # dicts keep insertion order, versions are in the order they were first launched
+        if len(versions) < 2:
+            continue
+        (before, old), (after, new) = list(versions.items())[-2:]
+        if len(old) < REGRESSION_MIN_RUNS or len(new) < REGRESSION_MIN_RUNS:
+            continue
+        old_ms, new_ms = statistics.median(old), statistics.median(new)
+        if new_ms >= old_ms * REGRESSION_RATIO and new_ms - old_ms >= REGRESSION_MIN_MS:
+            found.append({"system": system, "game": game, "before": before, "after": after,
+                          "before_ms": old_ms, "after_ms": new_ms})
+    return found
+
+
+def failures(rows: Iterable[sqlite3.Row]) -> list[dict[str, Any]]:
+    """Games whose recent launches often exited non-zero."""
+    games: dict[tuple[str, str], list[int | None]] = {}
+    for row in rows:
+        games.setdefault((row["system"], row["game"]), []).append(row["exit_code"])
+    found = []
+    for (system, game), codes in sorted(games.items()):
+        recent = codes[-FAILURE_WINDOW:]
+        failed = [code for code in recent if code]
+        if len(failed) >= FAILURE_MIN and len(failed) >= FAILURE_RATE * len(recent):
+            found.append({"system": system, "game": game, "launches": len(recent), "failed": len(failed),
+                          "last_exit": next((code for code in reversed(recent) if code), None)})
+    return found
+
+
+def report(systems: Iterable[str] = (), path: str | Path = HISTORY_DB) -> dict[str, Any]:
+    ingest(path)
+    conn = connect(path)
+    try:
+        rows = _launches(conn, systems)
+    finally:
+        conn.close()
+    return {"launches": len(rows), "latency": latencies(rows), "regressions": regressions(rows), "failures": failures(rows)}
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.launchHistory", description="Launch history and latency reports.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("ingest", help="store the spooled launch records")
+    report_parser = sub.add_parser("report", help="latency percentiles, regressions and failing games")
+    report_parser.add_argument("--system", action="append", default=[], help="only this system (repeatable)")
+    report_parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.action == "ingest":
+        print(f"{ingest()} launches stored")
+        return 0
+
+    result = report(args.system)
+    if args.json:
+        print(json.dumps(result, indent=1))
+        return 0
+
+    print(f"{result['launches']} launches")
+    print(f"{'system':<12} {'game':<32} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9}")
+    for entry in result["latency"]:
+        print(f"{entry['system'] or '':<12} {entry['game'] or '(all)':<32} {entry['launches']:5} "
+              f"{entry['p50_ms']:9.1f} {entry['p95_ms']:9.1f}")
+    for entry in result["regressions"]:
+        print(f"REGRESSED {entry['system']}/{entry['game']}: {entry['before_ms']:.0f} -> {entry['after_ms']:.0f} ms "
+              f"since {entry['after']}")
+    for entry in result["failures"]:
+        print(f"FAILING   {entry['system']}/{entry['game']}: {entry['failed']} of the last {entry['launches']} launches, "
+              f"last exit {entry['last_exit']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
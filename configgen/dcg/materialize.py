@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg.paths import DCG_CACHE
+
+if TYPE_CHECKING:
+    from configparser import RawConfigParser
+    from xml.etree.ElementTree import ElementTree
+
+eslog = logging.getLogger(__name__)
+
+FINGERPRINTS: Final = DCG_CACHE / "fingerprints.json"
+
+_fingerprints: dict[str, list[Any]] | None = None
+# setup steps write configs from several threads, see dcg.taskGraph
+_fingerprints_lock = threading.Lock()
+
+
+# ------------------------------------------------------------
+# Fingerprint cache
+# ------------------------------------------------------------
+
+def _load() -> dict[str, list[Any]]:
+    global _fingerprints
+    with _fingerprints_lock:
+        if _fingerprints is None:
+            try:
+                with FINGERPRINTS.open() as fp:
+                    _fingerprints = json.load(fp)
+            except (OSError, ValueError):
+                _fingerprints = {}
+    return _fingerprints
+
+
+def _remember(path: str, st: os.stat_result, digest: str) -> None:
+    fingerprints = _load()
+    with _fingerprints_lock:
+        fingerprints[path] = [st.st_size, st.st_mtime_ns, digest]
+        try:
+            atomic_write(FINGERPRINTS, json.dumps(fingerprints, separators=(",", ":")).encode(), sync=False)
+        except OSError as e:
+            eslog.warning(f"unable to store config fingerprints: {e}")
+
+
+# ------------------------------------------------------------
+# Writers
+# ------------------------------------------------------------
+
+def atomic_write(path: str | Path, data: bytes, sync: bool = True) -> None:
+    """Write data to a temporary file next to path and rename it over path."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_native_id()}.tmp")
+    try:
+        with tmp.open("wb") as fp:
+            fp.write(data)
+            if sync:
+                fp.flush()
+                os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if sync:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def write_if_changed(path: str | Path, data: bytes) -> bool:
+    """Make path contain data, touching the disk only when it differs.
+
+    A cached (size, mtime, hash) of what was last written lets an unchanged
+    file be skipped without reading it back. Returns True if path was written.
+    """
+    key = os.path.abspath(path)
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        st = os.stat(key)
+    except FileNotFoundError:
+        st = None
+
+    if st is not None:
+        if _load().get(key) == [st.st_size, st.st_mtime_ns, digest]:
+            return False
+        if st.st_size == len(data):
+            with open(key, "rb") as fp:
+                if fp.read() == data:
+                    _remember(key, st, digest)
+                    return False
+
+    atomic_write(key, data)
+    _remember(key, os.stat(key), digest)
+    eslog.debug(f"wrote {key}")
+    return True
+
+
+def copy_if_changed(src: str | Path, dest: str | Path) -> bool:
+    with open(src, "rb") as fp:
+        return write_if_changed(dest, fp.read())
+
+
+# ------------------------------------------------------------
+# Renderers
+# ------------------------------------------------------------
+
+def render_ini(config: RawConfigParser, encoding: str = "utf_8_sig") -> bytes:
+    buffer = io.StringIO()
+    config.write(buffer)
+    return buffer.getvalue().encode(encoding)
+
+
+def render_xml(tree: ElementTree) -> bytes:
+    buffer = io.BytesIO()
+    tree.write(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg import batoceraSettings, launchHistory, supervisor, tracing
+from dcg.materialize import atomic_write
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Paths and limits
+# ------------------------------------------------------------
+
+# tmpfs, like the mounts themselves the state does not outlive a reboot
+MOUNT_ROOT: Final = Path("/var/run/wine")
+MOUNT_STATE: Final = MOUNT_ROOT / "dcg-mounts.json"
+MOUNT_LOCK: Final = MOUNT_ROOT / ".dcg-mounts.lock"
+
+# batocera.conf keys, the number of idle stacks kept and the MemAvailable (MiB) they may not eat into
+MAX_STACKS_KEY: Final = "windows.mountcache.max"
+MIN_AVAILABLE_KEY: Final = "windows.mountcache.minfree"
+DEFAULT_MAX_STACKS: Final = 3
+DEFAULT_MIN_AVAILABLE_MB: Final = 512
+
+
+def _limits() -> tuple[int, int]:
+    def setting(key: str, default: int) -> int:
+        try:
+            return max(0, int(batoceraSettings.get(key, default=str(default))))
+        except ValueError:
+            eslog.warning(f"ignoring {key}, not a number")
+            return default
+
+    return setting(MAX_STACKS_KEY, DEFAULT_MAX_STACKS), setting(MIN_AVAILABLE_KEY, DEFAULT_MIN_AVAILABLE_MB)
+
+
+def _mem_available_mb() -> int | None:
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# ------------------------------------------------------------
+# State
+# ------------------------------------------------------------
+
+_OCTAL_ESCAPE: Final = re.compile(r"\\([0-7]{3})")
+
+
+def _mounted() -> set[str]:
+    """Mount points of this mount namespace, octal escapes decoded."""
+    points = set()
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8", errors="surrogateescape") as fp:
+            for line in fp:
+                points.add(_OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), line.split(" ", 5)[4]))
+    except (OSError, IndexError):
+        pass
+    return points
+
+
+def _start_time(pid: int) -> int | None:
+    """Start time of pid in clock ticks since boot, field 22 of /proc/<pid>/stat."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as fp:
+            stat = fp.read()
+        # comm, the second field, may hold spaces and parentheses
+        return int(stat[stat.rindex(b")") + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _alive(pid: int | None, started: int | None = None) -> bool:
+    """Whether pid runs, and is still the process started at started rather than one reusing its pid."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return started is None or _start_time(pid) in (started, None)
+
+
+def _in_use(stack: dict[str, Any]) -> bool:
+    return _alive(stack["pid"], stack.get("started"))
+
+
+@contextmanager
+def _state() -> Iterator[dict[str, dict[str, Any]]]:
+    """The cached stacks keyed by overlay mount point, saved back on exit."""
+    MOUNT_ROOT.mkdir(parents=True, exist_ok=True)
+    with MOUNT_LOCK.open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with MOUNT_STATE.open() as fp:
+                    stacks = json.load(fp)
+            except (OSError, ValueError):
+                stacks = {}
+            before = json.dumps(stacks, sort_keys=True)
+            yield stacks
+            if json.dumps(stacks, sort_keys=True) != before:
+                atomic_write(MOUNT_STATE, json.dumps(stacks, indent=1).encode(), sync=False)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# ------------------------------------------------------------
+# Mounting
+# ------------------------------------------------------------
+
+def _umount(point: str) -> bool:
+    for flags in (["-l"], ["-f"]):
+        if subprocess.run(["umount", *flags, point], stderr=subprocess.DEVNULL).returncode == 0:
+            return True
+    return point not in _mounted()
+
+
+def _teardown(stack: dict[str, Any]) -> bool:
+    """Unmount the overlay then its squashfs and remove the mount points and workdir."""
+    with tracing.span("mount_cache.teardown", image=stack["image"]):
+        mounted = _mounted()
+        for point in (stack["overlay"], stack["squashfs"]):
+            if point in mounted and not _umount(point):
+                eslog.error(f"unable to unmount {point}")
+                return False
+        # upperdir holds the game's changes and saves, it stays
+        for path in (stack["squashfs"], stack["work"], stack["overlay"]):
+            shutil.rmtree(path, ignore_errors=True)
+    return True
+
+
+def _mount(stack: dict[str, Any]) -> None:
+    with tracing.span("mount_cache.mount", image=stack["image"]):
+        for path in (stack["squashfs"], stack["work"], stack["overlay"]):
+            shutil.rmtree(path, ignore_errors=True)
+        for path in (stack["upper"], stack["work"], stack["overlay"], stack["squashfs"]):
+            Path(path).mkdir(parents=True, exist_ok=True)
+        try:
+            subprocess.run(["mount", stack["image"], stack["squashfs"]], check=True)
+            subprocess.run([
+                "mount", "-t", "overlay",
+                "-o", f"rw,lowerdir={stack['squashfs']},upperdir={stack['upper']},workdir={stack['work']},redirect_dir=on",
+                "overlay", stack["overlay"],
+            ], check=True)
+        except (OSError, subprocess.CalledProcessError):
+            _teardown(stack)
+            raise
+
+
+def _stamp(image: str) -> list[int]:
+    st = os.stat(image)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def acquire(image: str, overlay: str, squashfs: str, upper: str, work: str, pid: int) -> bool:
+    """Mount image as an overlay on overlay, reusing a cached stack when the image
+    is unchanged. Returns True when an existing stack was reused."""
+    wanted = {
+        "image": image, "stamp": _stamp(image), "overlay": overlay,
+        "squashfs": squashfs, "upper": upper, "work": work,
+    }
+    with _state() as stacks:
+        stack = stacks.get(overlay)
+        if stack is not None:
+            if stack["pid"] != pid and _in_use(stack):
+                raise RuntimeError(f"{overlay} is in use by process {stack['pid']}")
+            mounted = _mounted()
+            if {k: stack.get(k) for k in wanted} == wanted and overlay in mounted and squashfs in mounted:
+                stack.update(pid=pid, started=_start_time(pid), last_used=time.time())
+                eslog.info(f"reusing the mounted {os.path.basename(image)}")
+                return True
+            if not _teardown(stack):
+                raise RuntimeError(f"unable to unmount the previous stack on {overlay}")
+            del stacks[overlay]
+        else:
+            # left behind by a launch that did not go through the cache
+            _teardown(wanted)
+
+        _mount(wanted)
+        stacks[overlay] = {**wanted, "pid": pid, "started": _start_time(pid), "mounted": time.time(), "last_used": time.time()}
+    return False
+
+
+def release(overlay: str) -> bool:
+    """Mark a stack idle, returns True when the cache is now over its limits."""
+    with _state() as stacks:
+        if overlay in stacks:
+            stacks[overlay].update(pid=None, started=None, last_used=time.time())
+        return bool(_over_limits(stacks))
+
+
+def _idle(stacks: dict[str, dict[str, Any]]) -> list[dict[str, Any]]:
+    """Idle stacks, least recently used first."""
+    return sorted((s for s in stacks.values() if not _in_use(s)), key=lambda s: s["last_used"])
+
+
+def _over_limits(stacks: dict[str, dict[str, Any]]) -> list[dict[str, Any]]:
+    """The idle stacks to evict to get back within the count and memory limits."""
+    max_stacks, min_available = _limits()
+    idle = _idle(stacks)
+    victims = idle[:max(0, len(idle) - max_stacks)]
+    available = _mem_available_mb()
+    if available is not None and available < min_available:
+        # nothing tells what a stack pins in memory, drop them oldest first
+        victims = idle
+    return victims
+
+
+def trim() -> list[str]:
+    """Evict idle stacks beyond the limits, least recently used first."""
+    evicted = []
+    with _state() as stacks:
+        for stack in _over_limits(stacks):
+            if _teardown(stack):
+                del stacks[stack["overlay"]]
+                evicted.append(stack["image"])
+    return evicted
+
+
+def trim_in_background() -> None:
+    """Run trim in a detached process so unmounting stays off the exit path.
+
+    Under dcg.supervisor it is handed off, the teardown of the game would
+    kill it otherwise.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "dcg.mountCache", "trim"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    supervisor.hand_off(proc.pid)
+
+
+def evict(targets: list[str], force: bool = False) -> list[str]:
+    """Tear down the stacks of targets (images or overlay mount points), all idle ones when empty."""
+    evicted = []
+    with _state() as stacks:
+        for stack in list(stacks.values()):
+            if targets and stack["image"] not in targets and stack["overlay"] not in targets:
+                continue
+            if _in_use(stack) and not force:
+                eslog.warning(f"{stack['image']} is in use by process {stack['pid']}, not evicted")
+                continue
+            if _teardown(stack):
+                del stacks[stack["overlay"]]
+                evicted.append(stack["image"])
+    return evicted
+
+
+def status() -> list[dict[str, Any]]:
+    mounted = _mounted()
+    with _state() as stacks:
+        result = []
+        for stack in sorted(stacks.values(), key=lambda s: s["last_used"], reverse=True):
+            try:
+                current = _stamp(stack["image"]) == stack["stamp"]
+            except OSError:
+                current = False
+            result.append({
+                **stack,
+                "in_use": _in_use(stack),
+                "mounted": stack["overlay"] in mounted and stack["squashfs"] in mounted,
+                "current": current,
+            })
+    return result
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="dcg.mountCache", description="Keep wsquashfs overlay stacks mounted between launches.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    acquire_parser = sub.add_parser("acquire", help="mount an image, reusing its cached stack")
+    acquire_parser.add_argument("--squashfs", required=True, help="squashfs mount point")
+    acquire_parser.add_argument("--upper", required=True, help="overlay upperdir, keeps the game's changes")
+    acquire_parser.add_argument("--work", required=True, help="overlay workdir")
+    acquire_parser.add_argument("--pid", type=int, default=os.getppid(), help="process using the stack")
+    acquire_parser.add_argument("image")
+    acquire_parser.add_argument("overlay", help="overlay mount point, the wine prefix")
+    release_parser = sub.add_parser("release", help="mark a stack idle and trim the cache in the background")
+    release_parser.add_argument("overlay")
+    sub.add_parser("trim", help="evict idle stacks beyond the limits")
+    sub.add_parser("status", help="show the cached stacks")
+    evict_parser = sub.add_parser("evict", help="unmount cached stacks now")
+    evict_parser.add_argument("--force", action="store_true", help="also evict stacks in use")
+    evict_parser.add_argument("targets", nargs="*", help="images or overlay mount points, every idle stack when omitted")
+    args = parser.parse_args(argv)
+
+    if args.action == "acquire":
+        try:
+            reused = acquire(os.path.abspath(args.image), args.overlay, args.squashfs, args.upper, args.work, args.pid)
+        except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+            print(f"unable to mount {args.image}: {e}", file=sys.stderr)
+            return 1
+        launchHistory.cache("mount_stack", reused)
+        return 0
+
+    if args.action == "release":
+        if release(args.overlay):
+            trim_in_background()
+        return 0
+
+    if args.action in ("trim", "evict"):
+        for image in trim() if args.action == "trim" else evict([os.path.abspath(t) for t in args.targets], args.force):
+            print(f"evicted {image}")
+        return 0
+
+    for stack in status():
+        state = "in use" if stack["in_use"] else "idle"
+        if not stack["mounted"]:
+            state = "lost"
+        elif not stack["current"]:
+            state += ", stale"
+        idle = time.time() - stack["last_used"]
+        print(f"{os.path.basename(stack['image']):<40} {state:<14} {idle / 60:8.1f} min  {stack['overlay']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
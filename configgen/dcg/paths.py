@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Final
+
+# ------------------------------------------------------------
+# Shared dcg paths
+# ------------------------------------------------------------
+
+# DCG_USERDATA relocates everything below /userdata, for the offline benchmarks
+USERDATA: Final = Path(os.environ.get("DCG_USERDATA", "/userdata"))
+SYSTEM: Final = USERDATA / "system"
+ROMS: Final = USERDATA / "roms"
+BATOCERA_CONF: Final = SYSTEM / "batocera.conf"
+
+DCG_HOME: Final = SYSTEM / "dcg"
+DCG_CACHE: Final = SYSTEM / "cache" / "dcg"
+
+WINE_BOTTLES: Final = SYSTEM / "wine-bottles"
+PREFIX_TEMPLATES: Final = WINE_BOTTLES / ".templates"
+
+# holds the dcg package, the PYTHONPATH of "python -m dcg.<helper>" started by the launcher
+CONFIGGEN: Final = Path(__file__).resolve().parent.parent
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg import batoceraSettings, prepare, tracing
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Settings
+# ------------------------------------------------------------
+
+# batocera.conf key, MiB read ahead per launch, 0 to disable
+BUDGET_KEY: Final = "dcg.prefetch.size"
+DEFAULT_BUDGET_MB: Final = 1024
+
+WORKERS: Final = 4
+# unit of work, small enough for the workers to share one big CHD
+CHUNK: Final = 8 * 1024 * 1024
+
+
+def _budget() -> int:
+    try:
+        return max(0, int(batoceraSettings.get(BUDGET_KEY, default=str(DEFAULT_BUDGET_MB)))) * 1024 ** 2
+    except ValueError:
+        eslog.warning(f"ignoring {BUDGET_KEY}, not a number")
+        return DEFAULT_BUDGET_MB * 1024 ** 2
+
+
+def _expand(paths: Iterable[str | Path]) -> Iterator[str]:
+    """Files of paths in the order given, directories walked in name order."""
+    seen: set[str] = set()
+    for path in paths:
+        path = os.fspath(path)
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for file in files:
+            if file not in seen:
+                seen.add(file)
+                yield file
+
+
+# ------------------------------------------------------------
+# Prefetch
+# ------------------------------------------------------------
+
+class Prefetch:
+    """Page cache read-ahead of the files a launch is about to read, by background threads.
+
+    Files are taken in the order given until the byte budget is spent, the
+    last one possibly only in part. The kernel is asked to read each chunk
+    with POSIX_FADV_WILLNEED, which returns once the reads are queued.
+    """
+
+    def __init__(self, name: str, paths: Iterable[str | Path], budget: int) -> None:
+        self.name = name
+        self.budget = budget
+        self.files = self.bytes = self.skipped = 0
+        self.elapsed: float | None = None
+        self.finished = threading.Event()
+        self._chunks = self._plan(paths)
+        self._lock = threading.Lock()
+        self._running = WORKERS
+        self._start = time.monotonic()
+        for i in range(WORKERS):
+            threading.Thread(target=self._work, name=f"prefetch-{i}", daemon=True).start()
+
+    def _plan(self, paths: Iterable[str | Path]) -> Iterator[tuple[str, int, int]]:
+        """(file, offset, length) chunks within the budget, pulled by the workers under the lock."""
+        remaining = self.budget
+        for file in _expand(paths):
+            try:
+                size = os.stat(file).st_size
+            except OSError:
+                self.skipped += 1
+                continue
+            if remaining <= 0:
+                self.skipped += 1
+                continue
+            length = min(size, remaining)
+            remaining -= length
+            self.files += 1
+            for offset in range(0, length, CHUNK):
+                yield file, offset, min(CHUNK, length - offset)
+
+    def _work(self) -> None:
+        with tracing.span("prefetch.worker", launch=self.name):
+            while True:
+                with self._lock:
+                    chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                file, offset, length = chunk
+                try:
+                    fd = os.open(file, os.O_RDONLY)
+                    try:
+                        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    continue
+                with self._lock:
+                    self.bytes += length
+
+        with self._lock:
+            self._running -= 1
+            if self._running:
+                return
+            self.elapsed = time.monotonic() - self._start
+        eslog.info(f"{self.name}: prefetched {self.files} files, {self.bytes / 1048576:.1f} MiB "
+                   f"in {self.elapsed * 1000:.0f} ms ({self.skipped} skipped)")
+        self.finished.set()
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "skipped": self.skipped,
+                "ms": round(self.elapsed * 1000, 1) if self.elapsed is not None else None,
+                "finished": self.finished.is_set(),
+            }
+
+    def wait(self, timeout: float | None = None) -> dict[str, Any]:
+        self.finished.wait(timeout)
+        return self.report()
+
+
+def start(name: str, paths: Iterable[str | Path]) -> Prefetch | None:
+    """Start reading paths ahead in the background, None when prefetching is disabled or nothing starts."""
+    budget = _budget()
+    if not budget or prepare.dry_run():
+        return None
+    return Prefetch(name, paths, budget)
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.prefetch", description="Read files ahead into the page cache.")
+    parser.add_argument("--budget", type=int, default=None, help=f"MiB to read ahead, default {BUDGET_KEY} or {DEFAULT_BUDGET_MB}")
+    parser.add_argument("paths", nargs="+", help="files or directories, most urgent first")
+    args = parser.parse_args(argv)
+
+    budget = _budget() if args.budget is None else args.budget * 1024 ** 2
+    report = Prefetch("prefetch", args.paths, budget).wait()
+    print(f"prefetched {report['files']} files, {report['bytes'] / 1048576:.1f} MiB in {report['ms']:.0f} ms "
+          f"({report['skipped']} skipped)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg import batoceraSettings
+from dcg.dirSync import FICLONE
+from dcg.paths import PREFIX_TEMPLATES, WINE_BOTTLES
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping
+
+eslog = logging.getLogger(__name__)
+
+TEMPLATE_INFO: Final = "template.json"
+
+# batocera.conf key, "overlay" to create new prefixes as overlays of their template, else they are cloned
+CLONE_KEY: Final = "windows.prefix.clone"
+# kept next to an overlay prefix: its upper and work dirs and OVERLAY_INFO naming the template
+OVERLAY_INFO: Final = "overlay.json"
+
+
+# ------------------------------------------------------------
+# Runner identity
+# ------------------------------------------------------------
+
+def runner_fingerprint(runner_dir: str | Path) -> str:
+    """Identify a runner build, so replacing a runner in place invalidates its template."""
+    runner_dir = Path(runner_dir)
+    st = (runner_dir / "bin" / "wineserver").stat()
+    return hashlib.sha1(f"{runner_dir.resolve()}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+
+
+def template_path(runner_dir: str | Path) -> Path:
+    return PREFIX_TEMPLATES / f"{Path(runner_dir).name}-{runner_fingerprint(runner_dir)}"
+
+
+def _read_info(template: Path) -> dict[str, Any]:
+    try:
+        with (template / TEMPLATE_INFO).open() as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def _templates_lock() -> Iterator[None]:
+    PREFIX_TEMPLATES.mkdir(parents=True, exist_ok=True)
+    with (PREFIX_TEMPLATES / ".lock").open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# ------------------------------------------------------------
+# Templates
+# ------------------------------------------------------------
+
+def kill_wine(runner_dir: str | Path, env: Mapping[str, str]) -> None:
+    """Kill every wine process of the prefix env's WINEPREFIX names, what a killed wine leaves running."""
+    try:
+        subprocess.run([str(Path(runner_dir) / "bin" / "wineserver"), "-k"], env=env, check=False, timeout=10,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        eslog.warning(f"unable to kill wine in {env.get('WINEPREFIX')}: {e}")
+
+
+def build_template(runner_dir: str | Path, wine_binary: str | Path, env: Mapping[str, str] | None = None,
+                   timeout: float | None = None) -> Path:
+    """Initialise a fresh prefix for the runner and keep it as its template.
+
+    Past timeout seconds wine is killed and subprocess.TimeoutExpired raised.
+    """
+    runner_dir = Path(runner_dir)
+    target = template_path(runner_dir)
+
+    with _templates_lock():
+        if (target / TEMPLATE_INFO).exists():
+            return target
+
+        building = target.with_name(f"{target.name}.building")
+        shutil.rmtree(building, ignore_errors=True)
+        building.mkdir(parents=True)
+
+        wine_env = dict(os.environ if env is None else env)
+        wine_env.update({"WINEPREFIX": str(building), "WINEDEBUG": "-all", "WINEDLLOVERRIDES": "winegstreamer="})
+        eslog.info(f"building wine prefix template {target.name}")
+        start = time.monotonic()
+        try:
+            subprocess.run([str(wine_binary), "hostname"], env=wine_env, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+            # the registry is only flushed once wineserver is gone
+            subprocess.run([str(runner_dir / "bin" / "wineserver"), "-w"], env=wine_env, check=False,
+                           timeout=None if timeout is None else max(0.0, start + timeout - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            kill_wine(runner_dir, wine_env)
+            shutil.rmtree(building, ignore_errors=True)
+            raise
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(building, ignore_errors=True)
+            raise
+
+        with (building / TEMPLATE_INFO).open("w") as fp:
+            json.dump({
+                "runner": str(runner_dir),
+                "fingerprint": runner_fingerprint(runner_dir),
+                "created": int(time.time()),
+                "build_seconds": round(time.monotonic() - start, 1),
+            }, fp)
+        building.rename(target)
+
+        # a runner updated in place leaves its previous template behind, unless overlay prefixes still sit on it
+        in_use = overlay_templates()
+        for path in PREFIX_TEMPLATES.iterdir():
+            if path != target and path not in in_use and _read_info(path).get("runner") == str(runner_dir):
+                shutil.rmtree(path, ignore_errors=True)
+    return target
+
+
+def clone_prefix(template: Path, dest: str | Path) -> dict[str, int]:
+    """Clone template into dest, which must be missing or empty.
+
+    Files are reflinked when the filesystem supports it and copied
+    otherwise, never hardlinked: installers overwrite DLLs in place
+    (CopyFile truncates the existing file), which would rewrite the
+    template and every bottle sharing the inode.
+    """
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    if any(dest.iterdir()):
+        raise FileExistsError(f"{dest} is not empty")
+
+    counts = {"reflink": 0, "copy": 0}
+    reflink = True
+    for root, dirs, files in os.walk(template):
+        rel = os.path.relpath(root, template)
+        target_root = dest if rel == "." else dest / rel
+        for name in dirs:
+            src = os.path.join(root, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), target_root / name)
+            else:
+                (target_root / name).mkdir()
+        for name in files:
+            if rel == "." and name == TEMPLATE_INFO:
+                continue
+            src = os.path.join(root, name)
+            dst = target_root / name
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                continue
+            if reflink:
+                try:
+                    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    shutil.copystat(src, dst)
+                    counts["reflink"] += 1
+                    continue
+                except OSError:
+                    # unsupported here, don't probe again for every file
+                    reflink = False
+                    dst.unlink(missing_ok=True)
+            shutil.copy2(src, dst)
+            counts["copy"] += 1
+    return counts
+
+
+# ------------------------------------------------------------
+# Overlay prefixes
+#
+# With windows.prefix.clone=overlay a new prefix is an overlayfs mount:
+# the template is its read-only lowerdir, and what wine and the game write
+# goes to an upper dir kept next to it in .<prefix>.overlay. A prefix then
+# only takes the space of what changed, on any filesystem able to hold an
+# upper dir (ext4, btrfs, not exFAT), and a file rewritten in place is
+# copied up first, the template is never written through. Mounts do not
+# outlive a reboot, remount() mounts a prefix again before it is used.
+# ------------------------------------------------------------
+
+def overlay_dir(dest: str | Path) -> Path:
+    dest = Path(dest)
+    return dest.parent / f".{dest.name}.overlay"
+
+
+def overlay_templates() -> set[Path]:
+    """Templates overlay prefixes sit on, they may not be removed."""
+    in_use = set()
+    for pattern in (f"*/.*.overlay/{OVERLAY_INFO}", f"*/*/.*.overlay/{OVERLAY_INFO}", f".*.overlay/{OVERLAY_INFO}"):
+        for path in WINE_BOTTLES.glob(pattern):
+            try:
+                with path.open() as fp:
+                    in_use.add(Path(json.load(fp)["template"]))
+            except (OSError, ValueError, KeyError):
+                continue
+    return in_use
+
+
+def _mount_overlay(dest: Path, template: Path) -> None:
+    overlay = overlay_dir(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    subprocess.run([
+        "mount", "-t", "overlay",
+        "-o", f"lowerdir={template},upperdir={overlay / 'upper'},workdir={overlay / 'work'}",
+        "overlay", str(dest),
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def overlay_prefix(template: Path, dest: str | Path) -> None:
+    """Mount dest, which must be missing or empty, as an overlay of template."""
+    dest = Path(dest)
+    if dest.exists() and any(dest.iterdir()):
+        raise FileExistsError(f"{dest} is not empty")
+    overlay = overlay_dir(dest)
+    shutil.rmtree(overlay, ignore_errors=True)
+    (overlay / "upper").mkdir(parents=True)
+    (overlay / "work").mkdir()
+    try:
+        _mount_overlay(dest, template)
+    except (OSError, subprocess.CalledProcessError):
+        shutil.rmtree(overlay, ignore_errors=True)
+        raise
+    # written last, a prefix whose mount failed is not taken for an overlay one
+    with (overlay / OVERLAY_INFO).open("w") as fp:
+        json.dump({"template": str(template), "created": int(time.time())}, fp)
+
+
+def remount(dest: str | Path) -> bool:
+    """Mount dest again if it is an overlay prefix that is not mounted; whether it is an overlay prefix."""
+    dest = Path(dest)
+    try:
+        with (overlay_dir(dest) / OVERLAY_INFO).open() as fp:
+            template = Path(json.load(fp)["template"])
+    except FileNotFoundError:
+        return False
+    if not os.path.ismount(dest):
+        _mount_overlay(dest, template)
+        eslog.debug(f"mounted {dest} over {template.name}")
+    return True
+
+
+def create_prefix(dest: str | Path, runner_dir: str | Path, wine_binary: str | Path, env: Mapping[str, str] | None = None,
+                  timeout: float | None = None) -> bool:
+    """Create a wine prefix from the runner's template, building it on first use.
+
+    The prefix is an overlay of the template with windows.prefix.clone=overlay
+    where it can be mounted, a clone of it otherwise. Returns False when no clone could be made, the caller should then fall
+    back to initialising the prefix with wine itself. A template build
+    running past timeout seconds raises subprocess.TimeoutExpired.
+    """
+    # an overlay prefix that fails to mount must not be replaced by a blank one
+    if remount(dest):
+        return True
+    try:
+        template = template_path(runner_dir)
+        if not (template / TEMPLATE_INFO).exists():
+            template = build_template(runner_dir, wine_binary, env, timeout)
+        if batoceraSettings.get(CLONE_KEY) == "overlay":
+            try:
+                overlay_prefix(template, dest)
+                eslog.debug(f"mounted {dest} over {template.name}")
+                return True
+            except (OSError, subprocess.CalledProcessError) as e:
+                eslog.warning(f"unable to mount {dest} as an overlay of {template.name}, cloning it: {e}")
+        counts = clone_prefix(template, dest)
+    except (OSError, subprocess.CalledProcessError) as e:
+        eslog.warning(f"unable to create {dest} from a prefix template: {e}")
+        if isinstance(e, FileExistsError):
+            return False
+        # leave an empty prefix behind for the wine fallback
+        shutil.rmtree(dest, ignore_errors=True)
+        Path(dest).mkdir(parents=True, exist_ok=True)
+        return False
+    eslog.debug(f"cloned {template.name} into {dest}: {counts}")
+    return True
+
+
+def list_templates() -> list[dict[str, Any]]:
+    templates = []
+    if not PREFIX_TEMPLATES.is_dir():
+        return templates
+    for path in sorted(PREFIX_TEMPLATES.iterdir()):
+        if not path.is_dir():
+            continue
+        info: dict[str, Any] = {"name": path.name, "path": str(path), "state": "building"}
+        info.update(_read_info(path))
+        if "fingerprint" in info:
+            try:
+                current = runner_fingerprint(info["runner"]) == info["fingerprint"]
+            except OSError:
+                current = False
+            info["state"] = "current" if current else "stale"
+        info["bytes"] = sum(
+            (Path(root) / name).lstat().st_size for root, _, files in os.walk(path) for name in files
+        )
+        templates.append(info)
+    return templates
+
+
+def gc_templates() -> list[str]:
+    """Remove templates of runners that were removed or updated, and aborted builds."""
+    removed = []
+    with _templates_lock():
+        in_use = overlay_templates()
+        for info in list_templates():
+            if info["state"] != "current" and Path(info["path"]) not in in_use:
+                shutil.rmtree(info["path"], ignore_errors=True)
+                removed.append(info["name"])
+    return removed
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.prefixTemplates", description="Manage golden wine prefix templates.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("list", help="show templates, their state and size")
+    sub.add_parser("gc", help="remove stale templates")
+    clone = sub.add_parser("clone", help="create a prefix from the runner's template")
+    clone.add_argument("--runner", required=True, help="runner directory, e.g. /usr/wine/wine-tkg")
+    clone.add_argument("--wine", required=True, help="wine binary used to build a missing template")
+    clone.add_argument("prefix")
+    mount = sub.add_parser("mount", help="mount an overlay prefix again, after a reboot")
+    mount.add_argument("prefix")
+    args = parser.parse_args(argv)
+
+    if args.action == "list":
+        for info in list_templates():
+            print(f"{info['name']:<40} {info['state']:<8} {info['bytes'] / 1048576:8.1f} MiB  {info.get('runner', '')}")
+        return 0
+
+    if args.action == "gc":
+        for name in gc_templates():
+            print(f"removed {name}")
+        return 0
+
+    if args.action == "mount":
+        try:
+            return 0 if remount(args.prefix) else 1
+        except (OSError, subprocess.CalledProcessError, ValueError, KeyError) as e:
+            print(f"unable to mount {args.prefix}: {e}", file=sys.stderr)
+            return 1
+
+    return 0 if create_prefix(args.prefix, args.runner, args.wine) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final, NamedTuple
+
+from dcg.paths import SYSTEM, USERDATA
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Dry run
+#
+# dcglauncher --prepare runs the generate() of every game without starting
+# it, so the configuration files, indexes, Demul prefix and extracted
+# runtimes a launch reads are in place before the first real one. While
+# DRY_RUN_ENV is set, what only pays off for a launch about to start
+# (prefetch, shader cache launch counts) stands down and what a launch
+# leaves to the background (AppImage extraction) is done in the foreground.
+# ------------------------------------------------------------
+
+DRY_RUN_ENV: Final = "DCG_DRY_RUN"
+
+
+def dry_run() -> bool:
+    return os.environ.get(DRY_RUN_ENV) == "1"
+
+
+# ------------------------------------------------------------
+# Games
+# ------------------------------------------------------------
+
+# where install.sh copies configs/emulationstations
+ES_SYSTEMS: Final = SYSTEM / "configs" / "emulationstation"
+ES_SYSTEMS_GLOB: Final = "es_systems_*.cfg"
+
+GAME_RESOLUTION: Final = {"width": 1920, "height": 1080}
+
+
+class Game(NamedTuple):
+    system: str
+    emulator: str
+    core: str | None
+    rom: str
+
+
+def _relocate(path: str) -> Path:
+    """An es_systems path, below DCG_USERDATA when it points into /userdata."""
+    if path.startswith("/userdata/"):
+        return USERDATA / path[len("/userdata/"):]
+    return Path(path)
+
+
+def load_systems(directory: Path = ES_SYSTEMS) -> list[dict[str, Any]]:
+    """name, ROM folder, extensions, emulators (with their default core) and default emulator of each system."""
+    import xml.etree.ElementTree as ET
+
+    systems = []
+    for cfg in sorted(directory.glob(ES_SYSTEMS_GLOB)):
+        try:
+            root = ET.parse(cfg).getroot()
+        except (OSError, ET.ParseError) as e:
+            eslog.warning(f"skipping {cfg.name}: {e}")
+            continue
+        for node in root.iter("system"):
+            name = (node.findtext("name") or "").strip()
+            path = (node.findtext("path") or "").strip()
+            if not name or not path:
+                continue
+            emulators: dict[str, str | None] = {}
+            default = None
+            for emulator in node.iter("emulator"):
+                cores = list(emulator.iter("core"))
+                chosen = next((core for core in cores if core.get("default") == "true"), None)
+                emulators[emulator.get("name", "")] = (chosen if chosen is not None else cores[0]).text if cores else None
+                if chosen is not None and default is None:
+                    default = emulator.get("name")
+            systems.append({
+                "name": name,
+                "path": _relocate(path),
+                "extensions": frozenset(ext.lower() for ext in (node.findtext("extension") or "").split()),
+                "emulators": emulators,
+                "default": default or next(iter(emulators), None),
+            })
+    return systems
+
+
+def _roms(folder: Path, extensions: frozenset[str]) -> Iterator[Path]:
+    """Games of a system folder as EmulationStation lists them, .wine directories included."""
+    from dcg.romScanner import SKIP_DIRS
+
+    try:
+        entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        path = Path(entry.path)
+        if path.suffix.lower() in extensions:
+            yield path
+        elif entry.is_dir() and entry.name not in SKIP_DIRS:
+            yield from _roms(path, extensions)
+
+
+def games(systems: Iterable[dict[str, Any]]) -> list[Game]:
+    """Every game whose emulator, as batocera.conf resolves it, is served by a dcg generator."""
+    from dcg import batoceraSettings, registry
+
+    found = []
+    for system in systems:
+        name = system["name"]
+        for rom in _roms(system["path"], system["extensions"]):
+            emulator = batoceraSettings.get(f'{name}["{rom.name}"].emulator', f"{name}.emulator", default=system["default"])
+            if emulator not in registry.GENERATORS:
+                continue
+            core = batoceraSettings.get(f'{name}["{rom.name}"].core', f"{name}.core",
+                                        default=system["emulators"].get(emulator))
+            found.append(Game(name, emulator, core, str(rom)))
+    return found
+
+
+# ------------------------------------------------------------
+# Prepare
+# ------------------------------------------------------------
+
+def _system(game: Game) -> Any:
+    from argparse import Namespace
+
+    from configgen.Emulator import Emulator
+
+    rom = Path(game.rom)
+    args = Namespace(system=game.system, systemname=game.system, emulator=game.emulator, core=game.core,
+                     rom=rom, gameinfoxml=None)
+    return Emulator(args, rom)
+
+
+def prepare_game(game: Game) -> dict[str, Any]:
+    """Dry run the generate() of one game, in a worker process."""
+    from dcg import registry
+
+    os.environ[DRY_RUN_ENV] = "1"
+    error = None
+    start = time.perf_counter()
+    try:
+        command = registry.get_generator(game.emulator).generate(
+            _system(game), Path(game.rom), [], {}, [], [], GAME_RESOLUTION
+        )
+        if not command.array:
+            error = "empty command"
+    except Exception as e:
+        eslog.debug(f"{game.rom}: generate() failed", exc_info=True)
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - start
+    return {**game._asdict(), "status": "fail" if error else "pass", "ms": round(elapsed * 1000, 1), "error": error}
+
+
+def prepare(found: list[Game], jobs: int | None = None) -> list[dict[str, Any]]:
+    """prepare_game() every game, the results in the order of found.
+
+    The first game of each emulator goes alone, it creates what the others
+    then share (Demul prefix, extracted AppImage). The workers are forked
+    from the launcher, with configgen and the generators' imports loaded.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    seeds: dict[str, Game] = {}
+    for game in found:
+        seeds.setdefault(game.emulator, game)
+    rest = [game for game in found if seeds[game.emulator] is not game]
+
+    results: dict[Game, dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+        for batch in (list(seeds.values()), rest):
+            results.update(zip(batch, pool.map(prepare_game, batch)))
+    return [results[game] for game in found]
+
+
+def warm(systems: list[dict[str, Any]], scan: bool = True) -> dict[str, Any]:
+    """Fill the caches shared by every launch: batocera.conf snapshot and ROM verification."""
+    from dcg import batoceraSettings
+
+    batoceraSettings.load()
+    if not scan:
+        return {}
+    from dcg import romScanner
+
+    scanned = tuple(system for system in romScanner.SCAN_SYSTEMS if system in {s["name"] for s in systems})
+    return romScanner.scan(scanned)["summary"] if scanned else {}
+
+
+def run(only: Iterable[str] = (), jobs: int | None = None, scan: bool = True,
+        directory: Path = ES_SYSTEMS) -> dict[str, Any]:
+    start = time.monotonic()
+    only = set(only)
+    systems = [system for system in load_systems(directory) if not only or system["name"] in only]
+    scanned = warm(systems, scan)
+    results = prepare(games(systems), jobs)
+    passed = sum(1 for result in results if result["status"] == "pass")
+    return {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seconds": round(time.monotonic() - start, 2),
+        "systems": [system["name"] for system in systems],
+        "summary": {"games": len(results), "passed": passed, "failed": len(results) - passed},
+        "scan": scanned,
+        "games": results,
+    }
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    import json
+
+    from dcg.materialize import atomic_write
+
+    parser = argparse.ArgumentParser(prog="dcglauncher --prepare",
+                                     description="Dry run every game's generator to warm the launch caches.")
+    parser.add_argument("--system", action="append", default=[], help="only prepare this system (repeatable)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes, default one per CPU")
+    parser.add_argument("--no-scan", dest="scan", action="store_false", help="skip the ROM verification scan")
+    parser.add_argument("--es-systems", type=Path, default=ES_SYSTEMS, help="folder of the es_systems_*.cfg files")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file, - for stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.system, jobs=args.jobs, scan=args.scan, directory=args.es_systems)
+    if args.output == "-":
+        sys.stdout.write(json.dumps(report, indent=1) + "\n")
+    else:
+        if args.output:
+            atomic_write(args.output, (json.dumps(report, indent=1) + "\n").encode(), sync=False)
+        for result in report["games"]:
+            line = (f"{result['status'].upper():<5} {result['system']:<12} {result['emulator']:<6} "
+                    f"{result['ms']:8.1f} ms  {Path(result['rom']).name}")
+            print(line + (f"  {result['error']}" if result["error"] else ""))
+
+    summary = report["summary"]
+    print(f"{summary['games']} games: {summary['passed']} passed, {summary['failed']} failed in {report['seconds']}s",
+          file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
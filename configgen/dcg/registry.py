@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from importlib import import_module
+from typing import TYPE_CHECKING, Final
+
+from dcg import tracing
+
+if TYPE_CHECKING:
+    from configgen.generators.Generator import Generator
+
+# ------------------------------------------------------------
+# Generator registry
+#
+# emulator name -> (module, class) of the dcg generator serving it. Only
+# the selected generator's module is imported, so adding a system costs
+# nothing to the launches of the others; benchmarks/test_importtime.py
+# holds each generator to an import budget.
+# ------------------------------------------------------------
+
+GENERATORS: Final = {
+    "demul": ("generators.demul.demulGenerator", "DemulGenerator"),
+    "play": ("generators.namco2x6.playGenerator", "PlayGenerator"),
+    "wine": ("generators.wine.wineGenerator", "WineGenerator"),
+}
+
+
+def get_generator(emulator: str) -> Generator | None:
+    """A new generator for emulator, None when it is not a dcg emulator."""
+    if (entry := GENERATORS.get(emulator)) is None:
+        return None
+    module, name = entry
+    with tracing.span("registry.import", emulator=emulator):
+        return getattr(import_module(module), name)()
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import struct
+import sys
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Final
+
+from dcg.materialize import atomic_write
+from dcg.paths import DCG_CACHE, ROMS
+
+eslog = logging.getLogger(__name__)
+
+SCAN_CACHE: Final = DCG_CACHE / "romscan.pickle"
+SCAN_VERSION: Final = 1
+
+# the Demul.ini roms0-roms7 folders, plus Play!'s namco2x6
+SCAN_SYSTEMS: Final = ("naomi", "naomi2", "hikaru", "gaelco", "cave3rd", "atomiswave", "dreamcast", "namco2x6")
+DEMUL_FOLDERS: Final = frozenset({"naomi", "naomi2", "hikaru", "gaelco", "atomiswave"})
+
+ROM_EXTENSIONS: Final = frozenset({".zip", ".7z", ".chd", ".cdi", ".gdi", ".iso", ".bin"})
+SKIP_DIRS: Final = frozenset({"images", "videos", "media", "manuals", "downloaded_images"})
+
+READ_CHUNK: Final = 1024 * 1024
+SAVE_INTERVAL: Final = 60
+
+
+# ------------------------------------------------------------
+# File checks (run in the worker processes)
+# ------------------------------------------------------------
+
+CHD_MAGIC: Final = b"MComprHD"
+CHD_HEADER_LENGTHS: Final = {3: 120, 4: 108, 5: 124}
+CHD_MAX_METADATA: Final = 4096
+
+
+def check_zip(path: str) -> dict[str, Any]:
+    """Decompress every member; zipfile verifies each CRC-32 as the member is read to the end."""
+    members = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            with archive.open(info) as fp:
+                while fp.read(READ_CHUNK):
+                    pass
+            members[info.filename] = f"{info.CRC:08x}"
+    return {"members": members}
+
+
+def check_chd(path: str) -> dict[str, Any]:
+    """Validate a CHD's header, map and metadata chain and hash the metadata."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as fp:
+        header = fp.read(124)
+        if header[:8] != CHD_MAGIC:
+            raise ValueError("not a CHD file")
+        length, version = struct.unpack(">II", header[8:16])
+        if CHD_HEADER_LENGTHS.get(version) != length or len(header) < length:
+            raise ValueError(f"unsupported or truncated CHD header (v{version}, {length} bytes)")
+
+        if version == 5:
+            compressors = struct.unpack(">4I", header[16:32])
+            logical, map_offset, meta_offset = struct.unpack(">3Q", header[32:56])
+            hunk_bytes = struct.unpack(">I", header[56:60])[0]
+            sha1, parent_sha1 = header[84:104], header[104:124]
+            hunks = -(-logical // hunk_bytes) if hunk_bytes else 0
+            if compressors[0]:
+                fp.seek(map_offset)
+                map_header = fp.read(16)
+                map_end = map_offset + 16 + (struct.unpack(">I", map_header[:4])[0] if len(map_header) == 16 else size)
+            else:
+                map_end = map_offset + 4 * hunks
+            if map_end > size:
+                raise ValueError(f"truncated: hunk map ends at {map_end}, file has {size} bytes")
+        elif version == 4:
+            logical, meta_offset = struct.unpack(">2Q", header[28:44])
+            sha1, parent_sha1 = header[48:68], header[68:88]
+        else:
+            logical, meta_offset = struct.unpack(">2Q", header[28:44])
+            sha1, parent_sha1 = header[80:100], header[100:120]
+
+        metadata = hashlib.sha1()
+        tags = []
+        seen = set()
+        offset = meta_offset
+        while offset:
+            if offset in seen or len(seen) >= CHD_MAX_METADATA:
+                raise ValueError("metadata chain loops")
+            seen.add(offset)
+            if offset + 16 > size:
+                raise ValueError(f"truncated: metadata entry at {offset}, file has {size} bytes")
+            fp.seek(offset)
+            tag, flags_length, next_offset = struct.unpack(">4sIQ", fp.read(16))
+            data = fp.read(flags_length & 0xFFFFFF)
+            if len(data) != flags_length & 0xFFFFFF:
+                raise ValueError(f"truncated: metadata entry at {offset}")
+            metadata.update(tag)
+            metadata.update(data)
+            tags.append(tag.decode("ascii", "replace"))
+            offset = next_offset
+
+    return {
+        "chd_version": version,
+        "logical_bytes": logical,
+        "sha1": sha1.hex(),
+        "parent_sha1": parent_sha1.hex() if any(parent_sha1) else None,
+        "metadata": tags,
+        "metadata_sha1": metadata.hexdigest(),
+    }
+
+
+def check_file(path: str) -> dict[str, Any]:
+    ext = os.path.splitext(path)[1].lower()
+    # zlib.error for corrupt deflate data, NotImplementedError for a compression
+    # method zipfile lacks, RuntimeError for an encrypted member
+    try:
+        if ext == ".zip":
+            return {"status": "ok", **check_zip(path)}
+        if ext == ".chd":
+            return {"status": "ok", **check_chd(path)}
+    except (
+        OSError, EOFError, ValueError, struct.error, zlib.error, NotImplementedError, RuntimeError,
+        zipfile.BadZipFile, zipfile.LargeZipFile,
+    ) as e:
+        return {"status": "corrupt", "error": str(e)}
+    return {"status": "unchecked"}
+
+
+# ------------------------------------------------------------
+# Verification cache
+# ------------------------------------------------------------
+
+def _load_cache() -> dict[str, tuple[int, int, dict[str, Any]]]:
+    try:
+        with SCAN_CACHE.open("rb") as fp:
+            version, entries = pickle.load(fp)
+        if version == SCAN_VERSION:
+            return entries
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    return {}
+
+
+def _save_cache(entries: dict[str, tuple[int, int, dict[str, Any]]]) -> None:
+    try:
+        atomic_write(SCAN_CACHE, pickle.dumps((SCAN_VERSION, entries), protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    except OSError as e:
+        eslog.warning(f"unable to store the scan cache: {e}")
+
+
+# ------------------------------------------------------------
+# Scan
+# ------------------------------------------------------------
+
+def walk(systems: tuple[str, ...]) -> list[tuple[str, str, os.stat_result]]:
+    """(system, path, stat) of every ROM file below the system folders."""
+    found = []
+    for system in systems:
+        for root, dirs, files in os.walk(ROMS / system):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")]
+            for name in files:
+                if name.startswith(".") or os.path.splitext(name)[1].lower() not in ROM_EXTENSIONS:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    found.append((system, path, os.stat(path)))
+                except OSError:
+                    continue
+    return found
+
+
+def cross_check(system: str, path: str) -> list[dict[str, str]]:
+    """Compare a file with what arcade_compat.txt and the arcadedefs expect of it."""
+    from generators.demul import arcadeCompat
+    from generators.namco2x6 import arcadeDefs
+
+    rom = Path(path)
+    issues = []
+
+    def issue(level: str, message: str) -> None:
+        issues.append({"level": level, "message": message})
+
+    if system in DEMUL_FOLDERS and rom.suffix.lower() in (".zip", ".7z") and rom.parent.name == system:
+        entry = arcadeCompat.lookup(rom.stem)
+        if entry is None:
+            issue("warning", "not in arcade_compat.txt")
+        else:
+            if entry["folder"] and entry["folder"] != system:
+                issue("warning", f"listed under {entry['section']}, belongs in roms/{entry['folder']}")
+            if entry["broken"]:
+                issue("warning", "not playable in Demul" + (f": {entry['notes']}" if entry["notes"] else ""))
+
+    elif system == "namco2x6":
+        if rom.suffix.lower() == ".zip" and rom.parent.name == system:
+            game = arcadeDefs.lookup(rom)
+            if game is None:
+                issue("warning", "no arcadedef for this set")
+            else:
+                for problem in arcadeDefs.check_set(rom, game):
+                    issue("error", problem)
+        elif rom.suffix.lower() == ".chd":
+            games = arcadeDefs.load_index()["games"].values()
+            if not any(rom.name in g["discs"] for g in games if rom.parent.name in (g["id"], g["parent"])):
+                issue("warning", f"not used by {rom.parent.name}.arcadedef or its clones")
+
+    return issues
+
+
+def scan(systems: tuple[str, ...] = SCAN_SYSTEMS, jobs: int | None = None, rescan: bool = False) -> dict[str, Any]:
+    """Verify the ROM library, rechecking only files whose size or mtime changed."""
+    start = time.monotonic()
+    cache = {} if rescan else _load_cache()
+    files = walk(systems)
+
+    pending = [
+        path for _, path, st in files
+        if (cached := cache.get(path)) is None or cached[:2] != (st.st_size, st.st_mtime_ns)
+    ]
+    stats = {path: st for _, path, st in files}
+
+    if pending:
+        eslog.info(f"checking {len(pending)} of {len(files)} files")
+        last_save = time.monotonic()
+        # big files first so one CHD does not finish alone at the end
+        pending.sort(key=lambda path: stats[path].st_size, reverse=True)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(check_file, path): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                st = stats[path]
+                cache[path] = (st.st_size, st.st_mtime_ns, future.result())
+                if time.monotonic() - last_save > SAVE_INTERVAL:
+                    _save_cache(cache)
+                    last_save = time.monotonic()
+
+    # forget files that were removed from the scanned folders
+    scanned_roots = tuple(f"{ROMS / system}{os.sep}" for system in systems)
+    for path in [p for p in cache if p.startswith(scanned_roots) and p not in stats]:
+        del cache[path]
+    _save_cache(cache)
+
+    report_files = []
+    summary = {"files": len(files), "checked": len(pending), "ok": 0, "corrupt": 0, "unchecked": 0, "errors": 0, "warnings": 0}
+    for system, path, st in sorted(files, key=lambda f: f[1]):
+        result = cache[path][2]
+        issues = cross_check(system, path)
+        summary[result["status"]] += 1
+        summary["errors"] += sum(1 for i in issues if i["level"] == "error")
+        summary["warnings"] += sum(1 for i in issues if i["level"] == "warning")
+        report_files.append({"path": path, "system": system, "size": st.st_size, **result, "issues": issues})
+
+    return {
+        "version": SCAN_VERSION,
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seconds": round(time.monotonic() - start, 2),
+        "systems": list(systems),
+        "summary": summary,
+        "files": report_files,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="dcg.romScanner", description="Verify the arcade ROM library.")
+    parser.add_argument("--system", action="append", choices=SCAN_SYSTEMS, help="only scan this system (repeatable)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes, default one per CPU")
+    parser.add_argument("--rescan", action="store_true", help="ignore the verification cache")
+    parser.add_argument("--output", default="-", help="JSON report file, - for stdout")
+    args = parser.parse_args(argv)
+
+    report = scan(tuple(args.system or SCAN_SYSTEMS), jobs=args.jobs, rescan=args.rescan)
+    data = json.dumps(report, indent=1) + "\n"
+    if args.output == "-":
+        sys.stdout.write(data)
+    else:
+        atomic_write(args.output, data.encode(), sync=False)
+
+    summary = report["summary"]
+    print(
+        f"{summary['files']} files, {summary['checked']} checked: {summary['ok']} ok, {summary['corrupt']} corrupt, "
+        f"{summary['errors']} errors, {summary['warnings']} warnings in {report['seconds']}s",
+        file=sys.stderr,
+    )
+    return 1 if summary["corrupt"] or summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Final
+
+from dcg import batoceraSettings, tracing
+from dcg.materialize import atomic_write
+from dcg.paths import DCG_CACHE, USERDATA
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Save synchronisation
+#
+# sync() mirrors a save folder file by file, remembering the size, mtime
+# and block hashes of what it copied, so an unchanged file is not read
+# again and a big one that changed only gets its changed blocks written.
+# The size and mtime it left each copy with are kept too: a copy written
+# since, by a game saving through a symlink or by restore(), no longer
+# holds the recorded blocks and is rewritten whole.
+# snapshot() keeps a bounded history of a game's saves: files are split
+# into blocks stored once, compressed, under their hash, and a snapshot
+# is the list of blocks of each file. Save states that differ by a few
+# blocks share the rest.
+# ------------------------------------------------------------
+
+SAVES: Final = USERDATA / "saves"
+SNAPSHOTS: Final = SAVES / ".dcg-snapshots"
+SYNC_STATES: Final = DCG_CACHE / "savesync"
+
+# batocera.conf key, snapshots kept per game, 0 to take none
+HISTORY_KEY: Final = "dcg.saves.history"
+DEFAULT_HISTORY: Final = 10
+
+BLOCK: Final = 1024 * 1024
+# smaller files are rewritten whole
+BLOCK_COPY_MIN: Final = 4 * BLOCK
+COMPRESS_LEVEL: Final = 1
+
+_UNSAFE: Final = re.compile(r"[^\w.+-]+")
+
+
+def _slug(text: str) -> str:
+    return _UNSAFE.sub("_", text).strip("_") or "_"
+
+
+def _block_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _walk(root: Path, match: str | None = None) -> dict[str, os.stat_result]:
+    """Regular files below root by relative path, only those whose name starts with match if given."""
+    files = {}
+    for folder, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in sorted(names):
+            if match and not name.startswith(match):
+                continue
+            path = os.path.join(folder, name)
+            st = os.lstat(path)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files[os.path.relpath(path, root)] = st
+    return files
+
+
+# ------------------------------------------------------------
+# Sync
+# ------------------------------------------------------------
+
+def _state_path(dest: Path) -> Path:
+    # kept out of the save folder, games see every file in it
+    return SYNC_STATES / f"{hashlib.sha1(str(dest.resolve()).encode()).hexdigest()[:16]}.json"
+
+
+def _load_state(dest: Path) -> dict[str, list[Any]]:
+    try:
+        with _state_path(dest).open() as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _copy_blocks(src: Path, dest: Path, blocks: list[str], previous: list[str]) -> int:
+    """Write the blocks of src that differ from previous over dest, in place; blocks written."""
+    written = 0
+    with src.open("rb") as fin, dest.open("r+b") as fout:
+        for i, digest in enumerate(blocks):
+            if i < len(previous) and previous[i] == digest:
+                continue
+            fin.seek(i * BLOCK)
+            fout.seek(i * BLOCK)
+            fout.write(fin.read(BLOCK))
+            written += 1
+        fout.truncate(src.stat().st_size)
+    return written
+
+
+def _hash_blocks(path: Path) -> list[str]:
+    blocks = []
+    with path.open("rb") as fp:
+        while data := fp.read(BLOCK):
+            blocks.append(_block_hash(data))
+    return blocks
+
+
+def sync(source: str | Path, dest: str | Path, delete: bool = True) -> dict[str, int]:
+    """Copy what changed in source to dest since the last sync, dest files not in source removed if delete."""
+    source, dest = Path(source), Path(dest)
+    state = _load_state(dest)
+    stats = {"files": 0, "copied": 0, "blocks": 0, "removed": 0, "bytes": 0}
+    files = _walk(source)
+
+    with tracing.span("save_sync.sync", files=len(files)):
+        for rel, st in files.items():
+            stats["files"] += 1
+            src, target = source / rel, dest / rel
+            record = state.get(rel)
+            stamp = [st.st_size, st.st_mtime_ns]
+            try:
+                target_st = target.stat()
+                target_stamp = [target_st.st_size, target_st.st_mtime_ns]
+            except OSError:
+                target_stamp = None
+            if record and record[:2] == stamp and target_stamp and target_stamp[0] == st.st_size:
+                continue
+
+            # dest still as the last sync left it, holding the recorded blocks
+            current = bool(record) and record[3:5] == target_stamp
+            blocks = _hash_blocks(src)
+            if current and record[2] == blocks:
+                pass
+            elif current and st.st_size >= BLOCK_COPY_MIN:
+                written = _copy_blocks(src, target, blocks, record[2])
+                stats["blocks"] += written
+                stats["bytes"] += written * BLOCK
+                stats["copied"] += 1
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, target)
+                stats["bytes"] += st.st_size
+                stats["copied"] += 1
+            os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+            target_st = target.stat()
+            state[rel] = [*stamp, blocks, target_st.st_size, target_st.st_mtime_ns]
+
+        for rel in [rel for rel in state if rel not in files]:
+            del state[rel]
+            if delete:
+                (dest / rel).unlink(missing_ok=True)
+                stats["removed"] += 1
+
+    atomic_write(_state_path(dest), json.dumps(state, separators=(",", ":")).encode(), sync=False)
+    return stats
+
+
+def seed(source: str | Path, dest: str | Path) -> int:
+    """Copy the files of source missing from dest, keeping their mtime; files copied."""
+    source, dest = Path(source), Path(dest)
+    copied = 0
+    for rel in _walk(source):
+        target = dest / rel
+        if target.exists():
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(source / rel, target)
+        copied += 1
+    return copied
+
+
+# ------------------------------------------------------------
+# Snapshots
+# ------------------------------------------------------------
+
+def _history() -> int:
+    try:
+        return max(0, int(batoceraSettings.get(HISTORY_KEY, default=str(DEFAULT_HISTORY))))
+    except ValueError:
+        eslog.warning(f"ignoring {HISTORY_KEY}, not a number")
+        return DEFAULT_HISTORY
+
+
+def _game_root(system: str, game: str) -> Path:
+    return SNAPSHOTS / _slug(system) / _slug(game)
+
+
+def _object(root: Path, digest: str) -> Path:
+    return root / "objects" / digest[:2] / digest
+
+
+def _snapshot_ids(root: Path) -> list[str]:
+    try:
+        return sorted(path.stem for path in root.glob("*.json"))
+    except OSError:
+        return []
+
+
+def _load_snapshot(root: Path, snapshot_id: str) -> dict[str, Any]:
+    with (root / f"{snapshot_id}.json").open() as fp:
+        return json.load(fp)
+
+
+def _store(root: Path, path: Path) -> tuple[list[str], int]:
+    """Blocks of path, the new ones compressed into the store; (block hashes, bytes stored)."""
+    blocks, stored = [], 0
+    with path.open("rb") as fp:
+        while data := fp.read(BLOCK):
+            digest = _block_hash(data)
+            blocks.append(digest)
+            target = _object(root, digest)
+            if not target.exists():
+                compressed = zlib.compress(data, COMPRESS_LEVEL)
+                atomic_write(target, compressed, sync=False)
+                stored += len(compressed)
+    return blocks, stored
+
+
+def snapshot(system: str, game: str, sources: dict[str, str | Path], match: str | None = None) -> str | None:
+    """Record the save folders of a game, by name, unless they did not change since its last snapshot."""
+    history = _history()
+    if not history:
+        return None
+    root = _game_root(system, game)
+    ids = _snapshot_ids(root)
+    latest = _load_snapshot(root, ids[-1])["files"] if ids else {}
+
+    files: dict[str, list[Any]] = {}
+    stored = 0
+    with tracing.span("save_sync.snapshot", game=game):
+        for name, folder in sorted(sources.items()):
+            for rel, st in _walk(Path(folder), match).items():
+                key = f"{name}/{rel}" if name else rel
+                record = latest.get(key)
+                stamp = [st.st_size, st.st_mtime_ns]
+                if record and record[:2] == stamp and all(_object(root, d).exists() for d in record[3]):
+                    blocks = record[3]
+                else:
+                    blocks, size = _store(root, Path(folder) / rel)
+                    stored += size
+                files[key] = [*stamp, st.st_mode & 0o777, blocks]
+
+    if not files or {k: v[3] for k, v in files.items()} == {k: v[3] for k, v in latest.items()}:
+        return None
+    snapshot_id = time.strftime("%Y%m%d-%H%M%S")
+    while snapshot_id in ids:
+        snapshot_id += "+"
+    atomic_write(root / f"{snapshot_id}.json", json.dumps({
+        "system": system, "game": game, "time": time.time(), "stored": stored, "files": files,
+    }, separators=(",", ":")).encode(), sync=False)
+    prune(system, game, history)
+    return snapshot_id
+
+
+def prune(system: str, game: str, keep: int) -> list[str]:
+    """Drop all but the keep latest snapshots of a game and the blocks only they used."""
+    root = _game_root(system, game)
+    ids = _snapshot_ids(root)
+    dropped = ids[:-keep] if keep else ids
+    if not dropped:
+        return []
+    for snapshot_id in dropped:
+        (root / f"{snapshot_id}.json").unlink(missing_ok=True)
+    used = {d for snapshot_id in ids[len(dropped):] for entry in _load_snapshot(root, snapshot_id)["files"].values()
+            for d in entry[3]}
+    for path in (root / "objects").glob("*/*"):
+        if path.name not in used:
+            path.unlink(missing_ok=True)
+    return dropped
+
+
+def snapshots(system: str, game: str) -> list[dict[str, Any]]:
+    root = _game_root(system, game)
+    result = []
+    for snapshot_id in _snapshot_ids(root):
+        data = _load_snapshot(root, snapshot_id)
+        result.append({
+            "id": snapshot_id, "time": data["time"], "files": len(data["files"]),
+            "bytes": sum(entry[0] for entry in data["files"].values()), "stored": data["stored"],
+        })
+    return result
+
+
+def restore(system: str, game: str, snapshot_id: str, targets: dict[str, str | Path]) -> int:
+    """Write the files of a snapshot back into the folders named in targets; files restored."""
+    root = _game_root(system, game)
+    restored = 0
+    for key, (_, mtime_ns, mode, blocks) in _load_snapshot(root, snapshot_id)["files"].items():
+        name, _, rel = key.partition("/") if "" not in targets else ("", "", key)
+        if name not in targets:
+            continue
+        target = Path(targets[name]) / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as fp:
+            for digest in blocks:
+                fp.write(zlib.decompress(_object(root, digest).read_bytes()))
+        os.chmod(tmp, mode)
+        os.replace(tmp, target)
+        os.utime(target, ns=(mtime_ns, mtime_ns))
+        restored += 1
+    return restored
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def _folders(values: list[str]) -> dict[str, str]:
+    """NAME=DIR arguments, a lone DIR is the unnamed folder."""
+    return dict(value.split("=", 1) if "=" in value else ("", value) for value in values)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.saveSync", description="Incremental save sync and snapshots.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    p = sub.add_parser("sync", help="copy what changed in a save folder to another")
+    p.add_argument("--keep", action="store_true", help="keep destination files missing from the source")
+    p.add_argument("source")
+    p.add_argument("dest")
+    for name, help_text in (
+        ("snapshot", "record a game's saves in its history"),
+        ("exit", "mirror folders then snapshot, after the emulator exited"),
+        ("list", "show a game's snapshots"),
+        ("restore", "write a snapshot back"),
+    ):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--system", required=True)
+        p.add_argument("--game", required=True)
+        if name in ("snapshot", "exit"):
+            p.add_argument("--match", default=None, help="only files whose name starts with this")
+        if name == "exit":
+            p.add_argument("--mirror", nargs=2, action="append", default=[], metavar=("SOURCE", "DEST"))
+        if name == "restore":
+            p.add_argument("snapshot")
+        if name != "list":
+            p.add_argument("folders", nargs="+", metavar="[NAME=]DIR")
+    args = parser.parse_args(argv)
+
+    if args.action == "sync":
+        stats = sync(args.source, args.dest, delete=not args.keep)
+        print(f"{stats['copied']} of {stats['files']} files copied ({stats['blocks']} blocks), "
+              f"{stats['removed']} removed, {stats['bytes'] / 1048576:.1f} MiB written")
+        return 0
+
+    if args.action in ("snapshot", "exit"):
+        for source, dest in getattr(args, "mirror", []):
+            if os.path.isdir(source):
+                sync(source, dest)
+        snapshot_id = snapshot(args.system, args.game, _folders(args.folders), args.match)
+        print(f"{args.game}: " + (f"snapshot {snapshot_id}" if snapshot_id else "unchanged"))
+        return 0
+
+    if args.action == "restore":
+        try:
+            count = restore(args.system, args.game, args.snapshot, _folders(args.folders))
+        except OSError as e:
+            print(f"unable to restore {args.snapshot}: {e}", file=sys.stderr)
+            return 1
+        print(f"{count} files restored")
+        return 0
+
+    for entry in snapshots(args.system, args.game):
+        print(f"{entry['id']}  {entry['files']:4} files  {entry['bytes'] / 1048576:8.1f} MiB  "
+              f"{entry['stored'] / 1048576:8.1f} MiB stored")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
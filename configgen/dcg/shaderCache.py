@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg import batoceraSettings, launchHistory, prepare, tracing
+from dcg.materialize import atomic_write
+from dcg.paths import CONFIGGEN, SYSTEM
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Paths and settings
+# ------------------------------------------------------------
+
+# one partition per emulator/game/version below it, the index keeps their sizes and use
+SHADER_ROOT: Final = SYSTEM / "cache" / "shaders"
+SHADER_INDEX: Final = SHADER_ROOT / "index.json"
+SHADER_LOCK: Final = SHADER_ROOT / ".index.lock"
+
+# describes the partitions of an exported archive
+EXPORT_META: Final = "shaders.json"
+
+# batocera.conf key, GiB all shader caches may take, 0 for no limit
+BUDGET_KEY: Final = "dcg.shadercache.size"
+DEFAULT_BUDGET_GB: Final = 4
+
+# environment variable -> subdirectory of the partition holding that cache
+CACHE_DIRS: Final = {
+    "DXVK_STATE_CACHE_PATH": "dxvk",
+    "VKD3D_SHADER_CACHE_PATH": "vkd3d",
+    "__GL_SHADER_DISK_CACHE_PATH": "nvidia",
+    "MESA_SHADER_CACHE_DIR": "mesa",
+}
+
+_UNSAFE: Final = re.compile(r"[^\w.+-]+")
+
+
+def _budget() -> int:
+    try:
+        return max(0, int(batoceraSettings.get(BUDGET_KEY, default=str(DEFAULT_BUDGET_GB)))) * 1024 ** 3
+    except ValueError:
+        eslog.warning(f"ignoring {BUDGET_KEY}, not a number")
+        return DEFAULT_BUDGET_GB * 1024 ** 3
+
+
+def _slug(text: str) -> str:
+    return _UNSAFE.sub("_", text).strip("._") or "_"
+
+
+def partition_key(emulator: str, game: str, version: str) -> str:
+    return f"{_slug(emulator)}/{_slug(game)}/{_slug(version)}"
+
+
+# ------------------------------------------------------------
+# Index
+# ------------------------------------------------------------
+
+@contextmanager
+def _index() -> Iterator[dict[str, Any]]:
+    """The partition index, saved back on exit."""
+    SHADER_ROOT.mkdir(parents=True, exist_ok=True)
+    with SHADER_LOCK.open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with SHADER_INDEX.open() as fp:
+                    index = json.load(fp)
+            except (OSError, ValueError):
+                index = {}
+            for key, default in (("partitions", {}), ("fingerprints", {}), ("pending", None), ("warm", 0), ("cold", 0)):
+                index.setdefault(key, default)
+            before = json.dumps(index, sort_keys=True)
+            yield index
+            if json.dumps(index, sort_keys=True) != before:
+                atomic_write(SHADER_INDEX, json.dumps(index, indent=1).encode(), sync=False)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _measure(path: Path) -> tuple[int, int]:
+    """Bytes and files below path."""
+    size = files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+            files += 1
+    return size, files
+
+
+def _remeasure(index: dict[str, Any], key: str) -> None:
+    if (record := index["partitions"].get(key)) is not None:
+        record["bytes"], record["files"] = _measure(SHADER_ROOT / key)
+        record["measured"] = time.time()
+
+
+def _fingerprint(index: dict[str, Any], path: str | Path) -> str | None:
+    """Short content hash of a driver or emulator binary, rehashed only when its stat changes.
+
+    Content rather than mtime, so cabinets running the same build agree on the partition."""
+    path = os.path.realpath(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = [st.st_size, st.st_mtime_ns]
+    cached = index["fingerprints"].get(path)
+    if cached is not None and cached[:2] == stamp:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while data := fp.read(1024 * 1024):
+            digest.update(data)
+    index["fingerprints"][path] = [*stamp, digest.hexdigest()[:12]]
+    return digest.hexdigest()[:12]
+
+
+# ------------------------------------------------------------
+# Partitions
+# ------------------------------------------------------------
+
+def acquire(emulator: str, game: str, version: str, fingerprints: Iterable[str | Path] = ()) -> Path:
+    """The cache partition of a game for this emulator build, created on first use.
+
+    version should name what invalidates the caches (runner, DXVK build...), the
+    fingerprints of the files given are appended to it. The partition the
+    previous launch used is measured now that its game has exited, and the
+    cache is trimmed in the background when that takes it over budget.
+    """
+    with tracing.span("shader_cache.acquire", emulator=emulator), _index() as index:
+        digests = [digest for path in fingerprints if (digest := _fingerprint(index, path))]
+        if digests:
+            version = "-".join([version, *digests])
+        key = partition_key(emulator, game, version)
+        partitions = index["partitions"]
+
+        if index["pending"] and index["pending"] != key:
+            _remeasure(index, index["pending"])
+        record = partitions.get(key)
+        if record is None:
+            record = partitions[key] = {
+                "emulator": emulator, "game": game, "version": version,
+                "bytes": 0, "files": 0, "launches": 0, "warm": 0, "created": time.time(),
+            }
+        _remeasure(index, key)
+
+        warm = record["files"] > 0
+        launchHistory.cache("shader", warm)
+        # a dry run only creates the partition, nothing will fill it
+        if not prepare.dry_run():
+            record["launches"] += 1
+            record["warm"] += warm
+            record["last_used"] = time.time()
+            index["warm" if warm else "cold"] += 1
+            index["pending"] = key
+        over = bool(_over_budget(partitions, key))
+
+    path = SHADER_ROOT / key
+    if not warm:
+        for sub in CACHE_DIRS.values():
+            (path / sub).mkdir(parents=True, exist_ok=True)
+    if over:
+        trim_in_background(key)
+    return path
+
+
+def env(path: Path) -> dict[str, str]:
+    """Environment pointing DXVK, VKD3D and the GL drivers at a partition."""
+    variables = {name: str(path / sub) for name, sub in CACHE_DIRS.items()}
+    # the budget is enforced across all games here, not by the driver
+    variables["__GL_SHADER_DISK_CACHE_SIZE"] = str(_budget() or 2 * 1024 ** 3)
+    variables["__GL_SHADER_DISK_CACHE_SKIP_CLEANUP"] = "1"
+    return variables
+
+
+def environment(emulator: str, game: str, version: str, fingerprints: Iterable[str | Path] = ()) -> dict[str, str]:
+    """env() of the game's partition, empty when it can't be set up so the shared cache is used."""
+    try:
+        return env(acquire(emulator, game, version, fingerprints))
+    except OSError as e:
+        eslog.warning(f"no shader cache partition for {game}: {e}")
+        return {}
+
+
+def _over_budget(partitions: dict[str, dict[str, Any]], keep: str | None = None) -> list[str]:
+    """Partitions beyond the budget once the most recently used ones are counted."""
+    budget = _budget()
+    if not budget:
+        return []
+    victims = []
+    used = 0
+    for key, record in sorted(partitions.items(), key=lambda item: item[1].get("last_used", 0), reverse=True):
+        used += record["bytes"]
+        if used > budget and key != keep:
+            victims.append(key)
+    return victims
+
+
+def _remove(index: dict[str, Any], key: str) -> None:
+    shutil.rmtree(SHADER_ROOT / key, ignore_errors=True)
+    del index["partitions"][key]
+    if index["pending"] == key:
+        index["pending"] = None
+    # drop the emptied game and emulator directories
+    for parent in ((SHADER_ROOT / key).parent, (SHADER_ROOT / key).parent.parent):
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+
+
+def trim(keep: str | None = None) -> list[str]:
+    """Remeasure every partition and evict the least recently used ones beyond the budget, keep excepted."""
+    with tracing.span("shader_cache.trim"), _index() as index:
+        for key in list(index["partitions"]):
+            if not (SHADER_ROOT / key).is_dir():
+                del index["partitions"][key]
+            else:
+                _remeasure(index, key)
+        victims = _over_budget(index["partitions"], keep)
+        for key in victims:
+            _remove(index, key)
+    return victims
+
+
+def trim_in_background(keep: str | None = None) -> None:
+    subprocess.Popen(
+        [sys.executable, "-m", "dcg.shaderCache", "trim", *(["--keep", keep] if keep else [])],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**os.environ, "PYTHONPATH": str(CONFIGGEN)}, start_new_session=True,
+    )
+
+
+def _select(partitions: dict[str, dict[str, Any]], emulator: str | None, game: str | None) -> list[str]:
+    return [
+        key for key, record in partitions.items()
+        if (emulator is None or record["emulator"] == emulator) and (game is None or record["game"] == game)
+    ]
+
+
+def reset(emulator: str | None = None, game: str | None = None) -> list[str]:
+    """Remove the partitions of a game and/or emulator, all of them when neither is given."""
+    with _index() as index:
+        removed = _select(index["partitions"], emulator, game)
+        for key in removed:
+            _remove(index, key)
+    return removed
+
+
+def stats() -> dict[str, Any]:
+    with _index() as index:
+        partitions = sorted(
+            ({"key": key, **record} for key, record in index["partitions"].items()),
+            key=lambda p: p.get("last_used", 0), reverse=True,
+        )
+        return {
+            "partitions": partitions,
+            "bytes": sum(p["bytes"] for p in partitions),
+            "budget": _budget(),
+            "warm": index["warm"],
+            "cold": index["cold"],
+        }
+
+
+# ------------------------------------------------------------
+# Export and import
+# ------------------------------------------------------------
+
+def export(archive: str | Path, emulator: str | None = None, game: str | None = None) -> list[str]:
+    """Pack the warmed partitions of a game and/or emulator, for import on other cabinets."""
+    import tarfile
+
+    archive = Path(archive)
+    with _index() as index:
+        keys = [key for key in _select(index["partitions"], emulator, game) if (SHADER_ROOT / key).is_dir()]
+        for key in keys:
+            _remeasure(index, key)
+        meta = {key: {k: index["partitions"][key][k] for k in ("emulator", "game", "version")} for key in keys}
+        with tarfile.open(archive, "w:gz") as tar:
+            data = json.dumps(meta, indent=1).encode()
+            info = tarfile.TarInfo(EXPORT_META)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, fileobj=io.BytesIO(data))
+            for key in keys:
+                tar.add(SHADER_ROOT / key, arcname=key)
+    return keys
+
+
+def import_(archive: str | Path) -> list[str]:
+    """Merge the partitions of an exported archive, keeping local cache files that are larger."""
+    import tarfile
+
+    filters = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    with tarfile.open(archive, "r:*") as tar:
+        try:
+            meta = json.load(tar.extractfile(EXPORT_META))
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{archive} is not a shader cache export") from e
+        keys = [key for key, record in meta.items() if key == partition_key(record["emulator"], record["game"], record["version"])]
+        with _index() as index:
+            for member in tar:
+                if not member.isfile() or "/".join(member.name.split("/")[:3]) not in keys:
+                    continue
+                target = SHADER_ROOT / member.name
+                try:
+                    if target.stat().st_size >= member.size:
+                        continue
+                except OSError:
+                    pass
+                tar.extract(member, SHADER_ROOT, **filters)
+            for key in keys:
+                record = index["partitions"].setdefault(key, {
+                    **meta[key], "launches": 0, "warm": 0, "created": time.time(), "last_used": time.time(),
+                })
+                _remeasure(index, key)
+    return keys
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    import tarfile
+
+    parser = argparse.ArgumentParser(prog="dcg.shaderCache", description="Per-game shader and pipeline caches within a size budget.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    env_parser = sub.add_parser("env", help="print the exports pointing a game at its partition")
+    env_parser.add_argument("--emulator", required=True)
+    env_parser.add_argument("--game", required=True)
+    env_parser.add_argument("--version", required=True, help="runner or emulator build the caches belong to")
+    env_parser.add_argument("--fingerprint", action="append", default=[], help="file whose content identifies the build")
+    trim_parser = sub.add_parser("trim", help="evict the least recently used partitions beyond the budget")
+    trim_parser.add_argument("--keep", help="partition never to evict")
+    sub.add_parser("status", help="show the partitions, their size and warm launches")
+    for name, help_text in (("reset", "remove partitions"), ("export", "pack partitions into an archive")):
+        selector = sub.add_parser(name, help=help_text)
+        selector.add_argument("--emulator")
+        selector.add_argument("--game")
+        if name == "export":
+            selector.add_argument("archive")
+    import_parser = sub.add_parser("import", help="merge an exported archive")
+    import_parser.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.action == "env":
+        for name, value in environment(args.emulator, args.game, args.version, args.fingerprint).items():
+            print(f"export {name}={shlex.quote(value)}")
+        return 0
+
+    if args.action in ("trim", "reset"):
+        for key in trim(args.keep) if args.action == "trim" else reset(args.emulator, args.game):
+            print(f"removed {key}")
+        return 0
+
+    if args.action in ("export", "import"):
+        try:
+            keys = export(args.archive, args.emulator, args.game) if args.action == "export" else import_(args.archive)
+        except (OSError, ValueError, tarfile.TarError) as e:
+            print(f"unable to {args.action} {args.archive}: {e}", file=sys.stderr)
+            return 1
+        print(f"{args.action}ed {len(keys)} partitions")
+        return 0
+
+    result = stats()
+    for p in result["partitions"]:
+        age = (time.time() - p.get("last_used", 0)) / 86400
+        print(f"{p['key']:<60} {p['bytes'] / 1048576:9.1f} MiB {p['warm']:4}/{p['launches']:<4} warm {age:6.1f} days")
+    launches = result["warm"] + result["cold"]
+    print(f"total {result['bytes'] / 1048576:.1f} of {result['budget'] / 1048576:.0f} MiB, "
+          f"{result['warm']}/{launches} launches warm ({100 * result['warm'] / launches if launches else 0:.0f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,479 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Final
+
+from dcg import batoceraSettings, tracing
+from dcg.materialize import atomic_write
+from dcg.paths import CONFIGGEN, SYSTEM
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Paths and settings
+# ------------------------------------------------------------
+
+SUPERVISOR_STATE: Final = Path("/var/run/dcg-supervisor.json")
+CGROUP_ROOT: Final = Path("/sys/fs/cgroup")
+CGROUP_PARENT: Final = CGROUP_ROOT / "dcg"
+EXIT_LOG: Final = SYSTEM / "logs" / "dcg-exits.jsonl"
+EXIT_LOG_KEEP: Final = 200
+
+# batocera.conf key, seconds the emulator tree gets to exit after SIGTERM before it is killed
+DEADLINE_KEY: Final = "dcg.shutdown.deadline"
+DEFAULT_DEADLINE: Final = 3.0
+KILL_GRACE: Final = 1.0
+
+# lets "python -m dcg.supervisor" find the dcg package from the emulator command
+SUPERVISOR_ENV: Final = {"PYTHONPATH": str(CONFIGGEN)}
+
+# set for the emulator tree: the file its helpers append the pids that must outlive it to, see hand_off()
+HANDOFF_ENV: Final = "DCG_SUPERVISOR_HANDOFF"
+
+PR_SET_CHILD_SUBREAPER: Final = 36
+
+
+def wrap(name: str, array: list[Any], after: list[Any] | None = None) -> list[Any]:
+    """array run under the supervisor, to be used with SUPERVISOR_ENV in the command's environment.
+
+    after is run once the emulator tree is gone, its files closed.
+    """
+    options = ["--after", shlex.join(str(arg) for arg in after)] if after else []
+    return [sys.executable, "-m", "dcg.supervisor", "run", "--name", name, *options, "--", *array]
+
+
+def _deadline() -> float:
+    try:
+        return max(0.0, float(batoceraSettings.get(DEADLINE_KEY, default=str(DEFAULT_DEADLINE))))
+    except ValueError:
+        eslog.warning(f"ignoring {DEADLINE_KEY}, not a number")
+        return DEFAULT_DEADLINE
+
+
+# ------------------------------------------------------------
+# Process trees
+#
+# The teardown kills everything the emulator started, detached or not. A
+# helper meant to outlive the game (the mountCache trim) is handed off:
+# its pid is appended to the file HANDOFF_ENV names, by hand_off() or
+# "echo $pid >> $DCG_SUPERVISOR_HANDOFF" from a script. Before tearing
+# down, the supervisor moves it and its descendants back to its own
+# cgroup and leaves them out of the tree it signals.
+# ------------------------------------------------------------
+
+def _descendants(root: int, exclude: set[int] = frozenset()) -> set[int]:
+    """Every process below root, leaving out the excluded ones and what is below them."""
+    found: set[int] = set()
+    pending = [root]
+    while pending:
+        pid = pending.pop()
+        try:
+            tasks = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            continue
+        for tid in tasks:
+            try:
+                with open(f"/proc/{pid}/task/{tid}/children") as fp:
+                    children = [int(child) for child in fp.read().split()]
+            except OSError:
+                continue
+            children = [child for child in children if child not in found and child not in exclude]
+            pending.extend(children)
+            found.update(children)
+    return found
+
+
+def hand_off(pid: int) -> bool:
+    """Let pid and what it starts outlive the supervised emulator; False when not supervised."""
+    path = os.environ.get(HANDOFF_ENV)
+    if not path:
+        return False
+    try:
+        with open(path, "a") as fp:
+            fp.write(f"{pid}\n")
+    except OSError as e:
+        eslog.warning(f"unable to hand process {pid} off: {e}")
+        return False
+    return True
+
+
+def _handed_off(path: Path) -> set[int]:
+    try:
+        with path.open() as fp:
+            return {int(line) for line in fp if line.strip().isdigit()}
+    except OSError:
+        return set()
+    finally:
+        path.unlink(missing_ok=True)
+
+
+class _Subreaper:
+    """The processes below the supervisor, orphans being reparented to it."""
+
+    kind = "subreaper"
+
+    def __init__(self) -> None:
+        # handed off, with what they started
+        self.kept: set[int] = set()
+
+    def preexec(self) -> None:
+        pass
+
+    def pids(self) -> set[int]:
+        return _descendants(os.getpid(), self.kept)
+
+    def keep(self, pids: set[int]) -> None:
+        """Leave pids and their descendants out of the tree."""
+        for pid in pids:
+            self.kept |= {pid, *_descendants(pid)}
+
+    def kill(self) -> None:
+        for pid in self.pids():
+            _signal(pid, signal.SIGKILL)
+
+    def remove(self) -> None:
+        pass
+
+
+class _Cgroup(_Subreaper):
+    """A cgroup v2 holding the emulator tree, nothing can leave it by forking."""
+
+    kind = "cgroup"
+
+    def __init__(self, path: Path, home: Path | None = None) -> None:
+        super().__init__()
+        self.path = path
+        # the supervisor's own cgroup, where handed off processes go
+        self.home = home
+
+    @classmethod
+    def create(cls, name: str) -> _Cgroup | None:
+        if not (CGROUP_ROOT / "cgroup.controllers").exists():
+            return None
+        path = CGROUP_PARENT / f"{name}-{os.getpid()}"
+        try:
+            path.mkdir(parents=True)
+        except OSError as e:
+            eslog.debug(f"no cgroup for {name}: {e}")
+            return None
+        home = None
+        try:
+            with open("/proc/self/cgroup") as fp:
+                for line in fp:
+                    if line.startswith("0::"):
+                        home = CGROUP_ROOT / line[3:].strip().lstrip("/")
+        except OSError:
+            pass
+        return cls(path, home)
+
+    def preexec(self) -> None:
+        # runs in the child between fork and exec
+        with open(self.path / "cgroup.procs", "w") as fp:
+            fp.write(str(os.getpid()))
+
+    def pids(self) -> set[int]:
+        try:
+            with open(self.path / "cgroup.procs") as fp:
+                return {int(pid) for pid in fp.read().split()} - self.kept
+        except OSError:
+            return super().pids()
+
+    def keep(self, pids: set[int]) -> None:
+        super().keep(pids)
+        # cgroup.kill and the cgroup's removal would take them too
+        for pid in sorted(self.kept):
+            try:
+                with open((self.home or CGROUP_ROOT) / "cgroup.procs", "w") as fp:
+                    fp.write(str(pid))
+            except ProcessLookupError:
+                continue
+            except OSError as e:
+                eslog.warning(f"unable to move handed off process {pid} out of {self.path}: {e}")
+
+    def kill(self) -> None:
+        try:
+            (self.path / "cgroup.kill").write_text("1")
+        except OSError:
+            # before linux 5.14
+            super().kill()
+
+    def remove(self) -> None:
+        try:
+            self.path.rmdir()
+        except OSError as e:
+            eslog.warning(f"unable to remove {self.path}: {e}")
+
+
+def _spawn(tracker: _Subreaper, name: str, argv: list[str]) -> tuple[subprocess.Popen[bytes], _Subreaper]:
+    """Start argv in tracker, below this subreaper when the cgroup refuses it; the child and its tracker."""
+    env = {**os.environ, "DCG_SUPERVISED": name}
+    try:
+        return subprocess.Popen(argv, env=env, preexec_fn=tracker.preexec), tracker
+    except subprocess.SubprocessError as e:
+        # preexec failed in the child, most likely cgroup.procs not writable by this user
+        if not isinstance(tracker, _Cgroup):
+            raise
+        eslog.warning(f"unable to start {name} in {tracker.path}, tracking it as a subreaper: {e}")
+        tracker.remove()
+        tracker = _Subreaper()
+        return subprocess.Popen(argv, env=env, preexec_fn=tracker.preexec), tracker
+
+
+def _signal(pid: int, sig: int) -> bool:
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _reap() -> dict[int, int]:
+    """Collect the exited children, orphans included; pid -> exit code."""
+    reaped = {}
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        reaped[pid] = os.waitstatus_to_exitcode(status)
+    return reaped
+
+
+def _wait_gone(tracker: _Subreaper, until: float, reaped: dict[int, int]) -> set[int]:
+    """Wait for the tree to empty, woken by the pidfds of its processes. Returns the survivors."""
+    while True:
+        reaped.update(_reap())
+        pids = tracker.pids()
+        remaining = until - time.monotonic()
+        if not pids or remaining <= 0:
+            return pids
+
+        poller = select.poll()
+        fds = []
+        for pid in pids:
+            try:
+                fd = os.pidfd_open(pid)
+            except (AttributeError, OSError):
+                continue
+            fds.append(fd)
+            poller.register(fd, select.POLLIN)
+        try:
+            # children only report through SIGCHLD and waitpid, don't sleep on them for long
+            poller.poll(min(remaining, 0.05 if not fds else 0.25) * 1000)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+
+# ------------------------------------------------------------
+# Supervision
+# ------------------------------------------------------------
+
+class _Stop(Exception):
+    def __init__(self, signum: int) -> None:
+        super().__init__(signum)
+        self.signum = signum
+
+
+def _on_signal(signum: int, frame: Any) -> None:
+    raise _Stop(signum)
+
+
+def teardown(tracker: _Subreaper, deadline: float, reaped: dict[int, int]) -> dict[str, Any]:
+    """SIGTERM the whole tree at once, SIGKILL what is left at the deadline."""
+    start = time.monotonic()
+    with tracing.span("supervisor.teardown", tracker=tracker.kind):
+        pids = tracker.pids()
+        for pid in pids:
+            _signal(pid, signal.SIGTERM)
+        killed = _wait_gone(tracker, start + deadline, reaped)
+        if killed:
+            eslog.warning(f"killing {len(killed)} processes still running after {deadline}s: {sorted(killed)}")
+            tracker.kill()
+            if survivors := _wait_gone(tracker, time.monotonic() + KILL_GRACE, reaped):
+                eslog.error(f"processes survived SIGKILL: {sorted(survivors)}")
+    return {
+        "processes": len(pids),
+        "killed": len(killed),
+        "latency_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+
+def _record_exit(entry: dict[str, Any]) -> None:
+    try:
+        lines = EXIT_LOG.read_text().splitlines()[-(EXIT_LOG_KEEP - 1):]
+    except OSError:
+        lines = []
+    lines.append(json.dumps(entry))
+    try:
+        atomic_write(EXIT_LOG, ("\n".join(lines) + "\n").encode(), sync=False)
+    except OSError as e:
+        eslog.warning(f"unable to record the exit: {e}")
+
+
+def run(name: str, argv: list[str], deadline: float, after: str | None = None) -> int:
+    """Run argv in its own cgroup (or below this subreaper) and tear its tree down when it exits or we are signalled."""
+    import ctypes
+
+    ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    tracker = _Cgroup.create(name) or _Subreaper()
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, _on_signal)
+
+    reason = "exit"
+    child = exit_code = None
+    reaped: dict[int, int] = {}
+    handoff = SUPERVISOR_STATE.with_name(f"dcg-supervisor-{os.getpid()}.handoff")
+    os.environ[HANDOFF_ENV] = str(handoff)
+    try:
+        child, tracker = _spawn(tracker, name, argv)
+        atomic_write(SUPERVISOR_STATE, json.dumps({
+            "pid": os.getpid(),
+            "child": child.pid,
+            "name": name,
+            "tracker": tracker.kind,
+            "cgroup": str(tracker.path) if isinstance(tracker, _Cgroup) else None,
+            "started": time.time(),
+        }).encode(), sync=False)
+
+        while exit_code is None:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            if pid == child.pid:
+                exit_code = os.waitstatus_to_exitcode(status)
+    except _Stop as stop:
+        reason = signal.Signals(stop.signum).name
+    finally:
+        # a second signal must not interrupt the teardown
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_IGN)
+        if kept := _handed_off(handoff):
+            tracker.keep(kept)
+            eslog.info(f"leaving handed off processes running: {sorted(kept)}")
+        result = teardown(tracker, deadline, reaped)
+        tracker.remove()
+        SUPERVISOR_STATE.unlink(missing_ok=True)
+
+    if exit_code is None:
+        exit_code = reaped.get(child.pid, 0) if child is not None else 1
+    if exit_code < 0:
+        # killed by a signal, as a shell would report it
+        exit_code = 128 - exit_code
+    eslog.info(f"{name} stopped ({reason}) in {result['latency_ms']} ms, {result['killed']} killed")
+    _record_exit({
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "name": name,
+        "reason": reason,
+        "exit_code": exit_code,
+        "tracker": tracker.kind,
+        **result,
+    })
+    if after:
+        # still ignoring signals, an exit hook syncing saves is not cut short either
+        with tracing.span("supervisor.after", name=name):
+            try:
+                subprocess.run(shlex.split(after), stdin=subprocess.DEVNULL, check=False)
+            except OSError as e:
+                eslog.warning(f"unable to run the exit hook of {name}: {e}")
+    return exit_code
+
+
+def stop(timeout: float | None = None) -> bool:
+    """Ask the running supervisor to tear its emulator down, False when none is running."""
+    try:
+        with SUPERVISOR_STATE.open() as fp:
+            pid = json.load(fp)["pid"]
+    except (OSError, ValueError, KeyError):
+        return False
+    if not _signal(pid, signal.SIGTERM):
+        SUPERVISOR_STATE.unlink(missing_ok=True)
+        return False
+
+    until = time.monotonic() + (timeout if timeout is not None else _deadline() + KILL_GRACE + 1)
+    try:
+        fd = os.pidfd_open(pid)
+    except OSError:
+        return True
+    try:
+        select.select([fd], [], [], max(0.0, until - time.monotonic()))
+    finally:
+        os.close(fd)
+    return True
+
+
+def recent_exits(count: int = 20) -> list[dict[str, Any]]:
+    try:
+        lines = EXIT_LOG.read_text().splitlines()
+    except OSError:
+        return []
+    exits = []
+    for line in lines[-count:]:
+        try:
+            exits.append(json.loads(line))
+        except ValueError:
+            continue
+    return exits
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    import statistics
+
+    parser = argparse.ArgumentParser(prog="dcg.supervisor", description="Run an emulator and reliably stop its whole process tree.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    run_parser = sub.add_parser("run", help="run a command under supervision")
+    run_parser.add_argument("--name", required=True, help="emulator name, for the cgroup and the exit log")
+    run_parser.add_argument("--deadline", type=float, default=None, help=f"seconds before SIGKILL, default {DEADLINE_KEY} or {DEFAULT_DEADLINE}")
+    run_parser.add_argument("--after", default=None, help="command line to run once the emulator tree is gone")
+    run_parser.add_argument("command", nargs=argparse.REMAINDER)
+    stop_parser = sub.add_parser("stop", help="stop the supervised emulator")
+    stop_parser.add_argument("--timeout", type=float, default=None, help="seconds to wait for it to be gone")
+    sub.add_parser("status", help="show the running emulator and recent exit latencies")
+    args = parser.parse_args(argv)
+
+    if args.action == "run":
+        command = args.command[1:] if args.command[:1] == ["--"] else args.command
+        if not command:
+            parser.error("run needs a command")
+        return run(args.name, command, _deadline() if args.deadline is None else args.deadline, args.after)
+
+    if args.action == "stop":
+        return 0 if stop(args.timeout) else 1
+
+    try:
+        with SUPERVISOR_STATE.open() as fp:
+            state = json.load(fp)
+        print(f"running: {state['name']} (supervisor {state['pid']}, {state['tracker']}) for {time.time() - state['started']:.0f}s")
+    except (OSError, ValueError, KeyError):
+        print("running: nothing")
+    exits = recent_exits()
+    for entry in exits:
+        print(f"{entry['time']}  {entry['name']:<8} {entry['reason']:<8} {entry['latency_ms']:8.1f} ms  "
+              f"{entry['processes']} processes, {entry['killed']} killed")
+    if exits:
+        print(f"median exit latency: {statistics.median(e['latency_ms'] for e in exits):.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Final, NamedTuple
+
+from dcg import tracing
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Setup task graphs
+#
+# A generator declares its setup steps and the steps each one needs, and
+# run() starts every step on a thread pool as soon as what it needs is
+# done. Writing configs, stat()ing prefixes and waiting on wine release
+# the GIL, so independent steps overlap and a launch only waits for its
+# longest chain of dependent steps. When a step fails, the steps that
+# need it never start and run() raises the step's own exception once the
+# running steps are done. With SERIAL_ENV=1 the steps run one after the
+# other in the order they were added, for debugging.
+#
+# A thread can't be interrupted: a step given a timeout bounds its own
+# waits with remaining() and kills what it started once that runs out.
+# The workers are daemon threads, so a step stuck anyway never keeps the
+# launcher from exiting.
+# ------------------------------------------------------------
+
+SERIAL_ENV: Final = "DCG_SERIAL_SETUP"
+MAX_WORKERS: Final = 4
+
+# last run of each graph by name: wall time, time of each step, their sum and the critical path
+last_runs: dict[str, dict[str, Any]] = {}
+
+# deadline of the step running in this thread
+_current = threading.local()
+
+
+class StepTimeout(TimeoutError):
+    """A setup step ran past its timeout, the launch stops waiting for it."""
+
+
+def remaining() -> float | None:
+    """Seconds left to the step running in this thread before its timeout, None when it has none."""
+    deadline = getattr(_current, "deadline", None)
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class _Step(NamedTuple):
+    name: str
+    fn: Callable[[], Any]
+    after: tuple[str, ...]
+    timeout: float | None
+
+
+class TaskGraph:
+    def __init__(self, name: str, workers: int = MAX_WORKERS) -> None:
+        self.name = name
+        self.workers = workers
+        self._steps: dict[str, _Step] = {}
+        # results by step name, those of its dependencies are there when a step starts
+        self.results: dict[str, Any] = {}
+        self._durations: dict[str, float] = {}
+
+    def add(self, name: str, fn: Callable[[], Any], after: Iterable[str] = (), timeout: float | None = None) -> None:
+        """Declare a step, after naming the steps added before it that it needs."""
+        after = tuple(after)
+        if name in self._steps:
+            raise ValueError(f"{self.name}: step {name} is declared twice")
+        if missing := [dep for dep in after if dep not in self._steps]:
+            raise ValueError(f"{self.name}: {name} needs undeclared steps {missing}")
+        self._steps[name] = _Step(name, fn, after, timeout)
+
+    def run(self, serial: bool | None = None) -> dict[str, Any]:
+        """Run every step, the result of each by name."""
+        if serial is None:
+            serial = os.environ.get(SERIAL_ENV) == "1"
+        self.results = {}
+        self._durations = {}
+        start = time.perf_counter()
+        try:
+            return self._run_serial() if serial else self._run_parallel()
+        finally:
+            self._record((time.perf_counter() - start) * 1000, serial)
+
+    def _call(self, step: _Step, deadline: float | None) -> Any:
+        start = time.perf_counter()
+        _current.deadline = deadline
+        try:
+            with tracing.span(f"{self.name}.{step.name}"):
+                return step.fn()
+        finally:
+            _current.deadline = None
+            self._durations[step.name] = (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _deadline(step: _Step) -> float | None:
+        return time.monotonic() + step.timeout if step.timeout is not None else None
+
+    def _timeout(self, step: _Step) -> StepTimeout:
+        return StepTimeout(f"{self.name}: {step.name} did not finish within {step.timeout:g}s")
+
+    def _run_serial(self) -> dict[str, Any]:
+        results = self.results
+        for step in self._steps.values():
+            results[step.name] = self._call(step, self._deadline(step))
+            if step.timeout is not None and self._durations[step.name] > step.timeout * 1000:
+                raise self._timeout(step)
+        return results
+
+    def _work(self, ready: queue.SimpleQueue[Any], done: queue.SimpleQueue[Any], closed: threading.Event) -> None:
+        while (item := ready.get()) is not None and not closed.is_set():
+            step, deadline = item
+            try:
+                done.put((step, self._call(step, deadline), None))
+            except BaseException as e:
+                done.put((step, None, e))
+
+    def _run_parallel(self) -> dict[str, Any]:
+        results = self.results
+        pending = dict(self._steps)
+        # deadline of each step handed to the workers, by name
+        running: dict[str, float | None] = {}
+        error: BaseException | None = None
+        ready: queue.SimpleQueue[Any] = queue.SimpleQueue()
+        done: queue.SimpleQueue[Any] = queue.SimpleQueue()
+        closed = threading.Event()
+        workers = max(1, min(self.workers, len(pending)))
+        for i in range(workers):
+            threading.Thread(target=self._work, args=(ready, done, closed), name=f"dcg-{self.name}-{i}", daemon=True).start()
+        try:
+            while True:
+                if error is None:
+                    for step in [step for step in pending.values() if all(dep in results for dep in step.after)]:
+                        del pending[step.name]
+                        running[step.name] = self._deadline(step)
+                        ready.put((step, running[step.name]))
+                if not running:
+                    break
+
+                deadlines = [deadline for deadline in running.values() if deadline is not None]
+                try:
+                    step, result, exc = done.get(timeout=max(0.0, min(deadlines) - time.monotonic()) if deadlines else None)
+                except queue.Empty:
+                    pass
+                else:
+                    # a step that timed out is no longer waited for, whatever it ends with
+                    if step.name in running:
+                        del running[step.name]
+                        if exc is None:
+                            results[step.name] = result
+                        else:
+                            eslog.debug(f"{self.name}: {step.name} failed", exc_info=exc)
+                            error = error or exc
+
+                now = time.monotonic()
+                for name, deadline in list(running.items()):
+                    if deadline is not None and now >= deadline:
+                        del running[name]
+                        error = error or self._timeout(self._steps[name])
+        finally:
+            # steps still queued never start, idle workers exit
+            closed.set()
+            for _ in range(workers):
+                ready.put(None)
+        if error is not None:
+            raise error
+        return results
+
+    def _record(self, wall_ms: float, serial: bool) -> None:
+        finish: dict[str, float] = {}
+        for step in self._steps.values():
+            if step.name in self._durations:
+                finish[step.name] = self._durations[step.name] + max((finish.get(dep, 0.0) for dep in step.after), default=0.0)
+        last_runs[self.name] = {
+            "serial": serial,
+            "wall_ms": round(wall_ms, 3),
+            "steps": {name: round(ms, 3) for name, ms in self._durations.items()},
+            "total_ms": round(sum(self._durations.values()), 3),
+            "critical_ms": round(max(finish.values(), default=0.0), 3),
+        }
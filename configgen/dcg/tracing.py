@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Any, Final
+
+from dcg.paths import DCG_HOME, SYSTEM
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+# ------------------------------------------------------------
+# Launch tracing
+#
+# Spans are recorded as Chrome trace events ("X" complete events, in
+# microseconds) and written as one JSON file per launch, loadable in
+# chrome://tracing or ui.perfetto.dev. batocera-wine and any dcg helper
+# started during the launch append their events to DCG_TRACE_FILE, which
+# is merged into the launch trace when the launcher exits. Listeners get
+# the name and duration of every span of this process, traced or not.
+# ------------------------------------------------------------
+
+TRACE_DIR: Final = SYSTEM / "logs" / "dcg-traces"
+TRACE_FLAG: Final = DCG_HOME / "trace.enabled"
+TRACE_ENV: Final = "DCG_TRACE_FILE"
+KEEP_TRACES: Final = 50
+
+# monotonic clock, shifted onto the wall clock bash's EPOCHREALTIME uses
+_EPOCH_NS: Final = time.time_ns() - time.monotonic_ns()
+
+_NOOP: Final = nullcontext()
+
+_events: list[dict[str, Any]] = []
+_listeners: list[Callable[[str, float], None]] = []
+_enabled = False
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict[str, Any]) -> None:
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> _Span:
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        end = time.monotonic_ns()
+        for listener in _listeners:
+            listener(self.name, (end - self.start) / 1e6)
+        if not _enabled:
+            return
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start + _EPOCH_NS) // 1000,
+            "dur": (end - self.start) // 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+        }
+        if self.args:
+            event["args"] = self.args
+        _events.append(event)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def add_listener(listener: Callable[[str, float], None]) -> None:
+    """Call listener(name, ms) as each span of this process ends, even with tracing off."""
+    _listeners.append(listener)
+
+
+def span(name: str, **args: Any) -> Any:
+    """Context manager timing one launch phase, a shared no-op when tracing is off and nobody listens."""
+    return _Span(name, args) if _enabled or _listeners else _NOOP
+
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled and not _listeners:
+                return fn(*args, **kwargs)
+            with _Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ------------------------------------------------------------
+# Trace files
+# ------------------------------------------------------------
+
+def _append_events() -> None:
+    """Child process of a traced launch: hand our events to the launch trace."""
+    if not _events:
+        return
+    with open(os.environ[TRACE_ENV], "a") as fp:
+        fp.write("".join(json.dumps(event) + "\n" for event in _events))
+
+
+def _write_trace() -> None:
+    events_file = os.environ[TRACE_ENV]
+    events = list(_events)
+    try:
+        with open(events_file) as fp:
+            events.extend(json.loads(line) for line in fp if line.strip())
+        os.unlink(events_file)
+    except (OSError, ValueError):
+        pass
+
+    trace = events_file.removesuffix(".events") + ".json"
+    with open(trace, "w") as fp:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+    for old in sorted(TRACE_DIR.glob("*.json"))[:-KEEP_TRACES]:
+        old.unlink(missing_ok=True)
+
+
+def _start() -> None:
+    global _enabled
+    if os.environ.get(TRACE_ENV):
+        _enabled = True
+        atexit.register(_append_events)
+        return
+
+    if os.environ.get("DCG_TRACE") != "1" and not TRACE_FLAG.exists():
+        return
+
+    try:
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    os.environ[TRACE_ENV] = str(TRACE_DIR / f"{stamp}-{os.getpid()}.events")
+    _enabled = True
+    atexit.register(_write_trace)
+
+
+_start()
@@ -0,0 +1,501 @@
+from __future__ import annotations
+
+import fcntl
+import fnmatch
+import hashlib
+import http.client
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Final
+
+from dcg import batoceraSettings, tracing
+from dcg.materialize import atomic_write
+from dcg.paths import BATOCERA_CONF, DCG_HOME, SYSTEM
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Incremental updater
+#
+# A release publishes manifest.json next to its files: every path of the
+# installed tree with its sha256, size and mode. On main it is written by
+# .github/workflows/manifest.yml after each push. Files that are not hosted
+# with the others carry their own url (the Play! AppImage), files shipped
+# inside an archive name it (demul.exe in demul.tar.gz). An update compares
+# the manifest with the tree and downloads only what differs, in parallel
+# and resuming what an interrupted run left, into a staging directory. Once
+# everything is there and verified, the moves are written to a journal and
+# the staged files are renamed over the installed ones; a run interrupted
+# in between finishes the journal first. Configuration files changed since
+# they were installed are kept, the new version is left next to them,
+# except those the generators rewrite on every launch.
+# ------------------------------------------------------------
+
+MANIFEST: Final = "manifest.json"
+MANIFEST_VERSION: Final = 1
+
+# below the installed tree
+INSTALL_STATE: Final = ".dcg-install.json"
+UPDATE_LOCK: Final = ".dcg-update.lock"
+STAGING: Final = ".dcg-update"
+JOURNAL: Final = "journal.json"
+
+# batocera.conf key, base url of the release the manifest and files are fetched from
+URL_KEY: Final = "dcg.update.url"
+DEFAULT_URL: Final = "https://raw.githubusercontent.com/DreamerCG/dcg-launcher/main"
+
+WORKERS: Final = 4
+RETRIES: Final = 3
+RETRY_DELAY: Final = 1.0
+TIMEOUT: Final = 30
+READ_CHUNK: Final = 1024 * 1024
+
+# kept when changed locally, the release's version is written next to them
+PRESERVE: Final = ("*.ini", "*.cfg", "*.conf", "*.keys")
+# rewritten by the generators on every launch, so always changed locally: replaced, never preserved
+GENERATED: Final = ("emulators/demul/Demul.ini", "emulators/demul/gpuDX11*.ini", "emulators/demul/ReShade.ini")
+NEW_SUFFIX: Final = ".dcg-new"
+
+# left out of a published manifest
+EXCLUDE: Final = (".git", ".github", "__pycache__", "*.pyc", "benchmarks", MANIFEST)
+# archive -> folder it is unpacked into, as install.sh does
+UNPACK: Final = {"emulators/demul.tar.gz": "emulators/demul"}
+
+# installed copies install.sh makes, refreshed when their source changes
+COPIES: Final = {
+    "configs/emulationstations/": SYSTEM / "configs" / "emulationstation",
+    "configs/evmapy/": SYSTEM / "configs" / "evmapy",
+}
+ARCADE_CONF: Final = "configs/advanced-arcade.conf"
+ARCADE_SECTION: Final = ("# --- ARCADE ADVANCED CONFIG START ---", "# --- ARCADE ADVANCED CONFIG END ---")
+PLAY_APPIMAGE: Final = "emulators/play/play.AppImage"
+
+
+def _sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while data := fp.read(READ_CHUNK):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _preserved(rel: str) -> bool:
+    if any(fnmatch.fnmatch(rel, pattern) for pattern in GENERATED):
+        return False
+    return any(fnmatch.fnmatch(os.path.basename(rel), pattern) for pattern in PRESERVE)
+
+
+# ------------------------------------------------------------
+# Manifest
+# ------------------------------------------------------------
+
+def _excluded(rel: str, patterns: tuple[str, ...]) -> bool:
+    return any(fnmatch.fnmatch(rel, pattern) or any(fnmatch.fnmatch(part, pattern) for part in rel.split("/"))
+               for pattern in patterns)
+
+
+def build_manifest(tree: str | Path, exclude: tuple[str, ...] = EXCLUDE, unpack: dict[str, str] | None = None,
+                   external: dict[str, str] | None = None) -> dict[str, Any]:
+    """The manifest of a release tree, archives in unpack described by their members."""
+    import tarfile
+
+    tree = Path(tree)
+    unpack = UNPACK if unpack is None else unpack
+    external = external or {}
+    files: dict[str, dict[str, Any]] = {}
+    for root, dirs, names in os.walk(tree):
+        rel_root = os.path.relpath(root, tree).replace(os.sep, "/")
+        dirs[:] = sorted(d for d in dirs if not _excluded(os.path.normpath(f"{rel_root}/{d}"), exclude))
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.normpath(f"{rel_root}/{name}").replace(os.sep, "/")
+            if _excluded(rel, exclude) or os.path.islink(path):
+                continue
+            st = os.stat(path)
+            entry = {"sha256": _sha256(path), "size": st.st_size, "mode": st.st_mode & 0o777}
+            if rel in unpack:
+                archive = {"path": rel, **entry}
+                with tarfile.open(path) as tar:
+                    for member in tar:
+                        if not member.isfile():
+                            continue
+                        fp = tar.extractfile(member)
+                        digest = hashlib.sha256()
+                        while data := fp.read(READ_CHUNK):
+                            digest.update(data)
+                        files[f"{unpack[rel]}/{os.path.normpath(member.name)}"] = {
+                            "sha256": digest.hexdigest(), "size": member.size, "mode": member.mode & 0o777,
+                            "archive": {**archive, "member": member.name},
+                        }
+                continue
+            if rel in external:
+                entry["url"] = external[rel]
+            files[rel] = entry
+    return {"version": MANIFEST_VERSION, "generated": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "files": files}
+
+
+def fetch_manifest(base: str) -> dict[str, Any]:
+    with urllib.request.urlopen(f"{base.rstrip('/')}/{MANIFEST}", timeout=TIMEOUT) as response:
+        manifest = json.load(response)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"unsupported manifest version {manifest.get('version')}")
+    return manifest
+
+
+# ------------------------------------------------------------
+# Plan
+# ------------------------------------------------------------
+
+def _load_state(root: Path) -> dict[str, Any]:
+    try:
+        with (root / INSTALL_STATE).open() as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def _local_hash(record: dict[str, Any] | None, path: Path) -> str | None:
+    """sha256 of an installed file, from the state while its size and mtime match it."""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    if record and record.get("stamp") == [st.st_size, st.st_mtime_ns]:
+        return record["sha256"]
+    return _sha256(path)
+
+
+def plan(manifest: dict[str, Any], root: str | Path = DCG_HOME) -> dict[str, Any]:
+    """What an update to manifest does to root: fetched, preserved, removed and unchanged paths."""
+    root = Path(root)
+    installed = _load_state(root)["files"]
+    fetch, preserve, remove, unchanged = [], [], [], []
+
+    for rel, entry in sorted(manifest["files"].items()):
+        if os.path.isabs(rel) or ".." in rel.split("/"):
+            raise ValueError(f"{rel}: path outside the installed tree")
+        record = installed.get(rel)
+        local = _local_hash(record, root / rel)
+        if local == entry["sha256"]:
+            unchanged.append(rel)
+        elif local is not None and _preserved(rel) and (record is None or local != record["sha256"]):
+            # changed since it was installed, or installed before the updater knew it
+            preserve.append(rel)
+        else:
+            fetch.append(rel)
+
+    for rel, record in sorted(installed.items()):
+        if rel in manifest["files"]:
+            continue
+        local = _local_hash(record, root / rel)
+        if local is not None and (local == record["sha256"] or not _preserved(rel)):
+            remove.append(rel)
+
+    staged = {manifest["files"][rel]["sha256"]: manifest["files"][rel]["size"] for rel in fetch + preserve}
+    return {
+        "fetch": fetch, "preserve": preserve, "remove": remove, "unchanged": unchanged,
+        "bytes": sum(staged.values()),
+    }
+
+
+# ------------------------------------------------------------
+# Downloads
+# ------------------------------------------------------------
+
+def _download(url: str, sha256: str, size: int, staging: Path) -> Path:
+    """url into staging/<sha256>, resuming a partial download, verified."""
+    target = staging / sha256
+    if target.exists():
+        return target
+    part = staging / f"{sha256}.part"
+    for attempt in range(1, RETRIES + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        if offset > size:
+            part.unlink()
+            offset = 0
+        if offset < size:
+            request = urllib.request.Request(url, headers={"Range": f"bytes={offset}-"} if offset else {})
+            try:
+                with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                    # a server ignoring Range sends the whole file again
+                    resumed = offset and response.status == 206
+                    with part.open("ab" if resumed else "wb") as fp:
+                        # read1 hands over what arrived, a dropped connection keeps all of it
+                        while data := response.read1(READ_CHUNK):
+                            fp.write(data)
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == RETRIES:
+                    raise
+                eslog.warning(f"{url}: {e!r}, retrying")
+                time.sleep(RETRY_DELAY * attempt)
+                continue
+
+        received = part.stat().st_size
+        if received < size:
+            eslog.warning(f"{url}: connection closed at {received} of {size} bytes, resuming")
+            continue
+        if received == size and _sha256(part) == sha256:
+            os.replace(part, target)
+            return target
+        eslog.warning(f"{url}: checksum mismatch, downloading again")
+        part.unlink()
+    raise ValueError(f"{url}: incomplete or corrupt after {RETRIES} attempts")
+
+
+def _unpack(archive: Path, member: str, sha256: str, staging: Path) -> Path:
+    import tarfile
+
+    target = staging / sha256
+    if target.exists():
+        return target
+    with tarfile.open(archive) as tar:
+        fp = tar.extractfile(member)
+        if fp is None:
+            raise ValueError(f"{member} is not a file of {archive.name}")
+        atomic_write(target, fp.read(), sync=False)
+    if _sha256(target) != sha256:
+        target.unlink()
+        raise ValueError(f"{member} of {archive.name} does not match the manifest")
+    return target
+
+
+def stage(base: str, manifest: dict[str, Any], paths: list[str], staging: Path, jobs: int = WORKERS) -> dict[str, Path]:
+    """Download what paths need into staging, in parallel, each sha256 once."""
+    base = base.rstrip("/")
+    downloads: dict[str, tuple[str, int]] = {}
+    members: dict[str, tuple[str, str]] = {}
+    for rel in paths:
+        entry = manifest["files"][rel]
+        if archive := entry.get("archive"):
+            downloads[archive["sha256"]] = (f"{base}/{urllib.parse.quote(archive['path'])}", archive["size"])
+            members[entry["sha256"]] = (archive["sha256"], archive["member"])
+        else:
+            downloads[entry["sha256"]] = (entry.get("url") or f"{base}/{urllib.parse.quote(rel)}", entry["size"])
+
+    staging.mkdir(parents=True, exist_ok=True)
+    with tracing.span("updater.download", files=len(downloads)), ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {sha: pool.submit(_download, url, sha, size, staging) for sha, (url, size) in downloads.items()}
+        staged = {sha: future.result() for sha, future in futures.items()}
+    for sha, (archive, member) in members.items():
+        staged[sha] = _unpack(staged[archive], member, sha, staging)
+    return staged
+
+
+# ------------------------------------------------------------
+# Commit
+# ------------------------------------------------------------
+
+def _commit(root: Path, journal: dict[str, Any]) -> None:
+    """Apply a journal, again after an interruption: moves, removals, install state, then the installed copies."""
+    staging = root / STAGING
+    moves = journal["moves"]
+    last_use = {move["staged"]: i for i, move in enumerate(moves)}
+    for i, move in enumerate(moves):
+        staged, target = staging / move["staged"], root / move["target"]
+        if not staged.exists():
+            # renamed by the run that was interrupted
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if last_use[move["staged"]] == i:
+            os.replace(staged, target)
+        else:
+            tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+            shutil.copyfile(staged, tmp)
+            os.replace(tmp, target)
+        os.chmod(target, move["mode"])
+
+    for rel in journal["remove"]:
+        path = root / rel
+        path.unlink(missing_ok=True)
+        for parent in path.parents:
+            if parent == root:
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+
+    files = {}
+    for rel, sha256 in journal["files"].items():
+        try:
+            st = (root / rel).stat()
+        except OSError:
+            continue
+        # preserved files keep no stamp, they are hashed again next time
+        stamp = None if rel in journal["preserve"] else [st.st_size, st.st_mtime_ns]
+        files[rel] = {"sha256": sha256, "stamp": stamp}
+    atomic_write(root / INSTALL_STATE, json.dumps({"generated": journal["generated"], "files": files}).encode())
+
+    _install_copies(root, journal["changed"])
+    (staging / JOURNAL).unlink(missing_ok=True)
+
+
+def _install_copies(root: Path, changed: list[str]) -> None:
+    """Refresh what install.sh copies or derives from the files that changed."""
+    for rel in changed:
+        for prefix, dest in COPIES.items():
+            if rel.startswith(prefix) and (root / rel).is_file():
+                dest.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(root / rel, dest / rel[len(prefix):])
+    if ARCADE_CONF in changed:
+        _inject_arcade_conf(root / ARCADE_CONF)
+    if PLAY_APPIMAGE in changed:
+        from dcg import appImageCache
+
+        appImageCache.extract_in_background(root / PLAY_APPIMAGE)
+
+
+def _inject_arcade_conf(conf: Path) -> None:
+    """Replace the advanced arcade section of batocera.conf, as install.sh does."""
+    start, end = ARCADE_SECTION
+    try:
+        lines = BATOCERA_CONF.read_text(encoding="utf-8").splitlines()
+    except OSError as e:
+        eslog.warning(f"not updating {BATOCERA_CONF.name}: {e}")
+        return
+    kept, inside = [], False
+    for line in lines:
+        if line == start:
+            inside = True
+        elif line == end and inside:
+            inside = False
+        elif not inside:
+            kept.append(line)
+    kept += ["", start, *conf.read_text(encoding="utf-8").splitlines(), end]
+    atomic_write(BATOCERA_CONF, ("\n".join(kept) + "\n").encode())
+    batoceraSettings._settings = None
+
+
+def recover(root: str | Path = DCG_HOME) -> bool:
+    """Finish the commit an interrupted update journaled, True when there was one."""
+    root = Path(root)
+    try:
+        with (root / STAGING / JOURNAL).open() as fp:
+            journal = json.load(fp)
+    except (OSError, ValueError):
+        return False
+    eslog.info("finishing an interrupted update")
+    _commit(root, journal)
+    return True
+
+
+# ------------------------------------------------------------
+# Update
+# ------------------------------------------------------------
+
+def update(base: str | None = None, root: str | Path = DCG_HOME, jobs: int = WORKERS,
+           check_only: bool = False) -> dict[str, Any]:
+    """Bring root to the release at base, downloading only the files that differ."""
+    base = base or batoceraSettings.get(URL_KEY, default=DEFAULT_URL)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    start = time.monotonic()
+    with (root / UPDATE_LOCK).open("w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        recovered = recover(root)
+        with tracing.span("updater.manifest"):
+            manifest = fetch_manifest(base)
+        with tracing.span("updater.plan"):
+            todo = plan(manifest, root)
+        report = {k: todo[k] for k in ("fetch", "preserve", "remove")} | {
+            "unchanged": len(todo["unchanged"]), "bytes": todo["bytes"], "recovered": recovered,
+        }
+        if check_only:
+            return report
+
+        files = manifest["files"]
+        staging = root / STAGING
+        staged = stage(base, manifest, todo["fetch"] + todo["preserve"], staging, jobs)
+        moves = [
+            {"staged": staged[files[rel]["sha256"]].name, "target": rel + (NEW_SUFFIX if rel in todo["preserve"] else ""),
+             "mode": files[rel]["mode"]}
+            for rel in todo["fetch"] + todo["preserve"]
+        ]
+        journal = {
+            "generated": manifest.get("generated"),
+            "moves": moves,
+            "remove": todo["remove"],
+            "files": {rel: entry["sha256"] for rel, entry in files.items()},
+            "preserve": todo["preserve"],
+            "changed": todo["fetch"],
+        }
+        atomic_write(staging / JOURNAL, json.dumps(journal).encode())
+        with tracing.span("updater.commit", files=len(moves)):
+            _commit(root, journal)
+        shutil.rmtree(staging, ignore_errors=True)
+
+    report["seconds"] = round(time.monotonic() - start, 2)
+    return report
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def _pairs(values: list[str]) -> dict[str, str]:
+    return dict(value.split("=", 1) for value in values)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="dcg.updater", description="Update the dcg tree from a release manifest.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    for name, help_text in (("update", "download and install what changed"), ("check", "show what an update would do")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--url", default=None, help=f"release base url, default {URL_KEY} or {DEFAULT_URL}")
+        p.add_argument("--root", type=Path, default=DCG_HOME, help="installed tree")
+        p.add_argument("--jobs", type=int, default=WORKERS, help="parallel downloads")
+    p = sub.add_parser("manifest", help="write the manifest of a release tree")
+    p.add_argument("tree", type=Path)
+    p.add_argument("--output", default="-", help="manifest file, - for stdout")
+    p.add_argument("--exclude", action="append", default=[], help="also leave out this pattern (repeatable)")
+    p.add_argument("--unpack", action="append", default=[], metavar="ARCHIVE=DIR",
+                   help=f"describe an archive by its members unpacked in DIR, default {UNPACK}")
+    p.add_argument("--external", action="append", default=[], metavar="PATH=URL", help="file hosted at URL")
+    args = parser.parse_args(argv)
+
+    if args.action == "manifest":
+        manifest = build_manifest(args.tree, EXCLUDE + tuple(args.exclude), _pairs(args.unpack) or None,
+                                  _pairs(args.external))
+        data = json.dumps(manifest, indent=1, sort_keys=True) + "\n"
+        if args.output == "-":
+            sys.stdout.write(data)
+        else:
+            try:
+                with open(args.output) as fp:
+                    current = json.load(fp).get("files")
+            except (OSError, ValueError, AttributeError):
+                current = None
+            # only the generated time would differ, the published one stays
+            if current == manifest["files"]:
+                print(f"{args.output} is current", file=sys.stderr)
+                return 0
+            atomic_write(args.output, data.encode(), sync=False)
+        print(f"{len(manifest['files'])} files", file=sys.stderr)
+        return 0
+
+    try:
+        report = update(args.url, args.root, args.jobs, check_only=args.action == "check")
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        print(f"update failed: {e!r}", file=sys.stderr)
+        return 1
+    for rel in report["preserve"]:
+        print(f"kept {rel}, the release's version is {rel}{NEW_SUFFIX}")
+    fetched, removed = ("would fetch", "remove") if args.action == "check" else ("fetched", "removed")
+    print(f"{fetched} {len(report['fetch']) + len(report['preserve'])} files ({report['bytes'] / 1048576:.1f} MiB), "
+          f"{removed} {len(report['remove'])}, {report['unchanged']} unchanged"
+          + (f" in {report['seconds']}s" if "seconds" in report else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import IO, Any, Final
+
+from dcg import batoceraSettings, launchHistory, tracing
+from dcg.materialize import atomic_write
+from dcg.paths import WINE_BOTTLES
+
+eslog = logging.getLogger(__name__)
+
+# kept inside each extracted prefix, its mtime is when the game was last launched
+EXTRACT_MANIFEST: Final = ".dcg-extract.pickle"
+EXTRACT_VERSION: Final = 1
+
+# batocera.conf key, GiB all extracted .wtgz prefixes below wine-bottles may take, 0 for no limit;
+# opt-in, eviction only ever removes files the archive can bring back
+BUDGET_KEY: Final = "windows.winetgz.cache"
+DEFAULT_BUDGET_GB: Final = 0
+
+READ_CHUNK: Final = 1024 * 1024
+
+# archive magic -> decompressors to try, multi-threaded ones first
+DECOMPRESSORS: Final = (
+    (b"\x1f\x8b", (["pigz", "-dc"], ["gzip", "-dc"])),
+    (b"\x28\xb5\x2f\xfd", (["zstd", "-dcq", "-T0"],)),
+    (b"\xfd7zXZ\x00", (["xz", "-dc", "-T0"],)),
+    (b"BZh", (["lbzip2", "-dc"], ["pbzip2", "-dc"], ["bzip2", "-dc"])),
+)
+
+
+# ------------------------------------------------------------
+# Archive stream
+# ------------------------------------------------------------
+
+class _HashingReader:
+    """File wrapper hashing everything read through it."""
+
+    def __init__(self, fp: IO[bytes]) -> None:
+        self.fp = fp
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fp.read(size)
+        self.sha256.update(data)
+        return data
+
+    def drain(self) -> None:
+        while self.read(READ_CHUNK):
+            pass
+
+
+def decompressor(archive: str | Path) -> list[str] | None:
+    """The fastest installed decompressor for archive, None for plain tar or when none is installed."""
+    with open(archive, "rb") as fp:
+        magic = fp.read(6)
+    for prefix, commands in DECOMPRESSORS:
+        if magic.startswith(prefix):
+            for command in commands:
+                if shutil.which(command[0]):
+                    return command
+            return None
+    return None
+
+
+def _pump(reader: _HashingReader, sink: IO[bytes]) -> None:
+    try:
+        while data := reader.read(READ_CHUNK):
+            sink.write(data)
+    except BrokenPipeError:
+        # the decompressor died, tarfile reports the truncated stream
+        pass
+    finally:
+        try:
+            sink.close()
+        except BrokenPipeError:
+            pass
+
+
+# ------------------------------------------------------------
+# Extraction
+# ------------------------------------------------------------
+
+def _record(member: tarfile.TarInfo) -> tuple[Any, ...]:
+    return (member.type, member.size, int(member.mtime), member.mode, member.linkname)
+
+
+def _on_disk_matches(path: Path, record: tuple[Any, ...]) -> bool:
+    """Whether path still is what an earlier extraction wrote, not something the game changed since."""
+    kind, size, mtime, _, linkname = record
+    try:
+        st = path.lstat()
+    except OSError:
+        return False
+    if kind == tarfile.SYMTYPE:
+        return os.readlink(path) == linkname
+    return int(st.st_mtime) == mtime and st.st_size == size
+
+
+def _load_manifest(prefix: Path) -> dict[str, Any] | None:
+    try:
+        with (prefix / EXTRACT_MANIFEST).open("rb") as fp:
+            manifest = pickle.load(fp)
+        if manifest.get("version") == EXTRACT_VERSION:
+            return manifest
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    return None
+
+
+def extract(archive: str | Path, prefix: str | Path) -> dict[str, Any]:
+    """Bring prefix up to date with archive.
+
+    Nothing is read when the archive's size and mtime match the last
+    extraction. Otherwise the archive is streamed once through a parallel
+    decompressor and only the members that changed, or are missing from
+    the prefix, are written; members dropped from the archive are removed
+    unless the game modified them. Files the game created stay. A prefix
+    extracted before this cache existed, or trimmed since, is adopted as
+    is.
+    """
+    archive = Path(archive)
+    prefix = Path(prefix)
+    st = archive.stat()
+    stamp = (st.st_size, st.st_mtime_ns)
+
+    manifest = _load_manifest(prefix)
+    if manifest is not None and manifest["stamp"] == stamp:
+        os.utime(prefix / EXTRACT_MANIFEST)
+        files = sum(1 for record in manifest["members"].values() if record[0] != tarfile.DIRTYPE)
+        return {"action": "current", "written": 0, "removed": 0, "skipped": files}
+
+    # no manifest on an existing prefix: trust what is on disk, only fill in the gaps
+    previous = manifest["members"] if manifest is not None else None
+    adopting = previous is None and prefix.is_dir()
+    prefix.mkdir(parents=True, exist_ok=True)
+    filters = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+
+    members: dict[str, tuple[Any, ...]] = {}
+    written = skipped = 0
+    total = 0
+    command = decompressor(archive)
+    with tracing.span("winetgz.extract", archive=archive.name, decompressor=command[0] if command else "python"), \
+            archive.open("rb") as raw:
+        reader = _HashingReader(raw)
+        proc = pump = None
+        if command:
+            proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            pump = threading.Thread(target=_pump, args=(reader, proc.stdin), daemon=True)
+            pump.start()
+            stream: Any = proc.stdout
+        else:
+            stream = reader
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                for member in tar:
+                    name = os.path.normpath(member.name).lstrip("/")
+                    if name == "." or name.startswith("../"):
+                        continue
+                    record = _record(member)
+                    members[name] = record
+                    total += member.size
+                    target = prefix / name
+                    if member.isdir():
+                        target.mkdir(parents=True, exist_ok=True)
+                        continue
+                    exists = os.path.lexists(target)
+                    if exists and (adopting or (previous is not None and previous.get(name) == record)):
+                        skipped += 1
+                        continue
+                    if exists and not target.is_dir():
+                        target.unlink()
+                    tar.extract(member, prefix, **filters)
+                    written += 1
+        finally:
+            if proc is not None:
+                # tar stops at its end-of-archive blocks, read the padding after them so nobody blocks
+                while proc.stdout.read(READ_CHUNK):
+                    pass
+                pump.join()
+                proc.stdout.close()
+                if proc.wait() != 0:
+                    raise OSError(f"{command[0]} failed on {archive} with exit code {proc.returncode}")
+            else:
+                reader.drain()
+
+    removed = 0
+    for name in sorted(set(previous or ()) - set(members), reverse=True):
+        target = prefix / name
+        if previous[name][0] == tarfile.DIRTYPE:
+            try:
+                target.rmdir()
+                removed += 1
+            except OSError:
+                pass
+        elif _on_disk_matches(target, previous[name]):
+            target.unlink()
+            removed += 1
+
+    atomic_write(prefix / EXTRACT_MANIFEST, pickle.dumps({
+        "version": EXTRACT_VERSION,
+        "archive": os.path.abspath(archive),
+        "stamp": stamp,
+        "sha256": reader.sha256.hexdigest(),
+        "bytes": total,
+        "members": members,
+    }, protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    return {"action": "adopted" if adopting else "extracted", "written": written, "removed": removed, "skipped": skipped}
+
+
+# ------------------------------------------------------------
+# Eviction
+#
+# A prefix holds the game's saves, its config and the registry wine
+# rewrote, often their only copy, so it is never removed whole. Trimming
+# deletes the members the manifest shows the game left as extracted, and
+# the manifest, and keeps everything else: the next launch adopts what is
+# left and extracts the missing members again.
+# ------------------------------------------------------------
+
+def _budget() -> int:
+    try:
+        return max(0, int(batoceraSettings.get(BUDGET_KEY, default=str(DEFAULT_BUDGET_GB)))) * 1024 ** 3
+    except ValueError:
+        eslog.warning(f"ignoring {BUDGET_KEY}, not a number")
+        return DEFAULT_BUDGET_GB * 1024 ** 3
+
+
+def list_prefixes() -> list[dict[str, Any]]:
+    """Extracted .wtgz prefixes below wine-bottles, most recently launched first."""
+    prefixes = []
+    for path in WINE_BOTTLES.glob(f"*/*/{EXTRACT_MANIFEST}"):
+        manifest = _load_manifest(path.parent)
+        if manifest is None:
+            continue
+        prefixes.append({
+            "prefix": str(path.parent),
+            "archive": manifest["archive"],
+            "sha256": manifest["sha256"],
+            "bytes": manifest["bytes"],
+            "last_used": path.stat().st_mtime,
+        })
+    return sorted(prefixes, key=lambda p: p["last_used"], reverse=True)
+
+
+def _over_budget(keep: str | None = None) -> list[dict[str, Any]]:
+    budget = _budget()
+    if not budget:
+        return []
+    victims = []
+    used = 0
+    for info in list_prefixes():
+        used += info["bytes"]
+        if used > budget and info["prefix"] != keep:
+            victims.append(info)
+    return victims
+
+
+def trim_prefix(prefix: str | Path) -> int:
+    """Delete the members of prefix that are as extracted, and its manifest; how many bytes that freed."""
+    prefix = Path(prefix)
+    manifest = _load_manifest(prefix)
+    if manifest is None:
+        return 0
+    # first, so an interrupted trim leaves a prefix to adopt rather than one thought current
+    (prefix / EXTRACT_MANIFEST).unlink()
+
+    freed = 0
+    members = manifest["members"]
+    for name in sorted(members, reverse=True):
+        target = prefix / name
+        if members[name][0] == tarfile.DIRTYPE:
+            try:
+                target.rmdir()
+            except OSError:
+                pass
+        elif _on_disk_matches(target, members[name]):
+            target.unlink()
+            freed += members[name][1]
+    try:
+        prefix.rmdir()
+    except OSError:
+        pass
+    return freed
+
+
+def trim(keep: str | None = None) -> list[str]:
+    """Trim the least recently launched prefixes beyond the budget, keep excepted."""
+    trimmed = []
+    for info in _over_budget(keep):
+        freed = trim_prefix(info["prefix"])
+        eslog.info(f"trimmed {info['prefix']}, {freed / 1048576:.1f} MiB freed")
+        trimmed.append(info["prefix"])
+    return trimmed
+
+
+def trim_in_background(keep: str | None = None) -> None:
+    subprocess.Popen(
+        [sys.executable, "-m", "dcg.winetgzCache", "trim", *(["--keep", keep] if keep else [])],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+# ------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="dcg.winetgzCache", description="Extract .wtgz games once and keep them current.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    extract_parser = sub.add_parser("extract", help="extract or update a prefix from its archive")
+    extract_parser.add_argument("archive")
+    extract_parser.add_argument("prefix")
+    trim_parser = sub.add_parser("trim", help="trim the least recently launched prefixes beyond the budget to what the game changed")
+    trim_parser.add_argument("--keep", help="prefix never to remove")
+    sub.add_parser("status", help="show the extracted prefixes")
+    args = parser.parse_args(argv)
+
+    if args.action == "extract":
+        start = time.monotonic()
+        try:
+            result = extract(args.archive, args.prefix)
+        except (OSError, tarfile.TarError) as e:
+            print(f"unable to extract {args.archive}: {e}", file=sys.stderr)
+            return 1
+        launchHistory.cache("winetgz", result["action"] == "current")
+        print(f"{Path(args.archive).name}: {result['action']}, {result['written']} written, "
+              f"{result['removed']} removed, {result['skipped']} unchanged in {time.monotonic() - start:.1f}s")
+        if result["action"] != "current" and _over_budget(args.prefix):
+            trim_in_background(args.prefix)
+        return 0
+
+    if args.action == "trim":
+        for prefix in trim(args.keep):
+            print(f"trimmed {prefix}")
+        return 0
+
+    for info in list_prefixes():
+        age = (time.time() - info["last_used"]) / 86400
+        print(f"{Path(info['prefix']).name:<40} {info['bytes'] / 1048576:10.1f} MiB {age:6.1f} days  {info['archive']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import logging
+import pickle
+from typing import Any, Final
+
+from dcg.materialize import atomic_write
+from dcg.paths import DCG_CACHE, DCG_HOME
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Paths
+# ------------------------------------------------------------
+
+COMPAT_LIST: Final = DCG_HOME / "emulators" / "demul" / "arcade_compat.txt"
+COMPAT_CACHE: Final = DCG_CACHE / "demul" / "arcade_compat.pickle"
+
+COMPAT_VERSION: Final = 2
+
+# section of arcade_compat.txt -> (batocera rom folder the sets belong in, demul -run system)
+SECTIONS: Final = {
+    "Naomi cartridge system": ("naomi", "naomi"),
+    "Naomi GD-ROM system": ("naomi", "naomi"),
+    "Naomi Satellite system": ("naomi", "naomi"),
+    "Naomi 2 cartridge system": ("naomi2", "naomi"),
+    "Naomi 2 GD-ROM system": ("naomi2", "naomi"),
+    "Atomiswave system": ("atomiswave", "awave"),
+    "System SP": ("naomi", "naomi"),
+    "Hikaru system": ("hikaru", "hikaru"),
+    "Gaelco PVR2-based system": ("gaelco", "gaelco"),
+}
+
+# batocera system or rom folder -> demul -run system, for what the list does not cover
+FOLDER_SYSTEMS: Final = {
+    "naomi": "naomi",
+    "naomi2": "naomi",
+    "hikaru": "hikaru",
+    "gaelco": "gaelco",
+    "cave3rd": "cave3rd",
+    "dreamcast": "dc",
+    "atomiswave": "awave",
+}
+
+# gaelco won't work with the new DX11 plugin
+GPU_PLUGINS: Final = {"gaelco": "gpuDX11old.dll"}
+DEFAULT_GPU_PLUGIN: Final = "gpuDX11.dll"
+
+# systems shipping a ReShade.ini.<system> ArcCabView profile
+RESHADE_PROFILES: Final = frozenset({"gaelco", "hikaru"})
+
+COLUMNS: Final = ("players", "rotation", "control", "bios", "test", "boot", "game", "notes")
+
+_compat: dict[str, dict[str, Any]] | None = None
+
+
+# ------------------------------------------------------------
+# arcade_compat.txt
+# ------------------------------------------------------------
+
+def parse(text: str) -> dict[str, dict[str, Any]]:
+    """Rows of the compatibility table keyed by romname, with their section."""
+    games: dict[str, dict[str, Any]] = {}
+    section = None
+    for line in text.splitlines():
+        if not line.startswith("|"):
+            continue
+        cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+        if len(cells) == 1:
+            section = cells[0]
+            continue
+        if cells[0] == "romname" or len(cells) != len(COLUMNS) + 1:
+            continue
+        folder, system = SECTIONS.get(section, (None, None))
+        entry: dict[str, Any] = dict(zip(COLUMNS, cells[1:]))
+        entry.update(romname=cells[0], section=section, folder=folder, **_launch(system))
+        entry["broken"] = entry["game"] == "No"
+        games[cells[0]] = entry
+    return games
+
+
+def _launch(system: str | None) -> dict[str, Any]:
+    return {
+        "system": system,
+        "gpu": GPU_PLUGINS.get(system, DEFAULT_GPU_PLUGIN),
+        "reshade": system if system in RESHADE_PROFILES else None,
+    }
+
+
+def load() -> dict[str, dict[str, Any]]:
+    """The parsed compatibility list, reparsed only when the file changes."""
+    global _compat
+    if _compat is not None:
+        return _compat
+
+    try:
+        st = COMPAT_LIST.stat()
+    except FileNotFoundError:
+        _compat = {}
+        return _compat
+    stamp = (COMPAT_VERSION, st.st_size, st.st_mtime_ns)
+
+    try:
+        with COMPAT_CACHE.open("rb") as fp:
+            cached_stamp, compat = pickle.load(fp)
+        if cached_stamp == stamp:
+            _compat = compat
+            return _compat
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+
+    with COMPAT_LIST.open(encoding="utf-8", errors="replace") as fp:
+        _compat = parse(fp.read())
+    try:
+        atomic_write(COMPAT_CACHE, pickle.dumps((stamp, _compat), protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    except OSError as e:
+        eslog.warning(f"unable to cache {COMPAT_LIST.name}: {e}")
+    return _compat
+
+
+def lookup(romname: str) -> dict[str, Any] | None:
+    return load().get(romname)
+
+
+def resolve(romname: str, *systems: str) -> dict[str, Any] | None:
+    """How Demul runs a set: its compat entry, else the first of systems (batocera
+    system, rom folder) Demul knows. None when neither applies."""
+    if (entry := lookup(romname)) is not None and entry["system"]:
+        return entry
+    for name in systems:
+        if name in FOLDER_SYSTEMS:
+            return {"romname": romname, "broken": False, **_launch(FOLDER_SYSTEMS[name])}
+    return None
@@ -2,29 +2,62 @@
 
 from __future__ import annotations
 
-import filecmp
 import logging
 import os
-import re
-import shutil
 import subprocess
 import sys
-import json
-
 from pathlib import Path, PureWindowsPath
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Final
 
 from configgen import Command as Command
-from configgen.batoceraPaths import mkdir_if_not_exists
 from configgen.controller import generate_sdl_game_controller_config
+from configgen.exceptions import BatoceraException
 from configgen.generators.Generator import Generator
 from configgen.utils.configparser import CaseSensitiveConfigParser
+from dcg import dirSync, launchHistory, materialize, prefetch, prefixTemplates, saveSync, shaderCache, supervisor, taskGraph, tracing
+from dcg.paths import DCG_HOME, SYSTEM, WINE_BOTTLES
+
+from generators.demul import arcadeCompat
 
 if TYPE_CHECKING:
     from configgen.types import HotkeysContext
 
 eslog = logging.getLogger(__name__)
 
+# ------------------------------------------------------------
+# Paths
+# ------------------------------------------------------------
+
+DEMUL_PREFIX: Final = WINE_BOTTLES / "demul"
+DEMUL_RUNNER: Final = SYSTEM / "wine" / "custom" / "ge-custom"
+DEMUL_HOME: Final = DCG_HOME / "emulators" / "demul"
+DEMUL_CONFIG: Final = DCG_HOME / "configs" / "emulators" / "demul"
+DEMUL_CACHE: Final = SYSTEM / "cache" / "demul"
+DXVK_DIR: Final = Path("/usr/wine/dxvk")
+# memory cards and save states live in Demul's folder, which install.sh replaces,
+# they are mirrored next to the nvram folder set in Demul.ini once Demul exits
+DEMUL_SAVES: Final = saveSync.SAVES / "demul" / "demul"
+DEMUL_SAVE_DIRS: Final = ("memsaves", "sstates")
+# a wine bootstrap stuck this long on a first launch will not finish
+PREFIX_INIT_TIMEOUT: Final = 180
+
+# read ahead while the prefix and configs are prepared, roughly in load order; the rom goes after Demul
+PREFETCH_EMULATOR: Final = (
+    DEMUL_RUNNER / "bin",
+    DEMUL_RUNNER / "lib" / "wine" / "x86_64-unix",
+    DEMUL_RUNNER / "lib" / "wine" / "i386-unix",
+    DEMUL_HOME / "AutoHotkey32.exe",
+    DEMUL_HOME / "demul.exe",
+    DEMUL_HOME / "plugins",
+    DEMUL_HOME / "d3dcompiler_47.dll",
+    DEMUL_HOME / "libchd.dll",
+)
+PREFETCH_RUNNER_DLLS: Final = (
+    DEMUL_RUNNER / "lib" / "wine" / "x86_64-windows",
+    DEMUL_RUNNER / "lib" / "wine" / "i386-windows",
+)
+
+
 class DemulGenerator(Generator):
 
     def getHotkeysContext(self) -> HotkeysContext:
@@ -34,33 +67,35 @@ class DemulGenerator(Generator):
         }
 
     @staticmethod
-    def sync_directories(source_dir, dest_dir):
-        dcmp = filecmp.dircmp(source_dir, dest_dir)
-        # Files that are only in the source directory or are different
-        differing_files = dcmp.diff_files + dcmp.left_only
-        for file in differing_files:
-            src_path = os.path.join(source_dir, file)
-            dest_path = os.path.join(dest_dir, file)
-            # Copy and overwrite the files from source to destination
-            shutil.copy2(src_path, dest_path)
+    def sync_directories(source_dir, dest_dir, manifest):
+        # the manifest lives in the wine prefix and lets an unchanged launch skip the compare
+        return dirSync.sync_directories(source_dir, dest_dir, manifest)
 
+    @tracing.traced("demul.generate")
     def generate(self, system, rom, playersControllers, metadata, guns, wheels, gameResolution):
-        wineprefix = '/userdata/system/wine-bottles/demul'
+        rom = Path(rom)
 
-        winepath = '/userdata/system/wine/custom/ge-custom/'
-        wineBinary = winepath + '/bin/wine64'
+        # determine what system to define for demul, before paying for the wine prefix
+        # -run=<name>           run specified system (dc, naomi, awave, hikaru, gaelco, cave3rd)
+        with tracing.span("demul.compat"):
+            compat = arcadeCompat.resolve(rom.stem, system.name, rom.parent.name)
+        if compat is None:
+            raise BatoceraException(f"Demul does not know which system runs {rom.name}")
+        if compat["broken"]:
+            raise BatoceraException(f"{rom.stem} is not playable in Demul" + (f": {compat['notes']}" if compat.get("notes") else ""))
+        demulsystem = compat["system"]
 
+        prefetch.start("demul", [*PREFETCH_EMULATOR, rom, DXVK_DIR / "x64", DXVK_DIR / "x32", *PREFETCH_RUNNER_DLLS])
 
-        emuConfig = '/userdata/system/dcg/configs/emulators/demul'
-        emuCache = '/userdata/system/cache/demul'
-        emupath = '/userdata/system/dcg/emulators/demul'
+        wineprefix = str(DEMUL_PREFIX)
+
+        winepath = f"{DEMUL_RUNNER}/"
+        wineBinary = winepath + '/bin/wine64'
 
-        # make system directories
-        if not os.path.exists(wineprefix):
-            os.makedirs(wineprefix)
-        if not os.path.exists(emuCache):
-            os.makedirs(emuCache)
 
+        emuConfig = str(DEMUL_CONFIG)
+        emuCache = str(DEMUL_CACHE)
+        emupath = str(DEMUL_HOME)
 
         if os.path.isdir(winepath + 'lib/wine/x86_64-unix/'):
             wine_lib64_dir = winepath + 'lib/wine'
@@ -69,180 +104,211 @@ class DemulGenerator(Generator):
 
         wine_lib32_dir = winepath + 'lib/wine'
 
-        if not os.path.exists(wineprefix + "/init.done"):
+        # move to the emulator path to ensure configs are saved etc
+        # (the working directory is the whole process', it is not a setup step)
+        os.chdir(emupath)
+
+        # the setup steps below only wait for the steps they name, see dcg.taskGraph
+        setup = taskGraph.TaskGraph("demul")
+
+        # make system directories
+        def make_dirs():
+            if not os.path.exists(wineprefix):
+                os.makedirs(wineprefix)
+            if not os.path.exists(emuCache):
+                os.makedirs(emuCache)
+
+        def prefix_init():
+            launchHistory.note(runner=DEMUL_RUNNER.name)
+            prefixTemplates.remount(wineprefix)
+            prefixReady = os.path.exists(wineprefix + "/init.done")
+            launchHistory.cache("prefix", prefixReady)
+            if prefixReady:
+                return
             cmd = [ wineBinary, 'hostname']
 
             env = {"LD_LIBRARY_PATH": "/lib32:${wine_lib64_dir}", "WINEPREFIX": wineprefix, "WINEDEBUG": "-all", "DXVK_LOG_LEVEL": "none", "VKD3D_DEBUG": "none", "VKD3D_SHADER_DEBUG": "none", "WINEDLLOVERRIDES": "winegstreamer.exe=" }
             env.update(os.environ)
             env["PATH"] = "${winepath}/bin:/bin:/usr/bin"
-            eslog.debug(f"command: {str(cmd)}")
-            proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = proc.communicate()
-            exitcode = proc.returncode
-            eslog.debug(out.decode())
-            eslog.error(err.decode())
+            # clone the runner's golden prefix, only bootstrap with wine if that fails;
+            # wine is killed once the step's timeout runs out, init.done is only written after a full init
+            if not prefixTemplates.create_prefix(wineprefix, winepath, wineBinary, env, timeout=taskGraph.remaining()):
+                eslog.debug(f"command: {str(cmd)}")
+                try:
+                    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=taskGraph.remaining())
+                except subprocess.TimeoutExpired:
+                    prefixTemplates.kill_wine(winepath, env)
+                    raise
+                exitcode = proc.returncode
+                eslog.debug(proc.stdout.decode())
+                eslog.error(proc.stderr.decode())
             with open(wineprefix + "/init.done", "w") as f:
                 f.write("init")
 
         # check & copy newer dxvk files
-        self.sync_directories("/usr/wine/dxvk/x64", wineprefix + "/drive_c/windows/system32")
-        self.sync_directories("/usr/wine/dxvk/x32", wineprefix + "/drive_c/windows/syswow64")
+        def dxvk_sync():
+            placed = self.sync_directories(DXVK_DIR / "x64", wineprefix + "/drive_c/windows/system32", wineprefix + "/dxvk-x64.manifest")
+            placed += self.sync_directories(DXVK_DIR / "x32", wineprefix + "/drive_c/windows/syswow64", wineprefix + "/dxvk-x32.manifest")
+            launchHistory.cache("dxvk", placed == 0)
+
+        def demul_ini():
+            configFileName = emupath + "/Demul.ini"
+            Config = CaseSensitiveConfigParser(interpolation=None)
+            Config.optionxform = str
+
+            if os.path.exists(configFileName):
+                try:
+                    with open(configFileName, 'r', encoding='utf_8_sig') as fp:
+                        Config.read_file(fp)
+                except:
+                    pass
+
+            # add rom & bios paths to Demul.ini
+            nvram = Path("/userdata/saves/demul/demul/nvram/")
+            nvram_path_on_windows = PureWindowsPath(nvram)
+            roms0 = Path("/userdata/roms/naomi2/")
+            roms0_path_on_windows = PureWindowsPath(roms0)
+            roms1 = Path("/userdata/bios/")
+            roms1_path_on_windows = PureWindowsPath(roms1)
+            roms2 = Path("/userdata/roms/hikaru")
+            roms2_path_on_windows = PureWindowsPath(roms2)
+            roms3 = Path("/userdata/roms/gaelco")
+            roms3_path_on_windows = PureWindowsPath(roms3)
+            roms4 = Path("/userdata/roms/cave3rd")
+            roms4_path_on_windows = PureWindowsPath(roms4)
+            roms5 = Path("/userdata/roms/dreamcast")
+            roms5_path_on_windows = PureWindowsPath(roms5)
+            roms6 = Path("/userdata/roms/atomiswave")
+            roms6_path_on_windows = PureWindowsPath(roms6)
+            roms7 = Path("/userdata/roms/naomi")
+            roms7_path_on_windows = PureWindowsPath(roms7)
+            plugins = Path(emupath + "/plugins/")
+            plugins_path_on_windows = PureWindowsPath(plugins)
+
+            if not Config.has_section("files"):
+                Config.add_section("files")
+            Config.set("files", "nvram", f"Z:{nvram_path_on_windows}")
+            Config.set("files", "roms0", f"Z:{roms0_path_on_windows}")
+            Config.set("files", "romsPathsCount", "8")
+            Config.set("files", "roms1", f"Z:{roms1_path_on_windows}")
+            Config.set("files", "roms2", f"Z:{roms2_path_on_windows}")
+            Config.set("files", "roms3", f"Z:{roms3_path_on_windows}")
+            Config.set("files", "roms4", f"Z:{roms4_path_on_windows}")
+            Config.set("files", "roms5", f"Z:{roms5_path_on_windows}")
+            Config.set("files", "roms6", f"Z:{roms6_path_on_windows}")
+            Config.set("files", "roms7", f"Z:{roms7_path_on_windows}")
+
+            if not Config.has_section("plugins"):
+                Config.add_section("plugins")
+            Config.set("plugins", "directory", f"Z:{plugins_path_on_windows}")
+            Config.set("plugins", "spu", "spuDemul.dll")
+            Config.set("plugins", "pad", "padDemul.dll")
+            Config.set("plugins", "net", "netDemul.dll")
+            Config.set("plugins", "gpu", compat["gpu"])
+
+            # dreamcast needs the full path & cdi or gdi image extensions
+            # check if we need to change the gdr plugin.
+            # demul supports zip & 7zip romset extensions
+            if demulsystem == "dc" and rom.suffix.lower() == ".chd":
+                Config.set("plugins", "gdr", "gdrCHD.dll")
+            else:
+                Config.set("plugins", "gdr", "gdrImage.dll")
 
-        # determine what system to define for demul
-        # -run=<name>           run specified system (dc, naomi, awave, hikaru, gaelco, cave3rd)
-        if "naomi" in str(rom):
-            demulsystem = "naomi"
-        elif "hikaru" in str(rom):
-            demulsystem = "hikaru"
-        elif "gaelco" in str(rom):
-            demulsystem = "gaelco"
-        elif "cave3rd" in str(rom):
-            demulsystem = "cave3rd"
-        elif "dreamcast" in str(rom):
-            demulsystem = "dc"
-        elif "atomiswave" in str(rom):
-            demulsystem = "awave"
+            with tracing.span("demul.write_ini", file="Demul.ini"):
+                materialize.write_if_changed(configFileName, materialize.render_ini(Config))
 
-        # remove the rom path & extension to simplify the rom name when needed
-        # -rom=<romname>        run specified system rom from the rom path defined in Demul.ini
-        # or -image=<full image path> for dreamcast
-        romname = rom.name
+        # adjust fullscreen & resolution to gpuDX11.ini
+        def gpu_ini():
+            configFileName = emupath + "/" + compat["gpu"].replace(".dll", ".ini")
+
+            Config = CaseSensitiveConfigParser(interpolation=None)
+            Config.optionxform = str
+            if os.path.exists(configFileName):
+                try:
+                    with open(configFileName, 'r', encoding='utf_8_sig') as fp:
+                        Config.read_file(fp)
+                except:
+                    pass
+
+            # set to be always fullscreen
+            if not Config.has_section("main"):
+                Config.add_section("main")
+            Config.set("main","UseFullscreen", "0")
+            # set resolution
+            if not Config.has_section("resolution"):
+                Config.add_section("resolution")
+            # force 640x480 on gaelco
+            if demulsystem == "gaelco":
+                Config.set("resolution", "Width", "640")
+                Config.set("resolution", "Height", "480")
+            else:
+                Config.set("resolution", "Width", str(gameResolution["width"]))
+                Config.set("resolution", "Height", str(gameResolution["height"]))
 
-        # move to the emulator path to ensure configs are saved etc
-        os.chdir(emupath)
-        configFileName = emupath + "/Demul.ini"
-        Config = CaseSensitiveConfigParser(interpolation=None)
-        Config.optionxform = str
-
-        if os.path.exists(configFileName):
-            try:
-                with open(configFileName, 'r', encoding='utf_8_sig') as fp:
-                    Config.read_file(fp)
-            except:
-                pass
-
-        # add rom & bios paths to Demul.ini
-        nvram = Path("/userdata/saves/demul/demul/nvram/")
-        nvram_path_on_windows = PureWindowsPath(nvram)
-        roms0 = Path("/userdata/roms/naomi2/")
-        roms0_path_on_windows = PureWindowsPath(roms0)
-        roms1 = Path("/userdata/bios/")
-        roms1_path_on_windows = PureWindowsPath(roms1)
-        roms2 = Path("/userdata/roms/hikaru")
-        roms2_path_on_windows = PureWindowsPath(roms2)
-        roms3 = Path("/userdata/roms/gaelco")
-        roms3_path_on_windows = PureWindowsPath(roms3)
-        roms4 = Path("/userdata/roms/cave3rd")
-        roms4_path_on_windows = PureWindowsPath(roms4)
-        roms5 = Path("/userdata/roms/dreamcast")
-        roms5_path_on_windows = PureWindowsPath(roms5)
-        roms6 = Path("/userdata/roms/atomiswave")
-        roms6_path_on_windows = PureWindowsPath(roms6)
-        roms7 = Path("/userdata/roms/naomi")
-        roms7_path_on_windows = PureWindowsPath(roms7)
-        plugins = Path(emupath + "/plugins/")
-        plugins_path_on_windows = PureWindowsPath(plugins)
-
-        if not Config.has_section("files"):
-            Config.add_section("files")
-        Config.set("files", "nvram", f"Z:{nvram_path_on_windows}")
-        Config.set("files", "roms0", f"Z:{roms0_path_on_windows}")
-        Config.set("files", "romsPathsCount", "8")
-        Config.set("files", "roms1", f"Z:{roms1_path_on_windows}")
-        Config.set("files", "roms2", f"Z:{roms2_path_on_windows}")
-        Config.set("files", "roms3", f"Z:{roms3_path_on_windows}")
-        Config.set("files", "roms4", f"Z:{roms4_path_on_windows}")
-        Config.set("files", "roms5", f"Z:{roms5_path_on_windows}")
-        Config.set("files", "roms6", f"Z:{roms6_path_on_windows}")
-        Config.set("files", "roms7", f"Z:{roms7_path_on_windows}")
-
-        if not Config.has_section("plugins"):
-            Config.add_section("plugins")
-        Config.set("plugins", "directory", f"Z:{plugins_path_on_windows}")
-        Config.set("plugins", "spu", "spuDemul.dll")
-        Config.set("plugins", "pad", "padDemul.dll")
-        Config.set("plugins", "net", "netDemul.dll")
-        # gaelco won't work with the new DX11 plugin
-        if demulsystem == "gaelco":
-            Config.set("plugins", "gpu", "gpuDX11old.dll")
-        else:
-            Config.set("plugins", "gpu", "gpuDX11.dll")
+            # now set the batocera options
+            if system.isOptSet("demulRatio"):
+                Config.set("main", "aspect", format(system.config["demulRatio"]))
+            else:
+                Config.set("main", "aspect", "1")
 
-        # dreamcast needs the full path & cdi or gdi image extensions
-        # check if we need to change the gdr plugin.
-        if demulsystem == "dc":
-            if ".chd" in rom:
-                Config.set("plugins", "gdr", "gdrCHD.dll")
+            if system.isOptSet("demulVSync"):
+                Config.set("main", "Vsync", format(system.config["demulVSync"]))
             else:
-                Config.set("plugins", "gdr", "gdrImage.dll")
-        # demul supports zip & 7zip romset extensions
-        elif ".zip" in romname:
-            smplromname = romname.replace(".zip", "")
-            Config.set("plugins", "gdr", "gdrImage.dll")
-        elif ".7z" in romname:
-            smplromname = romname.replace(".7z", "")
-            Config.set("plugins", "gdr", "gdrImage.dll")
+                Config.set("main", "Vsync", "0")
+
+            with tracing.span("demul.write_ini", file=os.path.basename(configFileName)):
+                materialize.write_if_changed(configFileName, materialize.render_ini(Config))
+
+        # copy system reshade config, systems without a profile keep the current one
+        def reshade():
+            if compat["reshade"]:
+                materialize.copy_if_changed(emupath + "/ReShade.ini." + compat["reshade"], emupath + "/ReShade.ini")
+
+        # per-game DXVK and VKD3D caches, they only stay valid for this runner and DXVK build
+        def shader_cache():
+            return shaderCache.environment("demul", rom.stem, DEMUL_RUNNER.name, [DXVK_DIR / "x64" / "d3d11.dll"])
+
+        # saves mirrored by an earlier launch come back into a reinstalled Demul
+        def seed_saves():
+            for folder in DEMUL_SAVE_DIRS:
+                saveSync.seed(DEMUL_SAVES / folder, DEMUL_HOME / folder)
+
+        def controllers():
+            return generate_sdl_game_controller_config(playersControllers)
+
+        setup.add("dirs", make_dirs)
+        setup.add("prefix_init", prefix_init, after=["dirs"], timeout=PREFIX_INIT_TIMEOUT)
+        setup.add("dxvk_sync", dxvk_sync, after=["prefix_init"])
+        setup.add("demul_ini", demul_ini)
+        setup.add("gpu_ini", gpu_ini)
+        setup.add("reshade", reshade)
+        setup.add("shader_cache", shader_cache)
+        setup.add("seed_saves", seed_saves)
+        setup.add("controllers", controllers)
+        results = setup.run()
 
-        with open(configFileName, 'w', encoding='utf_8_sig') as configfile:
-            Config.write(configfile)
+        # remove the rom path & extension to simplify the rom name when needed
+        # -rom=<romname>        run specified system rom from the rom path defined in Demul.ini
+        # or -image=<full image path> for dreamcast
+        smplromname = rom.stem
 
         # add the windows rom path if dreamcast
         if demulsystem == "dc":
             dcrom_windows = PureWindowsPath(rom)
             # add Z:
-            dcpath = f"Z:{dcrom_windows}"
-
-        # adjust fullscreen & resolution to gpuDX11.ini
-        if demulsystem == "gaelco":
-            configFileName = emupath + "/gpuDX11old.ini"
-        else:
-           configFileName = emupath + "/gpuDX11.ini"
-
-        Config = CaseSensitiveConfigParser(interpolation=None)
-        Config.optionxform = str
-        if os.path.exists(configFileName):
-            try:
-                with open(configFileName, 'r', encoding='utf_8_sig') as fp:
-                    Config.read_file(fp)
-            except:
-                pass
-
-        # set to be always fullscreen
-        if not Config.has_section("main"):
-            Config.add_section("main")
-        Config.set("main","UseFullscreen", "0")
-        # set resolution
-        if not Config.has_section("resolution"):
-            Config.add_section("resolution")
-        # force 640x480 on gaelco
-        if demulsystem == "gaelco":
-            Config.set("resolution", "Width", "640")
-            Config.set("resolution", "Height", "480")
-        else:
-            Config.set("resolution", "Width", str(gameResolution["width"]))
-            Config.set("resolution", "Height", str(gameResolution["height"]))
-
-        # now set the batocera options
-        if system.isOptSet("demulRatio"):
-            Config.set("main", "aspect", format(system.config["demulRatio"]))
-        else:
-            Config.set("main", "aspect", "1")
-
-        if system.isOptSet("demulVSync"):
-            Config.set("main", "Vsync", format(system.config["demulVSync"]))
-        else:
-            Config.set("main", "Vsync", "0")
-
-        with open(configFileName, 'w', encoding='utf_8_sig') as configfile:
-            Config.write(configfile)
-
-        # copy system reshade config
+            smplromname = f"Z:{dcrom_windows}"
 
-        shutil.copy2(emupath + "/ReShade.ini." + demulsystem, emupath + "/ReShade.ini")
+        saveHook = [sys.executable, "-m", "dcg.saveSync", "exit", "--system", "demul", "--game", rom.stem, "--match", rom.stem]
+        for folder in DEMUL_SAVE_DIRS:
+            saveHook += ["--mirror", DEMUL_HOME / folder, DEMUL_SAVES / folder]
+        saveHook += [f"{folder}={DEMUL_SAVES / folder}" for folder in ("nvram", *DEMUL_SAVE_DIRS)]
 
         # now setup the command array for the emulator
 
         commandArray = [wineBinary, "explorer", f"/desktop=Wine,{gameResolution['width']}x{gameResolution['height']}", emupath + '/AutoHotkey32.exe', 'newfullscreen.ahk', demulsystem, smplromname]
+        # wine leaves wineserver and Demul.exe behind AutoHotkey, the supervisor stops them all
+        # then syncs and snapshots the game's saves
+        commandArray = supervisor.wrap("demul", commandArray, after=saveHook)
 
         environment={
                 'WINEPREFIX': wineprefix,
@@ -261,14 +327,16 @@ class DemulGenerator(Generator):
 		'VKD3D_SHADER_DEBUG': 'none',
                 'LIBGL_DRIVERS_PATH': '/usr/lib/dri',
                 'WINEESYNC': '0',
-                'SDL_GAMECONTROLLERCONFIG': generate_sdl_game_controller_config(playersControllers),
+                'SDL_GAMECONTROLLERCONFIG': results["controllers"],
                 'SDL_JOYSTICK_HIDAPI': '0',
 
 
                 # hum pw 0.2 and 0.3 are hardcoded, not nice
                 'SPA_PLUGIN_DIR': '/usr/lib/spa-0.2:/lib32/spa-0.2',
                 'PIPEWIRE_MODULE_DIR': '/usr/lib/pipewire-0.3:/lib32/pipewire-0.3',
-                'VKD3D_SHADER_CACHE_PATH': emuCache
+                'VKD3D_SHADER_CACHE_PATH': emuCache,
+                **results["shader_cache"],
+                **supervisor.SUPERVISOR_ENV
         }
         
         # ensure nvidia driver used for vulkan
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pickle
+import zipfile
+from pathlib import Path
+from typing import Any, Final
+
+from configgen.exceptions import BatoceraException
+from dcg.materialize import atomic_write
+from dcg.paths import DCG_CACHE
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Paths
+# ------------------------------------------------------------
+
+ARCADEDEFS: Final = Path(__file__).parent / "arcadedefs"
+INDEX_CACHE: Final = DCG_CACHE / "play" / "arcadedefs.pickle"
+
+INDEX_VERSION: Final = 1
+
+# arcadedef entries Play! reads from the ROM zip, and the ones that are CHD images
+ARCHIVE_KEYS: Final = ("dongle", "nand")
+DISC_KEYS: Final = ("cdvd", "dvd", "hdd")
+
+_index: dict[str, Any] | None = None
+
+
+# ------------------------------------------------------------
+# Index
+# ------------------------------------------------------------
+
+def _stamps() -> dict[str, int]:
+    with os.scandir(ARCADEDEFS) as it:
+        return {entry.name: entry.stat().st_mtime_ns for entry in it if entry.name.endswith(".arcadedef")}
+
+
+def _entry(definition: dict[str, Any], parent: dict[str, Any]) -> dict[str, Any]:
+    """What a launch needs from an arcadedef, clones inheriting what they leave out."""
+    def files(keys: tuple[str, ...]) -> list[str]:
+        return [(definition.get(key) or parent[key])["name"] for key in keys if key in definition or key in parent]
+
+    return {
+        "id": definition["id"],
+        "name": definition.get("name", definition["id"]),
+        "parent": definition.get("parent"),
+        "boot": definition.get("boot"),
+        "archive": files(ARCHIVE_KEYS),
+        "discs": files(DISC_KEYS),
+        "defaults": {**parent.get("dcgDefaults", {}), **definition.get("dcgDefaults", {})},
+    }
+
+
+def compile_index(stamps: dict[str, int] | None = None) -> dict[str, Any]:
+    """Parse every arcadedef once into a lookup table keyed by game id."""
+    if stamps is None:
+        stamps = _stamps()
+
+    definitions = {}
+    for name in stamps:
+        try:
+            with (ARCADEDEFS / name).open(encoding="utf-8") as fp:
+                definition = json.load(fp)
+        except (OSError, ValueError) as e:
+            eslog.warning(f"skipping arcadedef {name}: {e}")
+            continue
+        definitions[definition["id"]] = definition
+
+    index = {
+        "version": INDEX_VERSION,
+        "stamps": stamps,
+        "games": {
+            game_id: _entry(definition, definitions.get(definition.get("parent"), {}))
+            for game_id, definition in definitions.items()
+        },
+    }
+    try:
+        atomic_write(INDEX_CACHE, pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    except OSError as e:
+        eslog.warning(f"unable to store the arcadedef index: {e}")
+    return index
+
+
+def load_index() -> dict[str, Any]:
+    """The compiled index, rebuilt only when an arcadedef was added, removed or modified."""
+    global _index
+    if _index is not None:
+        return _index
+
+    stamps = _stamps()
+    try:
+        with INDEX_CACHE.open("rb") as fp:
+            index = pickle.load(fp)
+        if index.get("version") == INDEX_VERSION and index.get("stamps") == stamps:
+            _index = index
+            return _index
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+
+    _index = compile_index(stamps)
+    return _index
+
+
+def lookup(rom: str | Path) -> dict[str, Any] | None:
+    return load_index()["games"].get(Path(rom).stem)
+
+
+# ------------------------------------------------------------
+# Preflight
+# ------------------------------------------------------------
+
+def find_disc(rom: str | Path, game: dict[str, Any], name: str) -> Path | None:
+    """Where Play! finds a CHD of the game: the folder named after it, else after its parent."""
+    rom = Path(rom)
+    for set_name in (game["id"], game["parent"]):
+        if set_name and (path := rom.parent / set_name / name).is_file():
+            return path
+    return None
+
+
+def check_set(rom: str | Path, game: dict[str, Any]) -> list[str]:
+    """What is missing from a game's ROM set, nothing when Play! can boot it.
+
+    The dongle/NAND dumps must be in the game's zip or its parent's and the
+    CHDs in a folder named after the game or its parent, next to the zip, which
+    is where Play! looks for them.
+    """
+    rom = Path(rom)
+    sets = [game["id"]] + ([game["parent"]] if game["parent"] else [])
+    problems = []
+
+    if game["archive"]:
+        archived: set[str] = set()
+        for set_name in sets:
+            try:
+                with zipfile.ZipFile(rom.parent / f"{set_name}.zip") as archive:
+                    archived.update(Path(member).name for member in archive.namelist())
+            except FileNotFoundError:
+                continue
+            except (OSError, zipfile.BadZipFile) as e:
+                problems.append(f"unreadable ROM set {set_name}.zip ({e})")
+        zips = " or ".join(f"{set_name}.zip" for set_name in sets)
+        problems.extend(f"{name} missing from {zips}" for name in game["archive"] if name not in archived)
+
+    for name in game["discs"]:
+        if find_disc(rom, game, name) is None:
+            problems.append(f"{name} missing, expected in {rom.parent / game['id']}")
+
+    return problems
+
+
+def preflight(rom: str | Path) -> dict[str, Any] | None:
+    """Check a ROM set is complete before paying for the Play! startup; unknown games are left to Play!."""
+    game = lookup(rom)
+    if game is not None and (problems := check_set(rom, game)):
+        raise BatoceraException(f"{game['name']}: {problems[0]}")
+    return game
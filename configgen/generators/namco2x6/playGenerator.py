@@ -1,16 +1,20 @@
 from __future__ import annotations
 
 import sys
-import os
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from typing import TYPE_CHECKING, Final
 
-import evdev
-
 from configgen import Command
 from configgen.batoceraPaths import CACHE, CONFIGS, SAVES, configure_emulator, mkdir_if_not_exists
 from configgen.generators.Generator import Generator
+from dcg import appImageCache, batoceraSettings, materialize, prefetch, shaderCache, supervisor, taskGraph, tracing
+from dcg.paths import DCG_HOME
+
+from generators.namco2x6 import arcadeDefs, playInputProfiles
+
+if TYPE_CHECKING:
+    from configgen.types import HotkeysContext
 
 # ------------------------------------------------------------
 # Paths
@@ -20,6 +24,11 @@ PLAY_CONFIG: Final = CONFIGS / "play"
 PLAY_SAVES: Final = SAVES / "play"
 PLAY_CONFIG_FILE: Final = PLAY_CONFIG / "Play Data Files" / "config.xml"
 PLAY_INPUT_FILE: Final = PLAY_CONFIG / "Play Data Files" / "inputprofiles" / "default.xml"
+PLAY_APPIMAGE: Final = DCG_HOME / "emulators" / "play" / "play.AppImage"
+
+PLAY_SYSTEM: Final = "namco2x6"
+# extracting the AppImage on the first launch after an update takes a few seconds, not minutes
+RUNTIME_TIMEOUT: Final = 120
 
 
 # ------------------------------------------------------------
@@ -51,103 +60,14 @@ OVERRIDES = {
 }
 
 
-# ------------------------------------------------------------
-# Input mappings
-# ------------------------------------------------------------
-
-BASE_EVMAP = {
-    "a": [16],
-    "b": [17],
-    "x": [18],
-    "y": [19],
-    "start": [2],
-    "select": [6],
-    "pageup": [20],
-    "pagedown": [22],
-    "joystick1left": [105, 106],
-    "joystick1up": [103, 108],
-    "joystick1up_pedal": [23, 21],
-    "up": [103],
-    "down": [108],
-    "left": [105],
-    "right": [106],
-    "l2": [21],
-    "r2": [23],
-    "l3": [24],
-    "r3": [25],
-}
-
-PLAYER_OFFSET = {1: 0, 2: 14}
-
-
-def build_evmap(player: int) -> dict[str, list[int]]:
-    offset = PLAYER_OFFSET[player]
-    return {k: [v + offset for v in values] for k, values in BASE_EVMAP.items()}
-
-
-PLAY_MAPPING_BASE = {
-    "square": "y",
-    "triangle": "x",
-    "circle": "b",
-    "cross": "a",
-    "start": "start",
-    "select": "select",
-    "l2": "pageup",
-    "r2": "pagedown",
-    "analog_left_x": "joystick1left",
-    "analog_left_y": "joystick1up",
-    "dpad_up": "up",
-    "dpad_down": "down",
-    "dpad_left": "left",
-    "dpad_right": "right",
-    "l1": "l2",
-    "r1": "r2",
-    "l3": "l3",
-    "r3": "r3",
-}
-
-
-GAME_MAPPING_RULES = [
-    ("prdgp03", lambda m: (m.update({"r1": "y"}), m.pop("square", None))),
-    ("fghtjam", lambda m: m.update({"triangle": "l2", "square": "x", "r3": "y"})),
-    ("superdbz", lambda m: m.update({"square": "x", "r3": "y"})),
-    ("tekken", lambda m: m.update({"square": "x", "r3": "y"})),
-    ("acedriv3", lambda m: (
-        m.update({"analog_left_y": "joystick1up_pedal"}),
-        m.pop("l1", None),
-        m.pop("r1", None),
-    )),
-    ("wangan", lambda m: (
-        m.update({"analog_left_y": "joystick1up_pedal"}),
-        m.pop("l1", None),
-        m.pop("r1", None),
-    )),
-]
-
-
-# ------------------------------------------------------------
-# Input helpers (CRITICAL for Play standalone)
-# ------------------------------------------------------------
-
-PAD_GUID = "1:0:1:0:1:0"
-PROVIDER_ID = 1702257782
-KEY_TYPE = 0
-
-
-def add_binding(input_root, nplayer, play_key, idx, key_code):
-    base = f"input.pad{nplayer}.{play_key}.bindingtarget{idx}"
-
-    ET.SubElement(input_root, "Preference",
-        Name=f"{base}.deviceId", Type="string", Value=PAD_GUID)
-
-    ET.SubElement(input_root, "Preference",
-        Name=f"{base}.keyId", Type="integer", Value=str(key_code))
-
-    ET.SubElement(input_root, "Preference",
-        Name=f"{base}.keyType", Type="integer", Value=str(KEY_TYPE))
-
-    ET.SubElement(input_root, "Preference",
-        Name=f"{base}.providerId", Type="integer", Value=str(PROVIDER_ID))
+def resolve_option(config, rom, key):
+    """play_* option of a game: its batocera.conf entry, then the arcadedef hint, then the system setting."""
+    rom = Path(rom)
+    if (value := batoceraSettings.get(f'{PLAY_SYSTEM}["{rom.name}"].{key}')) is not None:
+        return value
+    if rom.suffix.lower() == ".zip" and (game := arcadeDefs.lookup(rom)) and key in game["defaults"]:
+        return game["defaults"][key]
+    return config.get(key)
 
 
 # ------------------------------------------------------------
@@ -159,117 +79,106 @@ class PlayGenerator(Generator):
     def getHotkeysContext(self) -> HotkeysContext:
         return {"name": "play", "keys": {"exit": ["KEY_LEFTALT", "KEY_F4"]}}
 
+    @tracing.traced("play.generate")
     def generate(self, system, rom, playersControllers, metadata, guns, wheels, gameResolution):
 
-        mkdir_if_not_exists(PLAY_CONFIG)
-        mkdir_if_not_exists(PLAY_SAVES)
+        configuring = configure_emulator(rom)
+        arcade = not configuring and rom.suffix.lower() == ".zip"
+
+        # fail before the AppImage starts if the ROM set is incomplete
+        game = None
+        if arcade:
+            with tracing.span("play.preflight"):
+                game = arcadeDefs.preflight(rom)
+
+        # the setup steps below only wait for the steps they name, see dcg.taskGraph
+        setup = taskGraph.TaskGraph("play")
+
+        # the extracted AppImage, no FUSE mount nor squashfs decompression, once it is cached
+        def runtime():
+            return appImageCache.runtime(PLAY_APPIMAGE, timeout=taskGraph.remaining())
+
+        # read Play!, the ROM and its CHDs ahead while the configs are written
+        def prefetch_game():
+            executable = setup.results["runtime"]
+            extracted = executable != PLAY_APPIMAGE
+            discs = [arcadeDefs.find_disc(rom, game, name) for name in game["discs"]] if game else []
+            prefetch.start("play", [executable.parent if extracted else executable, rom, *filter(None, discs)])
+
+        def make_dirs():
+            mkdir_if_not_exists(PLAY_CONFIG)
+            mkdir_if_not_exists(PLAY_SAVES)
 
         # -------- config.xml --------
-        if PLAY_CONFIG_FILE.exists():
-            tree = ET.parse(PLAY_CONFIG_FILE)
-            root = tree.getroot()
-        else:
-            root = ET.Element("Config")
+        def config_xml():
+            if PLAY_CONFIG_FILE.exists():
+                tree = ET.parse(PLAY_CONFIG_FILE)
+                root = tree.getroot()
+            else:
+                root = ET.Element("Config")
+
+            existing = {pref.get("Name"): pref for pref in root.iter("Preference")}
 
-        for name, attrs in PREFERENCES.items():
-            pref = root.find(f".//Preference[@Name='{name}']")
-            if pref is None:
-                pref = ET.SubElement(root, "Preference", Name=name)
+            for name, attrs in PREFERENCES.items():
+                pref = existing.get(name)
+                if pref is None:
+                    pref = ET.SubElement(root, "Preference", Name=name)
 
-            pref.attrib.update(attrs)
+                pref.attrib.update(attrs)
 
-            if override := OVERRIDES.get(name):
-                if value := system.config.get(override):
-                    pref.attrib["Value"] = value
+                if override := OVERRIDES.get(name):
+                    if value := resolve_option(system.config, rom, override):
+                        pref.attrib["Value"] = value
 
-        PLAY_CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        ET.ElementTree(root).write(PLAY_CONFIG_FILE)
+            materialize.write_if_changed(PLAY_CONFIG_FILE, materialize.render_xml(ET.ElementTree(root)))
 
         # -------- input profiles --------
-        input_root = ET.Element("Config")
-        rom_str = str(rom)
-
-        for nplayer, controller in enumerate(playersControllers[:2], start=1):
-            evmap = build_evmap(nplayer)
-            play_mapping = PLAY_MAPPING_BASE.copy()
-
-            for needle, rule in GAME_MAPPING_RULES:
-                if needle in rom_str:
-                    rule(play_mapping)
-                    break
-
-            ET.SubElement(
-                input_root,
-                "Preference",
-                Name=f"input.pad{nplayer}.analog.sensitivity",
-                Type="float",
-                Value="1.0",
-            )
-
-            for play_key, joystick_key in play_mapping.items():
-                if joystick_key not in evmap:
-                    continue
-
-                key_codes = evmap[joystick_key]
-                binding_type = 2 if len(key_codes) > 1 else 1
-
-                hat_value = -1
-                if play_key in ("dpad_up", "dpad_left"):
-                    hat_value = 4
-                elif play_key in ("dpad_down", "dpad_right"):
-                    hat_value = 0
-
-                ET.SubElement(
-                    input_root,
-                    "Preference",
-                    Name=f"input.pad{nplayer}.{play_key}.bindingtype",
-                    Type="integer",
-                    Value=str(binding_type),
-                )
-
-                ET.SubElement(
-                    input_root,
-                    "Preference",
-                    Name=f"input.pad{nplayer}.{play_key}.povhatbinding.refvalue",
-                    Type="integer",
-                    Value=str(hat_value),
-                )
-
-                for idx, key_code in enumerate(key_codes, start=1):
-                    add_binding(input_root, nplayer, play_key, idx, key_code)
-
-        PLAY_INPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-        tree = ET.ElementTree(input_root)
-        ET.indent(tree, space="    ", level=0)
-        tree.write(PLAY_INPUT_FILE)
+        def input_profile():
+            nplayers = min(len(playersControllers), playInputProfiles.MAX_PLAYERS)
+            materialize.write_if_changed(PLAY_INPUT_FILE, playInputProfiles.profile_bytes(rom, nplayers))
+
+        # the GL driver caches of this game, for this Play build
+        def shader_cache():
+            return {} if configuring else shaderCache.environment("play", rom.stem, "play", [PLAY_APPIMAGE])
+
+        setup.add("runtime", runtime, timeout=RUNTIME_TIMEOUT)
+        if not configuring:
+            setup.add("prefetch", prefetch_game, after=["runtime"])
+        setup.add("dirs", make_dirs)
+        setup.add("config_xml", config_xml, after=["dirs"])
+        setup.add("input_profile", input_profile, after=["dirs"])
+        setup.add("shader_cache", shader_cache)
+        results = setup.run()
+        executable = results["runtime"]
 
         # -------- command --------
         cmd = [
-            Path("/userdata/system/dcg/emulators/play/play.AppImage"),
+            executable,
             "--fullscreen",
         ]
 
-        if not configure_emulator(rom):
-            if rom.suffix.lower() == ".zip":
-                cmd += ["--arcade", rom.stem]
-            else:
-                cmd += ["--disc", rom]
+        if arcade:
+            cmd += ["--arcade", rom.stem]
+        elif not configuring:
+            cmd += ["--disc", rom]
 
         print(cmd, file=sys.stderr)
-         
+
         return Command.Command(
-            array=cmd,
+            array=supervisor.wrap("play", cmd),
             env={
                 "XDG_CONFIG_HOME": PLAY_CONFIG,
                 "XDG_DATA_HOME": PLAY_CONFIG,
                 "XDG_CACHE_HOME": CACHE,
                 "QT_QPA_PLATFORM": "xcb",
+                **results["shader_cache"],
+                **supervisor.SUPERVISOR_ENV,
             },
         )
 
 
     def getInGameRatio(self, config, gameResolution, rom):
-        if config.get("play_widescreen") == "true" or config.get("play_mode") == "0":
+        if resolve_option(config, rom, "play_widescreen") == "true" or resolve_option(config, rom, "play_mode") == "0":
             return 16 / 9
         return 4 / 3
 # ------------------------------------------------------------
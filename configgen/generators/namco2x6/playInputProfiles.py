@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import pickle
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, Final
+
+from dcg.materialize import atomic_write, render_xml
+from dcg.paths import DCG_CACHE
+
+eslog = logging.getLogger(__name__)
+
+# ------------------------------------------------------------
+# Paths
+# ------------------------------------------------------------
+
+ARCADEDEFS: Final = Path(__file__).parent / "arcadedefs"
+PROFILES_CACHE: Final = DCG_CACHE / "play"
+
+
+# ------------------------------------------------------------
+# Input mappings
+# ------------------------------------------------------------
+
+BASE_EVMAP = {
+    "a": [16],
+    "b": [17],
+    "x": [18],
+    "y": [19],
+    "start": [2],
+    "select": [6],
+    "pageup": [20],
+    "pagedown": [22],
+    "joystick1left": [105, 106],
+    "joystick1up": [103, 108],
+    "joystick1up_pedal": [23, 21],
+    "up": [103],
+    "down": [108],
+    "left": [105],
+    "right": [106],
+    "l2": [21],
+    "r2": [23],
+    "l3": [24],
+    "r3": [25],
+}
+
+PLAYER_OFFSET = {1: 0, 2: 14}
+
+
+def build_evmap(player: int) -> dict[str, list[int]]:
+    offset = PLAYER_OFFSET[player]
+    return {k: [v + offset for v in values] for k, values in BASE_EVMAP.items()}
+
+
+PLAY_MAPPING_BASE = {
+    "square": "y",
+    "triangle": "x",
+    "circle": "b",
+    "cross": "a",
+    "start": "start",
+    "select": "select",
+    "l2": "pageup",
+    "r2": "pagedown",
+    "analog_left_x": "joystick1left",
+    "analog_left_y": "joystick1up",
+    "dpad_up": "up",
+    "dpad_down": "down",
+    "dpad_left": "left",
+    "dpad_right": "right",
+    "l1": "l2",
+    "r1": "r2",
+    "l3": "l3",
+    "r3": "r3",
+}
+
+
+# (rom name fragment, bindings to set, bindings to drop), first match wins
+GAME_MAPPING_RULES = [
+    ("prdgp03", {"r1": "y"}, ["square"]),
+    ("fghtjam", {"triangle": "l2", "square": "x", "r3": "y"}, []),
+    ("superdbz", {"square": "x", "r3": "y"}, []),
+    ("tekken", {"square": "x", "r3": "y"}, []),
+    ("acedriv3", {"analog_left_y": "joystick1up_pedal"}, ["l1", "r1"]),
+    ("wangan", {"analog_left_y": "joystick1up_pedal"}, ["l1", "r1"]),
+]
+
+
+def game_mapping(rule: str | None) -> dict[str, str]:
+    mapping = PLAY_MAPPING_BASE.copy()
+    for needle, updates, drops in GAME_MAPPING_RULES:
+        if needle == rule:
+            mapping.update(updates)
+            for key in drops:
+                mapping.pop(key, None)
+            break
+    return mapping
+
+
+def match_rule(stem: str) -> str | None:
+    for needle, _, _ in GAME_MAPPING_RULES:
+        if needle in stem:
+            return needle
+    return None
+
+
+# ------------------------------------------------------------
+# Input helpers (CRITICAL for Play standalone)
+# ------------------------------------------------------------
+
+PAD_GUID = "1:0:1:0:1:0"
+PROVIDER_ID = 1702257782
+KEY_TYPE = 0
+
+
+def add_binding(input_root, nplayer, play_key, idx, key_code):
+    base = f"input.pad{nplayer}.{play_key}.bindingtarget{idx}"
+
+    ET.SubElement(input_root, "Preference",
+        Name=f"{base}.deviceId", Type="string", Value=PAD_GUID)
+
+    ET.SubElement(input_root, "Preference",
+        Name=f"{base}.keyId", Type="integer", Value=str(key_code))
+
+    ET.SubElement(input_root, "Preference",
+        Name=f"{base}.keyType", Type="integer", Value=str(KEY_TYPE))
+
+    ET.SubElement(input_root, "Preference",
+        Name=f"{base}.providerId", Type="integer", Value=str(PROVIDER_ID))
+
+
+def render_profile(rule: str | None, nplayers: int) -> bytes:
+    """Build inputprofiles/default.xml for a game rule and number of pads."""
+    input_root = ET.Element("Config")
+
+    for nplayer in range(1, nplayers + 1):
+        evmap = build_evmap(nplayer)
+        play_mapping = game_mapping(rule)
+
+        ET.SubElement(
+            input_root,
+            "Preference",
+            Name=f"input.pad{nplayer}.analog.sensitivity",
+            Type="float",
+            Value="1.0",
+        )
+
+        for play_key, joystick_key in play_mapping.items():
+            if joystick_key not in evmap:
+                continue
+
+            key_codes = evmap[joystick_key]
+            binding_type = 2 if len(key_codes) > 1 else 1
+
+            hat_value = -1
+            if play_key in ("dpad_up", "dpad_left"):
+                hat_value = 4
+            elif play_key in ("dpad_down", "dpad_right"):
+                hat_value = 0
+
+            ET.SubElement(
+                input_root,
+                "Preference",
+                Name=f"input.pad{nplayer}.{play_key}.bindingtype",
+                Type="integer",
+                Value=str(binding_type),
+            )
+
+            ET.SubElement(
+                input_root,
+                "Preference",
+                Name=f"input.pad{nplayer}.{play_key}.povhatbinding.refvalue",
+                Type="integer",
+                Value=str(hat_value),
+            )
+
+            for idx, key_code in enumerate(key_codes, start=1):
+                add_binding(input_root, nplayer, play_key, idx, key_code)
+
+    tree = ET.ElementTree(input_root)
+    ET.indent(tree, space="    ", level=0)
+    return render_xml(tree)
+
+
+# ------------------------------------------------------------
+# Compiled profile library
+# ------------------------------------------------------------
+
+# any change to the tables above yields a new library
+MAPPING_VERSION: Final = hashlib.sha1(json.dumps(
+    [BASE_EVMAP, PLAYER_OFFSET, PLAY_MAPPING_BASE, GAME_MAPPING_RULES, PAD_GUID, PROVIDER_ID, KEY_TYPE],
+    sort_keys=True,
+).encode()).hexdigest()[:12]
+
+MAX_PLAYERS: Final = 2
+
+_library: dict[str, Any] | None = None
+
+
+def _library_file() -> Path:
+    return PROFILES_CACHE / f"inputprofiles-{MAPPING_VERSION}.pickle"
+
+
+def _save_library(library: dict[str, Any]) -> None:
+    try:
+        atomic_write(_library_file(), pickle.dumps(library, protocol=pickle.HIGHEST_PROTOCOL), sync=False)
+    except OSError as e:
+        eslog.warning(f"unable to store the input profile library: {e}")
+
+
+def compile_library() -> dict[str, Any]:
+    """Render every (rule, player count) profile and index the known ROM stems."""
+    rules: list[str | None] = [None, *(needle for needle, _, _ in GAME_MAPPING_RULES)]
+    library = {
+        "version": MAPPING_VERSION,
+        "stems": {path.stem: match_rule(path.stem) for path in ARCADEDEFS.glob("*.arcadedef")},
+        "profiles": {
+            (rule, nplayers): render_profile(rule, nplayers)
+            for rule in rules
+            for nplayers in range(MAX_PLAYERS + 1)
+        },
+    }
+
+    for stale in PROFILES_CACHE.glob("inputprofiles-*.pickle"):
+        if stale != _library_file():
+            stale.unlink(missing_ok=True)
+    _save_library(library)
+    return library
+
+
+def load_library() -> dict[str, Any]:
+    global _library
+    if _library is None:
+        try:
+            with _library_file().open("rb") as fp:
+                _library = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            _library = None
+        if _library is None or _library.get("version") != MAPPING_VERSION:
+            _library = compile_library()
+    return _library
+
+
+def profile_bytes(rom: str | Path, nplayers: int) -> bytes:
+    """Ready-to-write inputprofiles/default.xml for rom with nplayers pads."""
+    library = load_library()
+    stem = Path(rom).stem
+
+    stems = library["stems"]
+    if stem not in stems:
+        stems[stem] = match_rule(stem)
+        _save_library(library)
+
+    return library["profiles"][(stems[stem], min(nplayers, MAX_PLAYERS))]
@@ -2,14 +2,13 @@ from __future__ import annotations
 
 import os
 import sys
-import subprocess
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 from configgen import Command
 from configgen.controller import generate_sdl_game_controller_config
-from configgen.exceptions import BatoceraException
 from configgen.generators.Generator import Generator
+from dcg import batoceraSettings, supervisor, tracing
 
 
 if TYPE_CHECKING:
@@ -24,21 +23,19 @@ class WineGenerator(Generator):
             "keys": { "exit": "/userdata/system/dcg/bin/batocera-wine windows stop" }
         }
 
+    @tracing.traced("wine.generate")
     def generate(self, system, rom, playersControllers, metadata, guns, wheels, gameResolution):
         if system.name == "windows_installers":
             commandArray = ["/userdata/system/dcg/bin/batocera-wine", "windows", "install", rom]
-            return Command.Command(array=commandArray)
+            return Command.Command(array=supervisor.wrap("wine", commandArray), env=dict(supervisor.SUPERVISOR_ENV))
 
         else:
             print("Commande : /userdata/system/dcg/bin/batocera-wine", system.name, file= sys.stderr)
             commandArray = ["/userdata/system/dcg/bin/batocera-wine", system.name, "play", rom]
 
-            environment: dict[str, str | Path] = {}
+            environment: dict[str, str | Path] = dict(supervisor.SUPERVISOR_ENV)
             #system.language
-            try:
-                language = subprocess.check_output("batocera-settings-get system.language", shell=True, text=True).strip()
-            except subprocess.CalledProcessError:
-                language = 'en_US'
+            language = batoceraSettings.get("system.language", default='en_US')
             if language:
                 environment.update({
                     "LANG": language + ".UTF-8",
@@ -66,7 +63,7 @@ class WineGenerator(Generator):
                     }
                 )
 
-            return Command.Command(array=commandArray, env=environment)
+            return Command.Command(array=supervisor.wrap("wine", commandArray), env=environment)
 
     def getMouseMode(self, config, rom):
         return config.get_bool('force_mouse')
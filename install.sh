@@ -29,50 +29,66 @@ echo "Batocera $version détectée — poursuite de l'installation."
 
 set -e
 
-# Download and Install BSA
-(
-	url="https://github.com/DreamerCG/dcg-launcher/archive/refs/heads/main.tar.gz"
-    echo $url;
-	BSA_path="/userdata/system/dcg"
-
-	# Retrieve and Extract BSA to /userdata/BSA (will overwrite)
-	temp_file=$(mktemp) || { echo "ERROR: Failed to create temp file"; exit 1; }
+DCG_PATH="/userdata/system/dcg"
+
+# Mise à jour incrémentale : seuls les fichiers changés depuis la dernière installation sont téléchargés,
+# les configurations modifiées localement sont conservées (voir dcg.updater)
+if [[ -f "$DCG_PATH/configgen/dcg/updater.py" ]] && PYTHONPATH="$DCG_PATH/configgen" python -m dcg.updater update; then
+    echo "Mise à jour incrémentale terminée."
+else
+    # Download and Install BSA
+    (
+    	url="https://github.com/DreamerCG/dcg-launcher/archive/refs/heads/main.tar.gz"
+        echo $url;
+    	BSA_path="/userdata/system/dcg"
+
+    	# Retrieve and Extract BSA to /userdata/BSA (will overwrite)
+    	temp_file=$(mktemp) || { echo "ERROR: Failed to create temp file"; exit 1; }
+        wget --quiet --show-progress --progress=bar:force:noscroll \
+            --tries=10 --timeout=30 --waitretry=3 \
+            --no-check-certificate --no-cache --no-cookies \
+            -O "$temp_file" \
+            --max-redirect=10 \
+            "$url"
+
+
+    	[[ -n "$BSA_path" ]] && rm -rf "$BSA_path"
+    	mkdir -p "$BSA_path"
+    	tar -xzf "$temp_file" -C "$BSA_path" --strip-components=1
+    	rm -f "$temp_file"
+    )
+
+    # Copier les fichiers de configuration des systèmes
+    cp -rf /userdata/system/dcg/configs/emulationstations/* /userdata/system/configs/emulationstation/
+
+    # Copier les fichiers de configuration des evmapy
+    cp -rf /userdata/system/dcg/configs/evmapy/* /userdata/system/configs/evmapy/
+
+    # Téléchargement de l'AppImage Play! (PS2 Emulator)
+    mkdir -p /userdata/system/dcg/emulators/play/
     wget --quiet --show-progress --progress=bar:force:noscroll \
         --tries=10 --timeout=30 --waitretry=3 \
         --no-check-certificate --no-cache --no-cookies \
-        -O "$temp_file" \
+        -O "/userdata/system/dcg/emulators/play/play.AppImage" \
         --max-redirect=10 \
-        "$url"
+        "https://purei.org/downloads/play/stable/0.72/Play!-8de4a71f-x86_64.AppImage"
 
 
-	[[ -n "$BSA_path" ]] && rm -rf "$BSA_path"
-	mkdir -p "$BSA_path"
-	tar -xzf "$temp_file" -C "$BSA_path" --strip-components=1
-	rm -f "$temp_file"
-)
+    # Installation de Demul/Arcabview
+    mkdir -p /userdata/system/dcg/emulators/demul/
+    tar -xzf /userdata/system/dcg/emulators/demul.tar.gz -C /userdata/system/dcg/emulators/demul/
 
-# Copier les fichiers de configuration des systèmes
-cp -rf /userdata/system/dcg/configs/emulationstations/* /userdata/system/configs/emulationstation/
+    # Applications des droits pour Play! (PS2 Emulator)
+    chmod a+x "/userdata/system/dcg/emulators/play/play.AppImage"
 
-# Copier les fichiers de configuration des evmapy
-cp -rf /userdata/system/dcg/configs/evmapy/* /userdata/system/configs/evmapy/
+    # Extraction unique de l'AppImage Play!, les lancements n'ont plus à la monter
+    PYTHONPATH=/userdata/system/dcg/configgen python -m dcg.appImageCache extract "/userdata/system/dcg/emulators/play/play.AppImage" \
+        || echo "Play! sera lancé depuis l'AppImage jusqu'à son extraction"
 
-# Téléchargement de l'AppImage Play! (PS2 Emulator)
-mkdir -p /userdata/system/dcg/emulators/play/
-wget --quiet --show-progress --progress=bar:force:noscroll \
-    --tries=10 --timeout=30 --waitretry=3 \
-    --no-check-certificate --no-cache --no-cookies \
-    -O "/userdata/system/dcg/emulators/play/play.AppImage" \
-    --max-redirect=10 \
-    "https://purei.org/downloads/play/stable/0.72/Play!-8de4a71f-x86_64.AppImage"
-
-
-# Installation de Demul/Arcabview
-mkdir -p /userdata/system/dcg/emulators/demul/
-tar -xzf /userdata/system/dcg/emulators/demul.tar.gz -C /userdata/system/dcg/emulators/demul/
-
-# Applications des droits pour Play! (PS2 Emulator)
-chmod a+x "/userdata/system/dcg/emulators/play/play.AppImage"
+    # Enregistre l'arbre installé, la prochaine mise à jour sera incrémentale
+    PYTHONPATH="$DCG_PATH/configgen" python -m dcg.updater update \
+        || echo "Pas de manifeste publié, la prochaine mise à jour sera complète"
+fi
 
 # Applications des droits des binaries de BSA
 chmod a+x "/userdata/system/dcg/bin/batocera-wine"
@@ -116,6 +132,30 @@ sed -i "/$SECTION_START/,/$SECTION_END/d" "$BATOCERA_CONF"
 echo "Injection terminée ✅"
 
 
+# BIOS des systèmes dcg : stockés une seule fois par empreinte puis liés dans /userdata/bios (voir dcg.biosStore)
+PYTHONPATH="$DCG_PATH/configgen" python -m dcg.biosStore sync || echo "BIOS manquants ou invalides, voir la liste ci-dessus"
+
+# Vérification des BIOS et des listes de jeux à chaque démarrage, sans effet quand rien n'a changé :
+# les ROMs ajoutées depuis l'installation arrivent dans gamelist.xml sans réinstaller
+CUSTOM_SH="/userdata/system/custom.sh"
+BIOS_START="# --- DCG BIOS START ---"
+BIOS_END="# --- DCG BIOS END ---"
+if [[ -f "$CUSTOM_SH" ]]; then
+    sed -i "/$BIOS_START/,/$BIOS_END/d" "$CUSTOM_SH"
+else
+    echo "#!/bin/bash" > "$CUSTOM_SH"
+fi
+{
+    echo "$BIOS_START"
+    echo '[ "$1" = "start" ] && PYTHONPATH=/userdata/system/dcg/configgen python -m dcg.biosStore sync >/dev/null 2>&1 &'
+    echo '[ "$1" = "start" ] && PYTHONPATH=/userdata/system/dcg/configgen python -m dcg.gamelistIndexer >/dev/null 2>&1 &'
+    echo "$BIOS_END"
+} >> "$CUSTOM_SH"
+chmod a+x "$CUSTOM_SH"
+
+# Listes de jeux des systèmes dcg, seuls les dossiers modifiés sont relus (voir dcg.gamelistIndexer)
+PYTHONPATH="$DCG_PATH/configgen" python -m dcg.gamelistIndexer || echo "Listes de jeux non mises à jour"
+
 echo "System Launcher Installed!"
 
 killall -9 emulationstation || true
\ No newline at end of file